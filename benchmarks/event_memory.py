@@ -0,0 +1,75 @@
+"""
+Resident bytes per realized note on a large synthetic score.
+
+Compares the __slots__ based events against the original layout where every attribute lived in a
+per-instance __dict__. The reference objects share the attribute values of the realized notes so the
+difference is the per-object overhead only.
+"""
+import argparse
+import tracemalloc
+from hewmp.event import Note
+from hewmp.parser import parse_text
+
+
+class ReferenceNote:
+    """
+    The original Note layout with its attributes in an instance __dict__
+    """
+    def __init__(self, note, names):
+        for name in names:
+            setattr(self, name, getattr(note, name))
+
+
+def slot_names(cls):
+    result = []
+    for klass in reversed(cls.__mro__):
+        for name in getattr(klass, "__slots__", ()):
+            if name not in result and name != "__weakref__":
+                result.append(name)
+    return result
+
+
+def slotted_copy(note, names):
+    result = Note.__new__(Note)
+    for name in names:
+        setattr(result, name, getattr(note, name))
+    return result
+
+
+def synthetic_score(num_notes):
+    """
+    Bars of eight notes with varying durations under a crescendo
+    """
+    bar = "P1 M2[2] m3 P4 P5[1/2] M6 m7[3/2] P8"
+    num_bars = num_notes // 8
+    return "(" + " ".join([bar] * num_bars) + "){p f}"
+
+
+def measure(construct):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    result = construct()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, after - before
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure memory used per realized note")
+    parser.add_argument("--notes", type=int, default=100000, help="Number of notes in the synthetic score")
+    args = parser.parse_args()
+
+    pattern = parse_text(synthetic_score(args.notes))[0][0]
+
+    realized, realize_bytes = measure(pattern.realize)
+    notes = [event for event in realized if isinstance(event, Note)]
+    num_notes = len(notes)
+
+    names = slot_names(Note)
+    references, reference_bytes = measure(lambda: [ReferenceNote(note, names) for note in notes])
+    copies, copy_bytes = measure(lambda: [slotted_copy(note, names) for note in notes])
+
+    print("{} realized notes".format(num_notes))
+    print("{:>32}: {:.1f} bytes/note".format("realize (total)", realize_bytes / num_notes))
+    print("{:>32}: {:.1f} bytes/note".format("reference (__dict__) objects", reference_bytes / num_notes))
+    print("{:>32}: {:.1f} bytes/note".format("Note objects", copy_bytes / num_notes))
@@ -0,0 +1,85 @@
+"""
+Flatten throughput in events per second on deeply nested and wide synthetic scores.
+
+Compares Pattern.iter_flat against the original recursive flatten that retimed every event
+once per nesting level.
+"""
+import argparse
+from timeit import default_timer
+from hewmp.event import Pattern
+from hewmp.parser import parse_text
+
+
+def reference_flatten(pattern):
+    """
+    The original recursive flatten. Copies each event once per enclosing pattern.
+    """
+    if not isinstance(pattern, Pattern):
+        return [pattern]
+    dilation = pattern.dilation
+    dynamic_f, articulation_f = pattern.envelopes()
+    result = []
+    for offset, subpattern in pattern.offset_subpatterns():
+        for event in reference_flatten(subpattern):
+            time = event.time + offset
+            if dynamic_f:
+                event.velocity = float(dynamic_f(float(time)))
+            if articulation_f:
+                event.gate_ratio = float(articulation_f(float(time)))
+            result.append(event.retime(pattern.time + time*dilation, event.duration*dilation))
+    return result
+
+
+def deep_score(depth, count):
+    """
+    count groups of three notes each inside depth levels of parentheses with dynamics on the outermost level
+    """
+    group = "(" * depth + "P1 M2 m3" + ")" * depth
+    return "(" + " ".join([group] * count) + "){p f}"
+
+
+def wide_score(width):
+    """
+    A single pattern of width notes
+    """
+    return "(" + " ".join(["P1", "M2", "m3", "P4"] * (width // 4)) + "){p f}"
+
+
+def as_tuples(events):
+    return [(type(event).__name__, event.time, event.duration, getattr(event, "velocity", None)) for event in events]
+
+
+def measure(flatten, pattern, repeats):
+    best = float("inf")
+    num_events = 0
+    for _ in range(repeats):
+        start = default_timer()
+        num_events = len(flatten(pattern))
+        best = min(best, default_timer() - start)
+    return num_events, best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure flatten throughput in events per second")
+    parser.add_argument("--depth", type=int, default=20, help="Nesting depth of the deep score")
+    parser.add_argument("--count", type=int, default=200, help="Number of nested groups in the deep score")
+    parser.add_argument("--width", type=int, default=20000, help="Number of notes in the wide score")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    scores = [
+        ("deep (depth {}, {} groups)".format(args.depth, args.count), deep_score(args.depth, args.count)),
+        ("wide ({} notes)".format(args.width), wide_score(args.width)),
+    ]
+    candidates = [
+        ("reference (recursive)", reference_flatten),
+        ("iter_flat", Pattern.flatten),
+    ]
+    for score_name, text in scores:
+        pattern = parse_text(text)[0][0]
+        if as_tuples(reference_flatten(pattern)) != as_tuples(pattern.flatten()):
+            raise ValueError("Flattened events differ")
+        print(score_name)
+        for name, flatten in candidates:
+            num_events, elapsed = measure(flatten, pattern, args.repeats)
+            print("{:>28}: {} events in {:.3f}s, {:.0f} events/s".format(name, num_events, elapsed, num_events / elapsed))
@@ -0,0 +1,64 @@
+"""
+Time to update the tokens of a large score after single character edits compared to lexing it again.
+"""
+import argparse
+import glob
+import os.path
+import random
+from timeit import default_timer
+from hewmp.lexer import Lexer, IncrementalLexer
+
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples", "*.hewmp")
+
+
+def edit_latency(lexer, positions, replacements):
+    """
+    Average time in seconds of the edits and the average number of blocks lexed per edit
+    """
+    num_relexed = 0
+    start = default_timer()
+    for position, replacement in zip(positions, replacements):
+        num_relexed += lexer.edit(position, position, replacement)
+    return (default_timer() - start) / len(positions), num_relexed / len(positions)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure incremental lexing latency")
+    parser.add_argument("--copies", type=int, default=20, help="Number of times the examples are concatenated")
+    parser.add_argument("--lines", type=int, default=50000, help="Number of lines in the synthetic score")
+    parser.add_argument("--edits", type=int, default=1000)
+    args = parser.parse_args()
+
+    text = ""
+    for filename in sorted(glob.glob(EXAMPLES)):
+        with open(filename) as fp:
+            text += fp.read()
+    text *= args.copies
+
+    start = default_timer()
+    num_tokens = len(list(Lexer(text)))
+    full = default_timer() - start
+
+    lexer = IncrementalLexer(text)
+    random.seed(0)
+    positions = []
+    length = len(text)
+    for _ in range(args.edits):
+        positions.append(random.randrange(length))
+        length += 1
+    replacements = [random.choice("P1 2\n") for _ in range(args.edits)]
+    incremental, num_relexed = edit_latency(lexer, positions, replacements)
+
+    print("{} characters, {} lines, {} tokens".format(len(text), text.count("\n"), num_tokens))
+    print("{:>12}: {:.3f} ms".format("full lex", full * 1000))
+    print("{:>12}: {:.3f} ms/edit, {:.2f} blocks lexed/edit".format("incremental", incremental * 1000, num_relexed))
+
+    # Edits shift the offsets of all the blocks after them so their position in a large file matters
+    text = "P1 M2 (m3 P4)[2] =M_1 ~P5 $ comment\n" * args.lines
+    print("{} characters, {} lines".format(len(text), args.lines))
+    for name, position in [("top", 10), ("middle", len(text) // 2), ("end", len(text) - 10)]:
+        lexer = IncrementalLexer(text)
+        replacements = [random.choice("P1 2\n") for _ in range(args.edits)]
+        incremental, num_relexed = edit_latency(lexer, [position] * args.edits, replacements)
+        print("{:>12}: {:.3f} ms/edit, {:.2f} blocks lexed/edit".format(name, incremental * 1000, num_relexed))
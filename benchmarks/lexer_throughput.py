@@ -0,0 +1,174 @@
+"""
+Lexer throughput in tokens per second.
+
+Compares hewmp.lexer.Lexer against the original reader based implementation that peeked
+using per-character read/tell/seek.
+"""
+import argparse
+import glob
+import os.path
+from io import StringIO
+from timeit import default_timer
+from hewmp.lexer import Lexer, Token, COMMENT, SPLITTERS, SEPARATORS, SPACERS, PLAY_CONTROL, TRACK_START, CONFIGS
+
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), "..", "examples", "*.hewmp")
+
+
+class ReferenceLexer:
+    """
+    The original lexer. Reads one character at a time and seeks back after peeking.
+    """
+    def __init__(self, reader):
+        self.reader = reader
+        self.done = False
+        self.reading_config_value = False
+        self.on_a_new_line = True
+        self.reading_string = False
+        self.reading_escape = False
+        self.index = 0
+        self.line = 0
+        self.column = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        was_on_a_new_line = self.on_a_new_line
+        self.on_a_new_line = False
+        if self.done:
+            raise StopIteration
+        whitespace = ""
+        token = ""
+        commenting = False
+        while True:
+            character = self.reader.read(1)
+            self.index += 1
+            self.column += 1
+            token_obj = Token(token, whitespace, self.index, self.line, self.column)
+            if not character:
+                if token:
+                    return token_obj
+                else:
+                    self.done = True
+                    token_obj.value = None
+                    return token_obj
+            pos = self.reader.tell()
+            next_character = self.reader.read(1)
+            next_but_one_character = self.reader.read(1)
+            self.reader.seek(pos)
+
+            if self.reading_config_value and not commenting:
+                token += character
+                if next_character == "\n" or next_character in COMMENT:
+                    self.reading_config_value = False
+                    token_obj.value = token
+                    return token_obj
+                continue
+
+            if self.reading_string:
+                if character == '"' and not self.reading_escape:
+                    self.reading_string = False
+                    return token_obj
+                if character == "$" and not self.reading_escape:
+                    self.reading_escape = True
+                else:
+                    token += character
+                    self.reading_escape = False
+                continue
+
+            token_obj.value = token
+
+            if character == "\n":
+                commenting = False
+                self.on_a_new_line = True
+                self.line += 1
+                self.column = 0
+                token_obj.value = character
+                return token_obj
+            elif character.isspace():
+                whitespace += character
+            elif character in COMMENT:
+                commenting = True
+                whitespace += character
+            elif not commenting:
+                token += character
+                if character == '"':
+                    self.reading_string = True
+                    self.reading_escape = False
+            else:
+                whitespace += character
+
+            token_obj.value = token
+            token_obj.whitespace = whitespace
+
+            if token:
+                if token == TRACK_START and was_on_a_new_line:
+                    return token_obj
+                if token in PLAY_CONTROL:
+                    return token_obj
+                if next_character in (":", ">") and next_but_one_character == "|":
+                    return token_obj
+                if character not in (":", ">") and next_character in SPACERS:
+                    return token_obj
+                if token in SPACERS and next_character not in (":", ">"):
+                    return token_obj
+
+                if token in CONFIGS and was_on_a_new_line:
+                    self.reading_config_value = True
+                    return token_obj
+
+                if next_character in SPLITTERS or token in SEPARATORS or next_character.isspace():
+                    return token_obj
+
+
+def synthetic_score(target_size):
+    """
+    Concatenate the bundled examples until the text is at least target_size characters long
+    """
+    sources = []
+    for filename in sorted(glob.glob(EXAMPLES)):
+        with open(filename) as f:
+            sources.append(f.read())
+    chunks = []
+    size = 0
+    while size < target_size:
+        for source in sources:
+            chunks.append(source)
+            size += len(source)
+    return "\n".join(chunks)
+
+
+def as_tuples(lexer):
+    return [(token.value, token.whitespace, token.index, token.line, token.column) for token in lexer]
+
+
+def measure(make_lexer, text, repeats):
+    best = float("inf")
+    num_tokens = 0
+    for _ in range(repeats):
+        start = default_timer()
+        num_tokens = sum(1 for _ in make_lexer(text))
+        best = min(best, default_timer() - start)
+    return num_tokens, best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure lexer throughput in tokens per second")
+    parser.add_argument("--size", type=int, default=1000000, help="Size of the synthetic score in characters")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    text = synthetic_score(args.size)
+    if as_tuples(Lexer(text)) != as_tuples(ReferenceLexer(StringIO(text))):
+        raise ValueError("Token streams differ")
+
+    candidates = [
+        ("reference (read/tell/seek)", lambda t: ReferenceLexer(StringIO(t))),
+        ("buffer (str)", Lexer),
+        ("buffer (StringIO)", lambda t: Lexer(StringIO(t))),
+    ]
+    print("{} characters".format(len(text)))
+    for name, make_lexer in candidates:
+        num_tokens, elapsed = measure(make_lexer, text, args.repeats)
+        print("{:>28}: {} tokens in {:.3f}s, {:.0f} tokens/s".format(name, num_tokens, elapsed, num_tokens / elapsed))
@@ -0,0 +1,84 @@
+"""
+Interval addition and scaling throughput in operations per second.
+
+Compares the int64 backed SemiMonzo against the original implementation that stored
+an object array of Fractions and re-wrapped every component on each operation.
+"""
+import argparse
+from fractions import Fraction
+from timeit import default_timer
+from numpy import array
+from hewmp.monzo import SemiMonzo, Interval, PRIMES
+
+
+class ReferenceSemiMonzo:
+    """
+    The original SemiMonzo arithmetic. Residuals and nats are left out as they're unchanged.
+    """
+    def __init__(self, value):
+        self.vector = array([Fraction(component) for component in value])
+
+    def __add__(self, other):
+        return self.__class__(self.vector + other.vector)
+
+    def __mul__(self, other):
+        other = Fraction(other)
+        return self.__class__([component * other for component in self.vector])
+
+    def __truediv__(self, other):
+        other = Fraction(other)
+        return self.__class__([component / other for component in self.vector])
+
+
+def operands(monzo_class, count):
+    result = []
+    for i in range(count):
+        vector = [(i * (j + 3)) % 7 - 3 for j in range(len(PRIMES))]
+        vector[0] = Fraction(-19, 2) if i % 3 == 0 else vector[0]
+        result.append(monzo_class(vector))
+    return result
+
+
+def add_all(monzos):
+    total = monzos[0]
+    for monzo in monzos[1:]:
+        total = total + monzo
+    return total
+
+
+def scale_all(monzos):
+    return [monzo * 3 / 2 for monzo in monzos]
+
+
+def measure(func, monzos, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = default_timer()
+        func(monzos)
+        best = min(best, default_timer() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure monzo arithmetic throughput")
+    parser.add_argument("--count", type=int, default=20000, help="Number of operands")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    reference = operands(ReferenceSemiMonzo, args.count)
+    current = operands(SemiMonzo, args.count)
+    intervals = [Interval(monzo) for monzo in current]
+    if list(add_all(reference).vector) != list(add_all(current).vector):
+        raise ValueError("Sums differ")
+
+    candidates = [
+        ("reference add", add_all, reference),
+        ("SemiMonzo add", add_all, current),
+        ("Interval add", add_all, intervals),
+        ("reference scale", scale_all, reference),
+        ("SemiMonzo scale", scale_all, current),
+        ("Interval scale", scale_all, intervals),
+    ]
+    for name, func, monzos in candidates:
+        elapsed = measure(func, monzos, args.repeats)
+        print("{:>16}: {:.3f}s, {:.0f} ops/s".format(name, elapsed, len(monzos) / elapsed))
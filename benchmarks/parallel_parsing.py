@@ -0,0 +1,45 @@
+"""
+Wall-clock time of parsing a large multi-track score with an increasing number of worker processes.
+
+The parsed patterns are pickled back to the parent process so the speedup is bounded by the time it takes
+to unpickle them. It also can't exceed the number of available cores. The tracks don't change the interval
+parser because the tracks after such a change are parsed sequentially.
+"""
+import argparse
+import os
+import time
+from hewmp.parser import parse_text
+
+
+def synthetic_score(num_tracks, num_bars):
+    """
+    Global config in 19edo followed by tracks of chords and melodies in different tempos
+    """
+    tracks = ["BN:C4\nET:19\nQ:1/4=120\nG:1/4=2 1"]
+    for index in range(num_tracks):
+        if index % 2:
+            bar = "=M7_1 ~P5 =m7 ~M2 | P1 M2 m3 P4 P5[1/2] M6 m7[3/2] P8 |\n"
+        else:
+            bar = "=M_1 =m_1 | ^M2 vM3 P4 P5 M6[2] |\n"
+        header = "Q:1/4={}\n".format(100 + 10 * (index % 10))
+        tracks.append(header + bar * num_bars)
+    return "\n---\n".join(tracks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure parsing time with 1 to 8 worker processes")
+    parser.add_argument("--tracks", type=int, default=32, help="Number of tracks in the synthetic score")
+    parser.add_argument("--bars", type=int, default=200, help="Number of bars per track")
+    parser.add_argument("--max-workers", type=int, default=8)
+    args = parser.parse_args()
+
+    text = synthetic_score(args.tracks, args.bars)
+    print("{} cores available".format(os.cpu_count()))
+    baseline = None
+    for workers in range(1, args.max_workers + 1):
+        start = time.perf_counter()
+        parse_text(text, workers=workers)
+        elapsed = time.perf_counter() - start
+        if baseline is None:
+            baseline = elapsed
+        print("{} worker(s): {:.3f} s, speedup {:.2f}x".format(workers, elapsed, baseline / elapsed))
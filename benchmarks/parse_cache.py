@@ -0,0 +1,46 @@
+"""
+Time to parse the bundled examples without a cache, with an empty cache and with a warm cache.
+"""
+import argparse
+import glob
+import os
+import time
+from tempfile import TemporaryDirectory
+from hewmp.parser import parse_text
+from hewmp.parse_cache import DiskCache
+
+
+EXAMPLES = os.path.join(os.path.dirname(__file__), os.pardir, "examples", "*.hewmp")
+
+
+def parse_all(texts, cache):
+    start = time.perf_counter()
+    for text in texts:
+        parse_text(text, cache_dir=cache)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare cold and warm parse cache load times")
+    parser.add_argument("--rounds", type=int, default=5, help="Number of warm rounds to average")
+    args = parser.parse_args()
+
+    texts = []
+    for filename in sorted(glob.glob(EXAMPLES)):
+        with open(filename) as fp:
+            texts.append(fp.read())
+
+    with TemporaryDirectory() as directory:
+        cache = DiskCache(directory)
+        # The first round also fills the in-memory caches
+        parse_all(texts, None)
+        uncached = parse_all(texts, None)
+        cold = parse_all(texts, cache)
+        warm = sum(parse_all(texts, cache) for _ in range(args.rounds)) / args.rounds
+        stored = sum(size for _, size, _ in cache.entries())
+
+    print("{} examples".format(len(texts)))
+    print("{:>10}: {:.4f} s".format("no cache", uncached))
+    print("{:>10}: {:.4f} s".format("cold", cold))
+    print("{:>10}: {:.4f} s ({:.1f}x faster than parsing)".format("warm", warm, uncached / warm))
+    print("{:>10}: {} bytes".format("stored", stored))
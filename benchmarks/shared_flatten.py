@@ -0,0 +1,55 @@
+"""
+Render time of a large multi-track score when syncing playheads and realizing flatten every track separately
+compared to a single shared flatten pass.
+"""
+import argparse
+from timeit import default_timer
+from hewmp.parser import parse_text, realize, sync_playheads
+
+
+def synthetic_score(num_tracks, num_bars):
+    """
+    Tracks of nested patterns with dynamics and a playhead
+    """
+    tracks = ["Q:1/4=120"]
+    for index in range(num_tracks):
+        bar = "(P1 M2 (m3 P4) P5)[2]{p f} =M_1 ~P5 m7[1/2] | "
+        tracks.append("|>" + bar * num_bars + ">|")
+    return "\n---\n".join(tracks)
+
+
+def separate_passes(patterns):
+    """
+    The previous implementation of realize
+    """
+    result = []
+    for pattern, (start_time, end_time) in zip(patterns, sync_playheads(patterns)):
+        result.append(pattern.realize(start_time=start_time, end_time=end_time))
+    return result
+
+
+def best_of(function, patterns, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = default_timer()
+        function(patterns)
+        best = min(best, default_timer() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare flattening tracks once and twice per render")
+    parser.add_argument("--tracks", type=int, default=16)
+    parser.add_argument("--bars", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    patterns = parse_text(synthetic_score(args.tracks, args.bars))[0]
+
+    flatten = best_of(lambda patterns: [pattern.flatten() for pattern in patterns], patterns, args.rounds)
+    separate = best_of(separate_passes, patterns, args.rounds)
+    shared = best_of(realize, patterns, args.rounds)
+
+    print("{:>16}: {:.3f} s".format("flatten only", flatten))
+    print("{:>16}: {:.3f} s".format("separate passes", separate))
+    print("{:>16}: {:.3f} s ({:.2f}x faster)".format("shared pass", shared, separate / shared))
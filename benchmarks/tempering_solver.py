@@ -0,0 +1,50 @@
+"""
+Per-call latency of temper_subgroup over every entry of TEMPERAMENTS.
+
+Compares the closed-form "direct" solver against the original "iterative" projection loop.
+"""
+import argparse
+from timeit import default_timer
+from numpy import array, log, isclose
+from hewmp.event import DEFAULT_METRIC
+from hewmp.monzo import fraction_to_monzo, PRIMES
+from hewmp.temperament import temper_subgroup
+from hewmp.temperaments import TEMPERAMENTS
+
+
+def problems():
+    result = []
+    for name, (comma_list, subgroup) in TEMPERAMENTS.items():
+        comma_list = [fraction_to_monzo(comma)[0] for comma in comma_list]
+        subgroup = [fraction_to_monzo(basis_vector)[0] for basis_vector in subgroup.split(".")]
+        result.append((name, comma_list, subgroup))
+    return result
+
+
+def measure(just_mapping, problems, method, repeats):
+    best = float("inf")
+    for _ in range(repeats):
+        start = default_timer()
+        for _, comma_list, subgroup in problems:
+            temper_subgroup(just_mapping, comma_list, [], subgroup, metric=DEFAULT_METRIC, method=method)
+        best = min(best, default_timer() - start)
+    return best / len(problems)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure tempering latency per call")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    JI = log(array(PRIMES))
+    problems = problems()
+    for name, comma_list, subgroup in problems:
+        direct = temper_subgroup(JI, comma_list, [], subgroup, metric=DEFAULT_METRIC, method="direct")
+        iterative = temper_subgroup(JI, comma_list, [], subgroup, metric=DEFAULT_METRIC, method="iterative")
+        if not isclose(direct, iterative).all():
+            raise ValueError("Solvers disagree on {}".format(name))
+
+    print("{} temperaments".format(len(problems)))
+    for method in ["iterative", "direct"]:
+        latency = measure(JI, problems, method, args.repeats)
+        print("{:>10}: {:.3f} ms per call".format(method, latency * 1000))
@@ -0,0 +1,46 @@
+"""
+Render time of a few bars near the end of a long score when realizing the flattened track
+compared to pruning the parts of the pattern tree outside of the window.
+"""
+import argparse
+from fractions import Fraction
+from timeit import default_timer
+from hewmp.parser import parse_text
+
+
+def synthetic_score(num_bars):
+    """
+    Track of nested patterns with dynamics and a tempo change
+    """
+    bar = "(P1 M2 (m3 P4) P5)[2]{p f} P1 M3 m7[1/2] | "
+    return "Q:1/4=120\n" + bar * (num_bars // 2) + "\nQ:1/4=90\n" + bar * (num_bars - num_bars // 2)
+
+
+def best_of(function, rounds):
+    best = float("inf")
+    for _ in range(rounds):
+        start = default_timer()
+        function()
+        best = min(best, default_timer() - start)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare full and windowed realization of a long track")
+    parser.add_argument("--bars", type=int, default=2000)
+    parser.add_argument("--window", type=int, default=4, help="Number of bars to render")
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    pattern = parse_text(synthetic_score(args.bars))[0][0]
+    bar_duration = Fraction(9, 2)
+    end_time = pattern.end_time - bar_duration
+    start_time = end_time - args.window * bar_duration
+
+    full = best_of(lambda: pattern.realize(start_time, end_time, flat=pattern.flatten()), args.rounds)
+    windowed = best_of(lambda: pattern.realize(start_time, end_time), args.rounds)
+    early = best_of(lambda: pattern.realize(bar_duration, (args.window + 1) * bar_duration), args.rounds)
+
+    print("{:>16}: {:.3f} s".format("full flatten", full))
+    print("{:>16}: {:.3f} s ({:.2f}x faster)".format("window at end", windowed, full / windowed))
+    print("{:>16}: {:.3f} s ({:.2f}x faster)".format("window at start", early, full / early))
@@ -1,9 +1,10 @@
 from math import gcd
+from bisect import bisect_right
 from collections import deque
 from fractions import Fraction
-from numpy import array, zeros, log, floor, pi, around, dot, exp, cumsum, linspace, concatenate, ones
+from numpy import array, asarray, zeros, maximum, searchsorted, log, floor, pi, around, dot, exp, cumsum, linspace, concatenate, ones
 from scipy.interpolate import interp1d
-from .temperament import temper_subgroup, comma_reduce, comma_equals, comma_root
+from .temperament import MAPPING_CACHE, comma_reduce, comma_equals, comma_root
 from .notation import tokenize_fraction
 from .monzo import PRIMES, Mapping
 from .util import interp_lin_const
@@ -15,6 +16,8 @@ DEFAULT_METRIC[1] = 2  # Optimize error for 9 not 3
 
 
 class MusicBase:
+    __slots__ = ("time", "duration", "real_time", "real_duration")
+
     def __init__(self, time, duration, real_time=None, real_duration=None):
         self.time = Fraction(time)
         self.duration = Fraction(duration)
@@ -57,11 +60,18 @@ class MusicBase:
 
 
 class Event(MusicBase):
+    __slots__ = ()
+
     def flatten(self):
         return [self]
 
 
 class Tuning(Event):
+    __slots__ = (
+        "base_frequency", "comma_list", "constraints", "subgroup", "et_divisions", "et_divided", "warts",
+        "suggested_mapping", "cache",
+    )
+
     def __init__(self, base_frequency, comma_list, constraints, subgroup, et_divisions=None, et_divided=None, warts=None, suggested_mapping=None, time=0, duration=0, real_time=None, real_duration=None):
         super().__init__(time, duration, real_time, real_duration)
         self.base_frequency = base_frequency
@@ -77,7 +87,7 @@ class Tuning(Event):
     def suggest_mapping(self):
         JI = log(array(PRIMES))
         if self.et_divisions is None or self.et_divided is None or self.warts is None:
-            mapping = temper_subgroup(
+            mapping = MAPPING_CACHE.temper_subgroup(
                 JI,
                 [comma[:len(JI)] for comma in self.comma_list],
                 [constraint[:len(JI)] for constraint in self.constraints],
@@ -85,21 +95,27 @@ class Tuning(Event):
                 metric=DEFAULT_METRIC,
             )
         else:
-            generator = log(float(self.et_divided)) / float(self.et_divisions)
-            if generator == 0:
-                mapping = JI*0
-            else:
-                steps = around(JI/generator)
-                mapping = steps*generator
-                for index, count in enumerate(self.warts):
-                    modification = ((count + 1)//2) * (2*(count%2) - 1)
-                    if mapping[index] > JI[index]:
-                        steps[index] -= modification
-                    else:
-                        steps[index] += modification
-                mapping = steps*generator
+            key = ("equal", Fraction(self.et_divisions), Fraction(self.et_divided), tuple(self.warts))
+            mapping = MAPPING_CACHE.get(key, lambda: self.equal_temperament_mapping(JI))
         self.suggested_mapping = Mapping(mapping, self.base_frequency)
 
+    def equal_temperament_mapping(self, JI):
+        """
+        Mapping of the primes to the nearest steps of the equal temperament modified by the warts
+        """
+        generator = log(float(self.et_divided)) / float(self.et_divisions)
+        if generator == 0:
+            return JI*0
+        steps = around(JI/generator)
+        mapping = steps*generator
+        for index, count in enumerate(self.warts):
+            modification = ((count + 1)//2) * (2*(count%2) - 1)
+            if mapping[index] > JI[index]:
+                steps[index] -= modification
+            else:
+                steps[index] += modification
+        return steps*generator
+
     def to_json(self):
         result = super().to_json()
         comma_list = ",".join(tokenize_fraction(comma, PRIMES) for comma in self.comma_list)
@@ -160,6 +176,8 @@ class Tuning(Event):
 
 
 class Tempo(Event):
+    __slots__ = ("tempo_unit", "tempo_duration", "beat_unit", "groove_pattern", "groove_span", "groove")
+
     def __init__(self, tempo_unit, tempo_duration, beat_unit, groove_pattern=None, groove_span=None, time=0, duration=0, real_time=None, real_duration=None):
         super().__init__(time, duration, real_time, real_duration)
         self.tempo_unit = tempo_unit
@@ -182,6 +200,13 @@ class Tempo(Event):
         beats = linspace(0, 1, len(beat_times))
         self.groove = interp1d(beats, beat_times)
 
+    def __reduce__(self):
+        # The groove function is rebuilt instead of pickled
+        return (self.__class__, (
+            self.tempo_unit, self.tempo_duration, self.beat_unit, self.groove_pattern, self.groove_span,
+            self.time, self.duration, self.real_time, self.real_duration,
+        ))
+
     def to_json(self):
         result = super().to_json()
         result.update({
@@ -215,6 +240,27 @@ class Tempo(Event):
 
         return start_time*beat_duration, (end_time - start_time)*beat_duration
 
+    def to_real_times(self, times, durations):
+        """
+        Array version of to_real_time. Maps arrays of beat times and durations to arrays of real times and durations.
+        """
+        times = asarray(times)
+        start_beats = times.astype(float)
+        end_beats = (times + asarray(durations)).astype(float)
+        beat_duration = float(self.beat_duration)
+        if self.groove_span is None:
+            return start_beats*beat_duration, (end_beats - start_beats)*beat_duration
+
+        unit = float(self.groove_span/self.beat_unit)
+
+        groove_bars, groove_beats = divmod(start_beats, unit)
+        start_times = (groove_bars + self.groove(groove_beats/unit)) * unit
+
+        groove_bars, groove_beats = divmod(end_beats, unit)
+        end_times = (groove_bars + self.groove(groove_beats/unit)) * unit
+
+        return start_times*beat_duration, (end_times - start_times)*beat_duration
+
     def __repr__(self):
         return "{}({!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r})".format(
             self.__class__.__name__,
@@ -230,7 +276,95 @@ class Tempo(Event):
         )
 
 
+class TempoMap:
+    """
+    Piecewise tempo of a track built from its Tempo events
+
+    Each tempo takes effect at its time and lasts until the next one. The real and universal time (in whole notes)
+    at every breakpoint are accumulated up front so that conversions only need a binary search.
+    Within a segment real time follows the segment's tempo and groove shifted to be continuous at the breakpoint.
+    """
+    def __init__(self, tempi):
+        self.tempi = []
+        for tempo in sorted(tempi, key=lambda tempo: tempo.time):
+            if self.tempi and self.tempi[-1].time == tempo.time:
+                self.tempi[-1] = tempo
+            else:
+                self.tempi.append(tempo)
+        self.times = [tempo.time for tempo in self.tempi]
+        self.float_times = array([float(time) for time in self.times])
+        self.real_times = []
+        self.universal_times = []
+        self.offsets = []
+        for i, tempo in enumerate(self.tempi):
+            real_time, _ = tempo.to_real_time(tempo.time, 0)
+            if i == 0:
+                offset = 0.0
+                universal_time = tempo.time * tempo.beat_unit
+            else:
+                previous = self.tempi[i-1]
+                span = tempo.time - previous.time
+                real_time = self.real_times[-1] + previous.to_real_time(previous.time, span)[1]
+                offset = real_time - tempo.to_real_time(tempo.time, 0)[0]
+                universal_time = self.universal_times[-1] + span * previous.beat_unit
+            self.real_times.append(real_time)
+            self.offsets.append(offset)
+            self.universal_times.append(universal_time)
+
+    def segment(self, time):
+        return max(bisect_right(self.times, time) - 1, 0)
+
+    def tempo_at(self, time):
+        return self.tempi[self.segment(time)]
+
+    def segments(self, beats):
+        return maximum(searchsorted(self.float_times, beats, side="right") - 1, 0)
+
+    def to_real_times(self, times, durations):
+        """
+        Map arrays of beat times and durations to arrays of real times and durations
+        """
+        if len(self.tempi) == 1:
+            return self.tempi[0].to_real_times(times, durations)
+        times = asarray(times)
+        ends = times + asarray(durations)
+        zero = zeros(len(times), dtype=int)
+        start_segments = self.segments(times.astype(float))
+        end_segments = self.segments(ends.astype(float))
+        real_times = zeros(len(times))
+        real_durations = zeros(len(times))
+        real_ends = zeros(len(times))
+        for i, tempo in enumerate(self.tempi):
+            starting = (start_segments == i)
+            if starting.any():
+                real_times[starting], real_durations[starting] = tempo.to_real_times(times[starting], asarray(durations)[starting])
+                real_times[starting] += self.offsets[i]
+            ending = (end_segments == i) & (start_segments != i)
+            if ending.any():
+                real_ends[ending] = tempo.to_real_times(ends[ending], zero[ending])[0] + self.offsets[i]
+        crossing = (start_segments != end_segments)
+        real_durations[crossing] = real_ends[crossing] - real_times[crossing]
+        return real_times, real_durations
+
+    def to_real_time(self, time, duration):
+        real_times, real_durations = self.to_real_times(_object_array([time]), _object_array([duration]))
+        return real_times[0], real_durations[0]
+
+    def to_universal(self, time):
+        """
+        Time in whole notes
+        """
+        i = self.segment(time)
+        return self.universal_times[i] + (time - self.times[i]) * self.tempi[i].beat_unit
+
+    def from_universal(self, universal_time):
+        i = max(bisect_right(self.universal_times, universal_time) - 1, 0)
+        return self.times[i] + (universal_time - self.universal_times[i]) / self.tempi[i].beat_unit
+
+
 class Rest(Event):
+    __slots__ = ()
+
     def __init__(self, time=0, duration=1, real_time=None, real_duration=None):
         super().__init__(time, duration, real_time, real_duration)
 
@@ -244,6 +378,8 @@ class Rest(Event):
 
 
 class Tie(Event):
+    __slots__ = ()
+
     def __init__(self, time=0, duration=1, real_time=None, real_duration=None):
         super().__init__(time, duration, real_time, real_duration)
 
@@ -255,6 +391,8 @@ class Tie(Event):
 
 
 class Spacer(Event):
+    __slots__ = ("value",)
+
     def __init__(self, value, time=0, duration=0, real_time=None, real_duration=None):
         if real_time is not None or real_duration is not None:
             raise ValueError("Spacers shouldn't be realized")
@@ -269,22 +407,24 @@ class Spacer(Event):
 
 
 class NewLine(Spacer):
-    pass
+    __slots__ = ()
 
 
 class BarLine(Spacer):
-    pass
+    __slots__ = ()
 
 
 class Playhead(Spacer):
-    pass
+    __slots__ = ()
 
 
 class Playstop(Spacer):
-    pass
+    __slots__ = ()
 
 
 class Dynamic(Event):
+    __slots__ = ("velocity",)
+
     def __init__(self, velocity, time=0, duration=0, real_time=None, real_duration=None):
         super().__init__(time, duration, real_time, real_duration)
         self.velocity = velocity
@@ -300,6 +440,8 @@ class Dynamic(Event):
 
 
 class Articulation(Event):
+    __slots__ = ("gate_ratio",)
+
     def __init__(self, gate_ratio, time=0, duration=0, real_time=None, real_duration=None):
         super().__init__(time, duration, real_time, real_duration)
         self.gate_ratio = gate_ratio
@@ -315,6 +457,8 @@ class Articulation(Event):
 
 
 class ContextChange(Event):
+    __slots__ = ("name",)
+
     def __init__(self, name, time=0, duration=0, real_time=None, real_duration=None):
         super().__init__(time, duration, real_time, real_duration)
         self.name = name
@@ -330,6 +474,8 @@ class ContextChange(Event):
 
 
 class ControlChange(Event):
+    __slots__ = ("control", "value")
+
     def __init__(self, control, value, time=0, duration=0, real_time=None, real_duration=None):
         super().__init__(time, duration, real_time, real_duration)
         self.control = control
@@ -348,6 +494,8 @@ class ControlChange(Event):
 
 
 class TrackVolume(ControlChange):
+    __slots__ = ("_volume",)
+
     def __init__(self, volume, time=0, duration=0, real_time=None, real_duration=None):
         super().__init__(7, None, time, duration, real_time, real_duration)
         self.volume = volume
@@ -372,6 +520,8 @@ class TrackVolume(ControlChange):
 
 
 class UserMessage(Event):
+    __slots__ = ("message",)
+
     def __init__(self, message, time, duration=0, real_time=None, real_duration=None):
         super().__init__(time, duration, real_time, real_duration)
         self.message = message
@@ -390,6 +540,8 @@ class UserMessage(Event):
 
 
 class ProgramChange(Event):
+    __slots__ = ("name", "program")
+
     def __init__(self, name, program, time, duration=0, real_time=None, real_duration=None):
         super().__init__(time, duration, real_time, real_duration)
         self.name = name
@@ -407,6 +559,8 @@ class ProgramChange(Event):
 
 
 class Waveform(Event):
+    __slots__ = ("name",)
+
     def __init__(self, name, time, duration=0, real_time=None, real_duration=None):
         super().__init__(time, duration, real_time, real_duration)
         self.name = name
@@ -422,6 +576,8 @@ class Waveform(Event):
 
 
 class Envelope(Event):
+    __slots__ = ("attackDuration", "decayDuration", "sustainLevel", "releaseDuration")
+
     def __init__(self, attackDuration, decayDuration, sustainLevel, releaseDuration, time, duration=0, real_time=None, real_duration=None):
         super().__init__(time, duration, real_time, real_duration)
         self.attackDuration = attackDuration
@@ -444,11 +600,15 @@ class Envelope(Event):
 
 
 class Transposable:
+    __slots__ = ()
+
     def transpose(self, interval):
         raise ValueError("Sub-classes should implement transposing")
 
 
 class GatedEvent(Event):
+    __slots__ = ("real_gate_length",)
+
     def __init__(self, time=0, duration=1, real_time=None, real_duration=None, real_gate_length=None):
         super().__init__(time, duration, real_time, real_duration)
         self.real_gate_length = real_gate_length
@@ -460,15 +620,18 @@ class GatedEvent(Event):
 
 
 class Note(GatedEvent, Transposable):
+    __slots__ = ("pitch", "velocity", "gate_ratio", "real_frequency")
+
     def __init__(self, pitch, velocity=None, gate_ratio=None, time=0, duration=1, real_time=None, real_duration=None, real_gate_length=None, real_frequency=None):
         super().__init__(time, duration, real_time, real_duration, real_gate_length)
-        self.pitch = pitch
+        # Pitches are shared between notes so they're replaced instead of modified
+        self.pitch = pitch.intern()
         self.velocity = velocity
         self.gate_ratio = gate_ratio
         self.real_frequency = real_frequency
 
     def transpose(self, interval):
-        self.pitch = self.pitch + interval
+        self.pitch = (self.pitch + interval).intern()
 
     def __repr__(self):
         return "{}({!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r})".format(
@@ -480,7 +643,7 @@ class Note(GatedEvent, Transposable):
         result = super().to_json()
         result.update({
             "type": "note",
-            "monzo": [float(component) for component in self.pitch.monzo.vector],
+            "monzo": [float(component) for component in self.pitch.monzo.components()],
             "centOffset": self.pitch.monzo.nats / log(2) * 1200,
             "frequencyOffset": self.pitch.frequency_offset,
             "phase": self.pitch.phase * 360 / (2*pi),
@@ -491,10 +654,12 @@ class Note(GatedEvent, Transposable):
         return result
 
     def retime(self, time, duration):
-        return self.__class__(self.pitch.copy(), self.velocity, self.gate_ratio, time, duration, real_gate_length=self.real_gate_length, real_frequency=self.real_frequency)
+        return self.__class__(self.pitch, self.velocity, self.gate_ratio, time, duration, real_gate_length=self.real_gate_length, real_frequency=self.real_frequency)
 
 
 class Percussion(GatedEvent):
+    __slots__ = ("name", "index", "velocity", "gate_ratio")
+
     def __init__(self, name, index=None, velocity=None, gate_ratio=None, time=0, duration=1, real_time=None, real_duration=None, real_gate_length=None):
         super().__init__(time, duration, real_time, real_duration, real_gate_length)
         self.name = name
@@ -523,6 +688,13 @@ class Percussion(GatedEvent):
         return self.__class__(self.name, self.index, self.velocity, self.gate_ratio, time, duration, real_gate_length=self.real_gate_length)
 
 
+# Events that affect the events after them or the timing of the whole track
+CONTROL_EVENTS = (Tuning, Tempo, Dynamic, Articulation, ProgramChange, TrackVolume, ContextChange, Waveform, Envelope, Playhead, Playstop)
+
+# Placeholder generated by Pattern.iter_flat in place of pruned events and subpatterns
+PRUNED = object()
+
+
 class Pattern(MusicBase, Transposable):
     def __init__(self, subpatterns=None, time=0, duration=1, logical_duration=0, real_time=None, real_duration=None, max_polyphony=None):
         super().__init__(time, duration, real_time, real_duration)
@@ -610,27 +782,39 @@ class Pattern(MusicBase, Transposable):
 
 
     def repeat(self, num_repeats, affect_duration=False):
-        subpatterns = self.subpatterns
-        self.subpatterns = []
-        offset = 0
-        for _ in range(num_repeats):
-            self.subpatterns += [sub.retime(sub.time + offset, sub.duration) for sub in subpatterns]
-            offset += self.logical_duration
-        self.logical_duration *= num_repeats
+        """
+        Pattern with the subpatterns played num_repeats times back to back
+
+        The repetitions share the subpatterns of this pattern and aren't written out as copies.
+        """
+        duration = self.duration
         if affect_duration:
-            self.duration *= num_repeats
+            duration *= num_repeats
+        result = RepeatPattern(self.subpatterns, num_repeats, self.logical_duration, self.time, duration, max_polyphony=self.max_polyphony)
+        result.properties = self.properties
+        return result
 
     def fill(self, num_onsets):
+        """
+        Repeat the subpatterns until there are num_onsets of them
+
+        The whole repetitions are kept in a RepeatPattern. Only the final partial repetition is written out.
+        """
         subpatterns = self.subpatterns
+        period = self.logical_duration
+        num_repeats, remainder = divmod(num_onsets, len(subpatterns))
         self.subpatterns = []
-        offset = 0
-        while len(self) < num_onsets:
-            for subpattern in subpatterns:
-                self.subpatterns.append(subpattern.retime(subpattern.time + offset, subpattern.duration))
-                if len(self) >= num_onsets:
-                    break
-            offset += self.logical_duration
-        self.logical_duration = self.last.end_time
+        if num_repeats:
+            self.subpatterns.append(RepeatPattern(subpatterns, num_repeats, period, 0, period * num_repeats))
+        offset = period * num_repeats
+        for subpattern in subpatterns[:remainder]:
+            self.subpatterns.append(subpattern.retime(subpattern.time + offset, subpattern.duration))
+        # Same as the end time of the last written out subpattern
+        for index in reversed(range(num_onsets)):
+            last = subpatterns[index % len(subpatterns)]
+            if not isinstance(last, Spacer):
+                self.logical_duration = last.end_time + period * (index // len(subpatterns))
+                break
 
     def reverse_time(self):
         for subpattern in self.subpatterns:
@@ -693,12 +877,16 @@ class Pattern(MusicBase, Transposable):
         if not self.duration:
             self.duration = 1
 
-    def flatten(self):
+    @property
+    def dilation(self):
         if self.logical_duration == 0:
-            dilation = Fraction(0)
-        else:
-            dilation = self.duration/self.logical_duration
-        result = []
+            return Fraction(0)
+        return Fraction(self.duration)/self.logical_duration
+
+    def envelopes(self):
+        """
+        Dynamic and articulation envelopes of the properties as functions of logical time
+        """
         dynamic_f = None
         articulation_f = None
         if self.properties is not None:
@@ -718,16 +906,134 @@ class Pattern(MusicBase, Transposable):
                 dynamic_f = interp_lin_const(dynamic_ts, dynamic_ys)
             if articulation_ts:
                 articulation_f = interp_lin_const(articulation_ts, articulation_ys)
+        return dynamic_f, articulation_f
+
+    def flatten(self):
+        return list(self.iter_flat())
+
+    def iter_flat(self, start_time=None, end_time=None, controls_only=False):
+        """
+        Generate the events of the pattern tree in the time frame of this pattern
+
+        The tree is walked once carrying the accumulated origin and scale of the enclosing patterns
+        so that each event is retimed exactly once.
+        Envelopes are carried as (function, origin, scale) in the logical time of the outermost pattern that defines them.
+
+        If start_time or end_time is given events and subpatterns whose events all start outside of the window are pruned.
+        Only the CONTROL_EVENTS of pruned subpatterns are generated because events that are later in the tree
+        may have earlier times. PRUNED is generated in place of each pruned event or subpattern.
+        Spacers and the ties extending a generated event are never pruned.
+        With controls_only only the CONTROL_EVENTS of the whole tree are generated.
+        """
+        windowed = start_time is not None or end_time is not None
+        start_time_ranges = {}
+        # Whether the last event was generated so that a Tie following it has to be too
+        follows_event = False
+        # Repeated subpatterns are copies that don't keep their envelopes
+        stack = [(iter([(0, self)]), Fraction(0), Fraction(1), None, None, controls_only, False)]
+        while stack:
+            subpatterns, origin, scale, dynamic, articulation, controls, copied = stack[-1]
+            for offset, subpattern in subpatterns:
+                time = offset + subpattern.time
+                if isinstance(subpattern, Pattern):
+                    dilation = subpattern.dilation
+                    sub_controls = controls
+                    if controls:
+                        start_time_range = subpattern.start_time_range(start_time_ranges)
+                        if start_time_range is None or not start_time_range[2]:
+                            continue
+                    elif windowed:
+                        start_time_range = subpattern.start_time_range(start_time_ranges)
+                        if start_time_range is None:
+                            continue
+                        first, last, has_controls = start_time_range
+                        if follows_event:
+                            # The subpattern may start with ties so its events are pruned one by one
+                            pass
+                        elif (end_time is not None and origin + (time + first*dilation)*scale > end_time or
+                                start_time is not None and origin + (time + last*dilation)*scale < start_time):
+                            yield PRUNED
+                            if not has_controls:
+                                continue
+                            sub_controls = True
+                    if copied:
+                        dynamic_f = articulation_f = None
+                    elif dynamic is None or articulation is None:
+                        dynamic_f, articulation_f = subpattern.envelopes()
+                    if dynamic is None:
+                        sub_dynamic = None if dynamic_f is None else (dynamic_f, 0, 1)
+                    else:
+                        sub_dynamic = (dynamic[0], dynamic[1] + time*dynamic[2], dilation*dynamic[2])
+                    if articulation is None:
+                        sub_articulation = None if articulation_f is None else (articulation_f, 0, 1)
+                    else:
+                        sub_articulation = (articulation[0], articulation[1] + time*articulation[2], dilation*articulation[2])
+                    stack.append((subpattern.offset_subpatterns(), origin + time*scale, dilation*scale, sub_dynamic, sub_articulation, sub_controls,
+                                  copied or isinstance(subpattern, RepeatPattern)))
+                    break
+                if controls and not isinstance(subpattern, CONTROL_EVENTS):
+                    follows_event = False
+                    continue
+                absolute_time = origin + time*scale
+                if windowed and not isinstance(subpattern, CONTROL_EVENTS + (Spacer,)):
+                    if isinstance(subpattern, Tie):
+                        if not follows_event:
+                            yield PRUNED
+                            continue
+                    elif (start_time is not None and absolute_time < start_time) or (end_time is not None and absolute_time > end_time):
+                        follows_event = False
+                        yield PRUNED
+                        continue
+                follows_event = True
+                event = subpattern.retime(absolute_time, subpattern.duration*scale)
+                if dynamic is not None and hasattr(event, "velocity"):
+                    event.velocity = float(dynamic[0](float(dynamic[1] + time*dynamic[2])))
+                if articulation is not None and hasattr(event, "gate_ratio"):
+                    event.gate_ratio = float(articulation[0](float(articulation[1] + time*articulation[2])))
+                yield event
+            else:
+                stack.pop()
+
+    def offset_subpatterns(self):
+        """
+        Subpatterns paired with a logical time offset
+        """
         for subpattern in self.subpatterns:
-            for event in subpattern.flatten():
-                if dynamic_f:
-                    event.velocity = float(dynamic_f(float(event.time)))
-                if articulation_f:
-                    event.gate_ratio = float(articulation_f(float(event.time)))
-                result.append(event.retime(
-                    self.time + event.time*dilation,
-                    event.duration*dilation
-                ))
+            yield 0, subpattern
+
+    def start_time_range(self, cache):
+        """
+        Earliest and latest start time of the events in the logical time of this pattern and
+        whether any of them is one of the CONTROL_EVENTS or None if there are no events
+
+        Events aren't necessarily within the duration of the pattern due to absolute time. The ranges of subpatterns
+        are stored in the cache dictionary keyed by id.
+        """
+        key = id(self)
+        if key in cache:
+            return cache[key]
+        first = None
+        last = None
+        has_controls = False
+        for offset, subpattern in self.offset_subpatterns():
+            time = offset + subpattern.time
+            if isinstance(subpattern, Pattern):
+                start_time_range = subpattern.start_time_range(cache)
+                if start_time_range is None:
+                    continue
+                dilation = subpattern.dilation
+                sub_first = time + start_time_range[0]*dilation
+                sub_last = time + start_time_range[1]*dilation
+                has_controls = has_controls or start_time_range[2]
+            else:
+                sub_first = sub_last = time
+                has_controls = has_controls or isinstance(subpattern, CONTROL_EVENTS)
+            if first is None or sub_first < first:
+                first = sub_first
+            if last is None or sub_last > last:
+                last = sub_last
+        result = None if first is None else (first, last, has_controls)
+        cache[key] = result
         return result
 
     def transpose(self, interval):
@@ -735,21 +1041,70 @@ class Pattern(MusicBase, Transposable):
             if isinstance(subpattern, Transposable):
                 subpattern.transpose(interval)
 
-    def realize(self, start_time=None, end_time=None, preserve_spacers=False):
+    def realize(self, start_time=None, end_time=None, preserve_spacers=False, flat=None):
+        """
+        Pattern of the events between start_time and end_time with real times and frequencies filled in
+
+        Subpatterns outside of the window are pruned. The state at the start of the window is restored
+        from the control events before it.
+        If the result of self.flatten() is already available it can be passed in as flat. Its events are modified.
+        """
+        columns, header = self._realize_columns(start_time, end_time, preserve_spacers, flat)
+        events, times, durations, real_times, real_durations, real_gate_lengths, real_frequencies = columns
+        for row, event in enumerate(events):
+            if isinstance(event, GatedEvent):
+                if start_time is not None:
+                    event = event.retime(times[row], durations[row])
+                event.real_time = real_times[row]
+                event.real_duration = real_durations[row]
+                event.real_gate_length = real_gate_lengths[row]
+                if isinstance(event, Note):
+                    event.real_frequency = real_frequencies[row]
+                events[row] = event
+        time, duration, real_time, real_duration = header
+        return self.__class__(events, time, duration, duration, real_time, real_duration, max_polyphony=self.max_polyphony)
+
+    def realize_table(self, start_time=None, end_time=None, preserve_spacers=False, flat=None):
+        """
+        EventTable of the events between start_time and end_time
+
+        Same as EventTable.from_pattern(self.realize(...)) but the notes and percussion go straight into the columns.
+        """
+        columns, header = self._realize_columns(start_time, end_time, preserve_spacers, flat)
+        return EventTable.from_columns(*columns, *header, max_polyphony=self.max_polyphony)
+
+    def _realize_columns(self, start_time, end_time, preserve_spacers, flat):
+        """
+        Events between start_time and end_time with parallel lists of their logical times and durations
+        relative to start_time, real times, real durations, real gate lengths and real frequencies
+
+        Events other than notes and percussion are retimed and have their real times filled in.
+        Notes and percussion are only given missing velocities and gate ratios.
+        Returns the lists and the time, duration, real time and real duration of the realized pattern.
+        """
+        flattened = self.iter_flat(start_time, end_time) if flat is None else flat
         flat = []
-        tempo = None
+        tempi = []
         tuning = None
         articulation = None
         dynamic = None
-        for event in self.flatten():
+        pruned = False
+        follows_pruned = False
+        for event in flattened:
+            if event is PRUNED:
+                pruned = follows_pruned = True
+                continue
             if isinstance(event, Spacer) and not preserve_spacers:
                 continue
             if isinstance(event, Tie):
-                flat[-1].duration += event.duration
+                # Ties following a pruned subpattern extend events outside of the window
+                if not follows_pruned:
+                    flat[-1].duration += event.duration
                 continue
+            follows_pruned = False
             flat.append(event)
-            if isinstance(event, Tempo) and tempo is None:
-                tempo = event
+            if isinstance(event, Tempo):
+                tempi.append(event)
             if isinstance(event, Tuning):
                 if tuning is None:
                     tuning = event
@@ -757,7 +1112,44 @@ class Pattern(MusicBase, Transposable):
                 articulation = event
             if isinstance(event, Dynamic) and dynamic is None:
                 dynamic = event
+        if pruned and (tuning is None or articulation is None or dynamic is None):
+            # The initial state is only found after the window
+            return self._realize_columns(start_time, end_time, preserve_spacers, self.flatten())
+        for event in flat:
+            if isinstance(event, Articulation):
+                articulation = event
+            if isinstance(event, Dynamic):
+                dynamic = event
+            if isinstance(event, GatedEvent):
+                if event.gate_ratio is None:
+                    event.gate_ratio = articulation.gate_ratio
+                if event.velocity is None:
+                    event.velocity = dynamic.velocity
+
+        tempo_map = TempoMap(tempi)
+        real_times, real_durations = tempo_map.to_real_times(
+            _object_array([event.time for event in flat]),
+            _object_array([event.duration for event in flat])
+        )
+        gated = [event for event in flat if isinstance(event, GatedEvent)]
+        _, real_gate_lengths = tempo_map.to_real_times(
+            _object_array([event.time for event in gated]),
+            _object_array([event.duration * event.gate_ratio for event in gated])
+        )
+        real_gate_lengths = real_gate_lengths.tolist()
+        notes = [event for event, length in zip(gated, real_gate_lengths) if isinstance(event, Note) and length > 0]
+        if notes:
+            real_frequencies = iter(tuning.suggested_mapping.map_pitches([note.pitch for note in notes]).tolist())
+        real_gate_lengths = iter(real_gate_lengths)
+
+        nan = float("nan")
         events = []
+        times = []
+        durations = []
+        real_times_out = []
+        real_durations_out = []
+        real_gate_lengths_out = []
+        real_frequencies_out = []
 
         missing = {
             Articulation: None,
@@ -769,26 +1161,19 @@ class Pattern(MusicBase, Transposable):
             Envelope: None,
         }
         if start_time is not None:
-            start_real_time, _ = tempo.to_real_time(start_time, 0)
+            start_real_time, _ = tempo_map.to_real_time(start_time, 0)
         else:
             start_real_time = 0.0
-        for event in flat:
-            if isinstance(event, Articulation):
-                articulation = event
-            if isinstance(event, Dynamic):
-                dynamic = event
-            real_time, real_duration = tempo.to_real_time(event.time, event.duration)
-            if isinstance(event, GatedEvent):
-                if event.gate_ratio is None:
-                    event.gate_ratio = articulation.gate_ratio
-                if event.velocity is None:
-                    event.velocity = dynamic.velocity
-                _, real_gate_length = tempo.to_real_time(event.time, event.duration * event.gate_ratio)
+        for event, real_time, real_duration in zip(flat, real_times.tolist(), real_durations.tolist()):
+            gated = isinstance(event, GatedEvent)
+            if gated:
+                real_gate_length = next(real_gate_lengths)
                 if real_gate_length <= 0:
                     continue
-                event.real_gate_length = real_gate_length
-            if isinstance(event, Note):
-                event.real_frequency = tuning.suggested_mapping(event.pitch)
+                if isinstance(event, Note):
+                    real_frequency = next(real_frequencies)
+                else:
+                    real_frequency = nan
             if start_time is not None and event.time < start_time:
                 for type_ in missing:
                     if isinstance(event, type_):
@@ -796,33 +1181,56 @@ class Pattern(MusicBase, Transposable):
                 continue
             if end_time is not None and event.end_time > end_time:
                 continue
-            if start_time is not None:
-                event = event.retime(event.time - start_time, event.duration)
+            time = event.time if start_time is None else event.time - start_time
             real_time -= start_real_time
             for type_, missing_event in list(missing.items()):
                 if missing_event is not None:
-                    extra = missing_event.retime(event.time, 0)
+                    extra = missing_event.retime(time, 0)
                     extra.real_time = real_time
                     extra.real_duration = 0.0
                     events.append(extra)
+                    times.append(time)
+                    durations.append(extra.duration)
+                    real_times_out.append(real_time)
+                    real_durations_out.append(0.0)
+                    real_gate_lengths_out.append(nan)
+                    real_frequencies_out.append(nan)
                     missing[type_] = None
-            event.real_time = real_time
-            event.real_duration = real_duration
+            if not gated:
+                if start_time is not None:
+                    event = event.retime(time, event.duration)
+                event.real_time = real_time
+                event.real_duration = real_duration
+                real_gate_length = nan
+                real_frequency = nan
             events.append(event)
+            times.append(time)
+            durations.append(event.duration)
+            real_times_out.append(real_time)
+            real_durations_out.append(real_duration)
+            real_gate_lengths_out.append(real_gate_length)
+            real_frequencies_out.append(real_frequency)
 
         if start_time is None:
             start_time = self.time
         if end_time is None:
             end_time = self.end_time
-        for thing in [tempo, tuning]:
+        for thing in [tempo_map.tempo_at(start_time), tuning]:
             if start_time > thing.time:
-                extra = thing.copy()
+                extra = thing.retime(0, 0)
                 extra.real_time = 0.0
                 extra.real_duration = 0.0
                 events.insert(0, extra)
+                times.insert(0, extra.time)
+                durations.insert(0, extra.duration)
+                real_times_out.insert(0, 0.0)
+                real_durations_out.insert(0, 0.0)
+                real_gate_lengths_out.insert(0, nan)
+                real_frequencies_out.insert(0, nan)
         duration = end_time - start_time
-        real_time, real_duration = tempo.to_real_time(start_time, duration)
-        return self.__class__(events, start_time, duration, duration, real_time, real_duration, max_polyphony=self.max_polyphony)
+        real_time, real_duration = tempo_map.to_real_time(start_time, duration)
+        columns = (events, times, durations, real_times_out, real_durations_out, real_gate_lengths_out, real_frequencies_out)
+        return columns, (start_time, duration, real_time, real_duration)
 
     def retime(self, time, duration):
         result = self.__class__([], time, duration, self.logical_duration, max_polyphony=self.max_polyphony)
@@ -853,3 +1261,357 @@ class Pattern(MusicBase, Transposable):
             "realDuration": self.real_duration,
             "events": [event.to_json() for event in self.events]
         }
+
+
+class RepeatPattern(Pattern):
+    """
+    Pattern with its subpatterns played num_repeats times, period apart
+
+    Only one period of subpatterns is stored in body. The repetitions are generated when the pattern is flattened.
+    Repetition i starts at offset + period*i so that reversing the pattern doesn't need to write out copies.
+    Reading subpatterns gives copies of the repetitions without modifying the pattern.
+    Methods that modify individual subpatterns write the repetitions out in place first.
+    Like in written out copies the envelopes of the subpatterns are ignored.
+    """
+    def __init__(self, subpatterns=None, num_repeats=1, period=1, time=0, duration=None, real_time=None, real_duration=None, max_polyphony=None):
+        logical_duration = period * num_repeats
+        if duration is None:
+            duration = logical_duration
+        super().__init__(subpatterns, time, duration, logical_duration, real_time, real_duration, max_polyphony)
+        self.num_repeats = num_repeats
+        self.period = period
+
+    @property
+    def subpatterns(self):
+        if self.num_repeats != 1 or self.offset:
+            return [subpattern.retime(subpattern.time + offset, subpattern.duration) for offset, subpattern in self.offset_subpatterns()]
+        return self.body
+
+    @subpatterns.setter
+    def subpatterns(self, value):
+        self.body = value
+        self.num_repeats = 1
+        self.offset = 0
+
+    def write_out(self):
+        """
+        Replace the body with copies of all the repetitions
+        """
+        if self.num_repeats != 1 or self.offset:
+            self.subpatterns = self.subpatterns
+            self.period = self.logical_duration
+
+    def __bool__(self):
+        return bool(self.body) and self.num_repeats > 0
+
+    def __len__(self):
+        return len(self.body) * self.num_repeats
+
+    def insert(self, index, value):
+        self.write_out()
+        super().insert(index, value)
+
+    def append(self, subpattern):
+        self.write_out()
+        super().append(subpattern)
+
+    def pop(self, index=-1):
+        self.write_out()
+        return super().pop(index)
+
+    def __setitem__(self, index, value):
+        self.write_out()
+        super().__setitem__(index, value)
+
+    def simplify(self):
+        self.write_out()
+        super().simplify()
+
+    def fill(self, num_onsets):
+        self.write_out()
+        super().fill(num_onsets)
+
+    def _rotate_time(self, steps):
+        self.write_out()
+        super()._rotate_time(steps)
+
+    def _rotate_logic(self, steps):
+        self.write_out()
+        super()._rotate_logic(steps)
+
+    def stretch_subpatterns(self):
+        self.write_out()
+        super().stretch_subpatterns()
+
+    def ensure_duration(self):
+        self.write_out()
+        super().ensure_duration()
+
+    def offsets(self):
+        return [self.offset + self.period * i for i in range(self.num_repeats)]
+
+    def is_periodic(self):
+        """
+        Repetitions follow each other without gaps or overlaps and the body fits inside one period in ascending order
+        """
+        if not self.body or self.num_repeats < 1 or self.offset or self.period <= 0 or self.logical_duration != self.period * self.num_repeats:
+            return False
+        previous_time = None
+        for subpattern in self.body:
+            if subpattern.time < 0 or subpattern.time >= self.period:
+                return False
+            if previous_time is not None and subpattern.time <= previous_time:
+                return False
+            previous_time = subpattern.time
+        return True
+
+    def repeat(self, num_repeats, affect_duration=False):
+        if self.offset or self.logical_duration != self.period * self.num_repeats:
+            return super().repeat(num_repeats, affect_duration)
+        duration = self.duration
+        if affect_duration:
+            duration *= num_repeats
+        result = RepeatPattern(self.body, self.num_repeats * num_repeats, self.period, self.time, duration, max_polyphony=self.max_polyphony)
+        result.properties = self.properties
+        return result
+
+    def reverse_time(self):
+        Pattern(self.body, logical_duration=self.logical_duration).reverse_time()
+        self.offset = -self.offset
+        self.period = -self.period
+
+    def reverse_logic(self):
+        self.body = self.body[::-1]
+        self.offset += self.period * (self.num_repeats - 1)
+        self.period = -self.period
+
+    def rotate_rhythm(self, steps):
+        if not self.is_periodic():
+            return super().rotate_rhythm(steps)
+        Pattern(self.body, logical_duration=self.period).rotate_rhythm(steps)
+
+    def rotate_time(self, steps):
+        if not self.is_periodic():
+            return super().rotate_time(steps)
+        body = Pattern(self.body, logical_duration=self.period)
+        body.rotate_time(steps)
+        self.body = body.subpatterns
+
+    def extend_duration(self, extension):
+        logical_extension = extension * self.logical_duration / self.duration
+        for subpattern in self.body:
+            subpattern.extend_duration(logical_extension)
+        self.logical_duration += logical_extension
+        MusicBase.extend_duration(self, extension)
+
+    def offset_subpatterns(self):
+        for offset in self.offsets():
+            for subpattern in self.body:
+                yield offset, subpattern
+
+    def expand(self):
+        """
+        Pattern with the repetitions written out as copies
+        """
+        result = Pattern([], self.time, self.duration, self.logical_duration, max_polyphony=self.max_polyphony)
+        for offset in self.offsets():
+            for subpattern in self.body:
+                result.append(subpattern.retime(subpattern.time + offset, subpattern.duration))
+        result.properties = self.properties
+        return result
+
+    def transpose(self, interval):
+        for subpattern in self.body:
+            if isinstance(subpattern, Transposable):
+                subpattern.transpose(interval)
+
+    def retime(self, time, duration):
+        result = self.__class__([subpattern.copy() for subpattern in self.body], self.num_repeats, self.period, time, duration, max_polyphony=self.max_polyphony)
+        result.logical_duration = self.logical_duration
+        result.offset = self.offset
+        return result
+
+    def __repr__(self):
+        return "{}({!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r})".format(self.__class__.__name__, self.body, self.num_repeats, self.period, self.time, self.duration, self.real_time, self.real_duration, self.max_polyphony)
+
+
+class RepeatedSection(RepeatPattern):
+    """
+    Earlier repetitions of a |: ... :| section. Stands in for the repeated subpatterns of the enclosing pattern.
+    """
+    def inline(self):
+        """
+        Copies of the repeated subpatterns in the time frame of the enclosing pattern
+        """
+        result = []
+        for offset in self.offsets():
+            for subpattern in self.body:
+                result.append(subpattern.retime(subpattern.time + self.time + offset, subpattern.duration))
+        return result
+
+
+class EventTable:
+    """
+    Columnar form of a realized pattern
+
+    Every event gets a row and a kind code. Notes and percussion live entirely in the columns:
+    logical times and durations keep their exact values in object arrays while velocities, gate ratios and
+    the realized quantities are float arrays with nan where they don't apply.
+    Events of the rarer kinds are kept as objects in the extras side table keyed by row.
+    """
+    KINDS = (
+        Note, Percussion, Rest, Tie, Spacer, NewLine, BarLine, Playhead, Playstop, Dynamic, Articulation,
+        ContextChange, ControlChange, TrackVolume, UserMessage, ProgramChange, Waveform, Envelope, Tempo, Tuning,
+    )
+    KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+    NOTE = KIND_CODES[Note]
+    PERCUSSION = KIND_CODES[Percussion]
+
+    def __init__(self, time=0, duration=0, real_time=None, real_duration=None, max_polyphony=None):
+        self.time = Fraction(time)
+        self.duration = Fraction(duration)
+        self.real_time = real_time
+        self.real_duration = real_duration
+        self.max_polyphony = max_polyphony
+        self.kinds = zeros(0, dtype="int8")
+        self.times = zeros(0, dtype=object)
+        self.durations = zeros(0, dtype=object)
+        self.real_times = zeros(0)
+        self.real_durations = zeros(0)
+        self.real_gate_lengths = zeros(0)
+        self.real_frequencies = zeros(0)
+        self.velocities = zeros(0)
+        self.gate_ratios = zeros(0)
+        self.phases = zeros(0)
+        self.indices = zeros(0, dtype=int)
+        self.pitches = zeros(0, dtype=object)
+        self.names = zeros(0, dtype=object)
+        self.extras = {}
+
+    def __len__(self):
+        return len(self.kinds)
+
+    @classmethod
+    def from_pattern(cls, pattern):
+        """
+        Tabulate the events of a flat (realized) pattern
+        """
+        nan = float("nan")
+        events = pattern.events
+        real_gate_lengths = []
+        real_frequencies = []
+        for event in events:
+            if isinstance(event, GatedEvent):
+                real_gate_lengths.append(nan if event.real_gate_length is None else event.real_gate_length)
+            else:
+                real_gate_lengths.append(nan)
+            if isinstance(event, Note):
+                real_frequencies.append(nan if event.real_frequency is None else event.real_frequency)
+            else:
+                real_frequencies.append(nan)
+        return cls.from_columns(
+            events,
+            [event.time for event in events],
+            [event.duration for event in events],
+            [nan if event.real_time is None else event.real_time for event in events],
+            [nan if event.real_duration is None else event.real_duration for event in events],
+            real_gate_lengths,
+            real_frequencies,
+            pattern.time, pattern.duration, pattern.real_time, pattern.real_duration,
+            max_polyphony=pattern.max_polyphony
+        )
+
+    @classmethod
+    def from_columns(cls, events, times, durations, real_times, real_durations, real_gate_lengths, real_frequencies, time, duration, real_time, real_duration, max_polyphony=None):
+        """
+        Tabulate events given their times and realized quantities as parallel lists
+
+        The times and real quantities of notes and percussion are taken from the lists instead of the event objects.
+        """
+        result = cls(time, duration, real_time, real_duration, max_polyphony)
+        nan = float("nan")
+        kinds = []
+        velocities = []
+        gate_ratios = []
+        phases = []
+        indices = []
+        pitches = []
+        names = []
+        for row, event in enumerate(events):
+            kind = cls.KIND_CODES[type(event)]
+            kinds.append(kind)
+            if kind == cls.NOTE:
+                velocities.append(nan if event.velocity is None else event.velocity)
+                gate_ratios.append(nan if event.gate_ratio is None else event.gate_ratio)
+                phases.append(event.pitch.phase)
+                pitches.append(event.pitch)
+                indices.append(-1)
+                names.append(None)
+            elif kind == cls.PERCUSSION:
+                velocities.append(nan if event.velocity is None else event.velocity)
+                gate_ratios.append(nan if event.gate_ratio is None else event.gate_ratio)
+                phases.append(nan)
+                pitches.append(None)
+                indices.append(-1 if event.index is None else event.index)
+                names.append(event.name)
+            else:
+                velocities.append(nan)
+                gate_ratios.append(nan)
+                phases.append(nan)
+                pitches.append(None)
+                indices.append(-1)
+                names.append(None)
+                result.extras[row] = event
+        result.kinds = array(kinds, dtype="int8")
+        result.times = _object_array(times)
+        result.durations = _object_array(durations)
+        result.real_times = array(real_times, dtype=float)
+        result.real_durations = array(real_durations, dtype=float)
+        result.real_gate_lengths = array(real_gate_lengths, dtype=float)
+        result.real_frequencies = array(real_frequencies, dtype=float)
+        result.velocities = array(velocities, dtype=float)
+        result.gate_ratios = array(gate_ratios, dtype=float)
+        result.phases = array(phases, dtype=float)
+        result.indices = array(indices, dtype=int)
+        result.pitches = _object_array(pitches)
+        result.names = _object_array(names)
+        return result
+
+    def to_pattern(self):
+        """
+        Flat pattern of event objects. Events from the extras side table are shared, not copied.
+        """
+        def optional(value):
+            return None if value != value else value
+
+        real_times = self.real_times.tolist()
+        real_durations = self.real_durations.tolist()
+        real_gate_lengths = self.real_gate_lengths.tolist()
+        real_frequencies = self.real_frequencies.tolist()
+        velocities = self.velocities.tolist()
+        gate_ratios = self.gate_ratios.tolist()
+        indices = self.indices.tolist()
+        events = []
+        for row, kind in enumerate(self.kinds.tolist()):
+            if kind == self.NOTE:
+                event = Note(
+                    self.pitches[row], optional(velocities[row]), optional(gate_ratios[row]), self.times[row], self.durations[row],
+                    optional(real_times[row]), optional(real_durations[row]),
+                    real_gate_length=optional(real_gate_lengths[row]), real_frequency=optional(real_frequencies[row])
+                )
+            elif kind == self.PERCUSSION:
+                event = Percussion(
+                    self.names[row], None if indices[row] < 0 else indices[row], optional(velocities[row]), optional(gate_ratios[row]),
+                    self.times[row], self.durations[row], optional(real_times[row]), optional(real_durations[row]),
+                    real_gate_length=optional(real_gate_lengths[row])
+                )
+            else:
+                event = self.extras[row]
+            events.append(event)
+        return Pattern(events, self.time, self.duration, self.duration, self.real_time, self.real_duration, max_polyphony=self.max_polyphony)
+
+
+def _object_array(values):
+    result = zeros(len(values), dtype=object)
+    result[:] = values
+    return result
@@ -1,3 +1,5 @@
+from collections import defaultdict
+
 PARENTHESIS = "()[]{}"
 MODIFIERS = "&,"
 SEPARATORS = PARENTHESIS + MODIFIERS
@@ -46,6 +48,8 @@ for arrow in "^v><":
 for arrow in "+-><^vi!*%AVunUDMW":
     CONFIGS.append("I{}:".format(arrow))
 
+CONFIG_SET = frozenset(CONFIGS)
+
 
 class Token:
     def __init__(self, value, whitespace, index, line, column):
@@ -62,18 +66,78 @@ class Token:
         return "{}({!r}, {!r}, {!r}, {!r}, {!r})".format(self.__class__.__name__, self.value, self.whitespace, self.index, self.line, self.column)
 
 
+class Checkpoint:
+    """
+    State of a Lexer between two tokens
+    """
+    def __init__(self, position, index, line, column, on_a_new_line, reading_config_value, reading_string, reading_escape):
+        self.position = position
+        self.index = index
+        self.line = line
+        self.column = column
+        self.on_a_new_line = on_a_new_line
+        self.reading_config_value = reading_config_value
+        self.reading_string = reading_string
+        self.reading_escape = reading_escape
+
+    @property
+    def mode(self):
+        return (self.on_a_new_line, self.reading_config_value, self.reading_string, self.reading_escape)
+
+    def __repr__(self):
+        return "{}({!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r}, {!r})".format(
+            self.__class__.__name__, self.position, self.index, self.line, self.column, *self.mode
+        )
+
+
 class Lexer:
-    def __init__(self, reader):
-        self.reader = reader
+    """
+    Tokenizer for HEWMP source
+
+    Accepts either a string or a readable file-like object. File-like objects are consumed in
+    chunks of chunk_size characters so non-seekable streams can be tokenized while they're still
+    being written. Only the unconsumed tail of the input plus one chunk is held in memory.
+
+    A lexer can resume in the middle of a source by passing the index, line and column where the
+    reader starts and whether that position is at the start of a line.
+    """
+    chunk_size = 4096
+
+    def __init__(self, reader, index=0, line=0, column=0, on_a_new_line=True):
+        if isinstance(reader, str):
+            self.buffer = reader
+            self.reader = None
+            self.exhausted = True
+        else:
+            self.buffer = ""
+            self.reader = reader
+            self.exhausted = False
+        self.position = 0
         self.done = False
         self.peeked_token = None
         self.reading_config_value = False
-        self.on_a_new_line = True
+        self.on_a_new_line = on_a_new_line
         self.reading_string = False
         self.reading_escape = False
-        self.index = 0
-        self.line = 0
-        self.column = 0
+        self.index = index
+        self.line = line
+        self.column = column
+
+    def fill(self, position):
+        """
+        Drop the consumed part of the buffer and read until the current character and two characters of lookahead are available
+        """
+        chunks = [self.buffer[position:]]
+        available = len(chunks[0])
+        while available < 3:
+            chunk = self.reader.read(self.chunk_size)
+            if not chunk:
+                self.exhausted = True
+                break
+            chunks.append(chunk)
+            available += len(chunk)
+        self.buffer = "".join(chunks)
+        return self.buffer
 
     def __iter__(self):
         return self
@@ -87,55 +151,82 @@ class Lexer:
             return token_obj
         if self.done:
             raise StopIteration
+        buffer = self.buffer
+        position = self.position
+        index = self.index
+        column = self.column
+        reading_config_value = self.reading_config_value
+        reading_string = self.reading_string
+        reading_escape = self.reading_escape
         whitespace = ""
         token = ""
         commenting = False
+        newline = False
         while True:
-            character = self.reader.read(1)
-            self.index += 1
-            self.column += 1
-            token_obj = Token(token, whitespace, self.index, self.line, self.column)
+            if not self.exhausted and len(buffer) - position < 3:
+                buffer = self.fill(position)
+                position = 0
+            if reading_config_value:
+                # Skip to the end of the value directly
+                end = len(buffer)
+                for terminator in "\n" + COMMENT:
+                    terminator_index = buffer.find(terminator, position + 1)
+                    if 0 <= terminator_index < end:
+                        end = terminator_index
+                if end == len(buffer) and not self.exhausted:
+                    # The last character needs lookahead that hasn't been read yet
+                    end -= 1
+                    token += buffer[position:end]
+                    index += end - position
+                    column += end - position
+                    position = end
+                    continue
+                if end > position:
+                    token += buffer[position:end]
+                    index += end - position
+                    column += end - position
+                    position = end
+                    reading_config_value = False
+                    break
+            elif commenting and not token:
+                # Skip to the end of the line directly
+                end = buffer.find("\n", position)
+                if end < 0:
+                    end = len(buffer)
+                whitespace += buffer[position:end]
+                index += end - position
+                column += end - position
+                position = end
+                if end == len(buffer) and not self.exhausted:
+                    continue
+
+            index += 1
+            column += 1
+            character = buffer[position:position+1]
             if not character:
-                if token:
-                    return token_obj
-                else:
+                if not token:
                     self.done = True
-                    token_obj.value = None
-                    return token_obj
-            # Peek emulation
-            pos = self.reader.tell()
-            next_character = self.reader.read(1)
-            next_but_one_character = self.reader.read(1)
-            self.reader.seek(pos)
-
-            if self.reading_config_value and not commenting:
-                token += character
-                if next_character == "\n" or next_character in COMMENT:
-                    self.reading_config_value = False
-                    token_obj.value = token
-                    return token_obj
-                continue
+                    token = None
+                break
+            position += 1
+            # Slicing instead of indexing makes the lookahead empty at the end of the buffer
+            next_character = buffer[position:position+1]
 
-            if self.reading_string:
-                if character == '"' and not self.reading_escape:
-                    self.reading_string = False
-                    return token_obj
-                if character == "$" and not self.reading_escape:
-                    self.reading_escape = True
+            if reading_string:
+                if character == '"' and not reading_escape:
+                    reading_string = False
+                    break
+                if character == "$" and not reading_escape:
+                    reading_escape = True
                 else:
                     token += character
-                    self.reading_escape = False
+                    reading_escape = False
                 continue
 
-            token_obj.value = token
-
             if character == "\n":
-                commenting = False
-                self.on_a_new_line = True
-                self.line += 1
-                self.column = 0
-                token_obj.value = character
-                return token_obj
+                token = character
+                newline = True
+                break
             elif character.isspace():
                 whitespace += character
             elif character in COMMENT:
@@ -144,33 +235,274 @@ class Lexer:
             elif not commenting:
                 token += character
                 if character == '"':
-                    self.reading_string = True
-                    self.reading_escape = False
+                    reading_string = True
+                    reading_escape = False
             else:
                 whitespace += character
 
-            token_obj.value = token
-            token_obj.whitespace = whitespace
-
             if token:
                 if token == TRACK_START and was_on_a_new_line:
-                    return token_obj
+                    break
                 if token in PLAY_CONTROL:
-                    return token_obj
-                if next_character in (":", ">") and next_but_one_character == "|":
-                    return token_obj
+                    break
+                if next_character in (":", ">") and buffer[position+1:position+2] == "|":
+                    break
                 if character not in (":", ">") and next_character in SPACERS:
-                    return token_obj
+                    break
                 if token in SPACERS and next_character not in (":", ">"):
-                    return token_obj
+                    break
 
-                if token in CONFIGS and was_on_a_new_line:
-                    self.reading_config_value = True
-                    return token_obj
+                if token in CONFIG_SET and was_on_a_new_line:
+                    reading_config_value = True
+                    break
 
                 if next_character in SPLITTERS or token in SEPARATORS or next_character.isspace():
-                    return token_obj
+                    break
+
+        token_obj = Token(token, whitespace, index, self.line, column)
+        if newline:
+            self.on_a_new_line = True
+            self.line += 1
+            column = 0
+        self.position = position
+        self.index = index
+        self.column = column
+        self.reading_config_value = reading_config_value
+        self.reading_string = reading_string
+        self.reading_escape = reading_escape
+        return token_obj
 
     def peek(self):
         self.peeked_token = next(self)
         return self.peeked_token
+
+    def checkpoint(self):
+        """
+        Current state of the lexer. The position is only meaningful for string input.
+        """
+        if self.peeked_token is not None:
+            raise ValueError("Cannot checkpoint after peeking")
+        return Checkpoint(
+            self.position, self.index, self.line, self.column,
+            self.on_a_new_line, self.reading_config_value, self.reading_string, self.reading_escape
+        )
+
+    @classmethod
+    def resume(cls, text, checkpoint):
+        """
+        Lexer continuing from a checkpoint taken in the same text
+        """
+        result = cls(text, checkpoint.index, checkpoint.line, checkpoint.column, checkpoint.on_a_new_line)
+        result.position = checkpoint.position
+        result.reading_config_value = checkpoint.reading_config_value
+        result.reading_string = checkpoint.reading_string
+        result.reading_escape = checkpoint.reading_escape
+        return result
+
+
+class _EditedText:
+    """
+    Readable view of an edited text from the start of a block onwards
+
+    The changed part is given as head and the rest is read from the texts of the unchanged blocks
+    starting at index so that the whole text is never joined.
+    """
+    def __init__(self, head, texts, index):
+        self.pending = head
+        self.texts = texts
+        self.index = index
+        self.handed = []
+
+    def read(self, size):
+        chunks = [self.pending]
+        available = len(self.pending)
+        while available < size and self.index < len(self.texts):
+            chunks.append(self.texts[self.index])
+            available += len(self.texts[self.index])
+            self.index += 1
+        self.pending = ""
+        result = "".join(chunks)
+        self.handed.append(result)
+        return result
+
+    def consume(self, unconsumed):
+        """
+        Text read since the last call except for the unconsumed tail that is read again
+        """
+        handed = "".join(self.handed)
+        self.handed = []
+        self.pending = unconsumed + self.pending
+        return handed[:len(handed) - len(unconsumed)]
+
+
+class IncrementalLexer:
+    """
+    Tokens of a text that are updated after an edit without lexing the whole text again
+
+    The tokens are stored in blocks that end in a newline token so every block starts at a line.
+    The mode of the lexer at the start of each block is saved as a checkpoint. After an edit lexing
+    resumes from the checkpoint of the block containing the edit and stops as soon as a new block
+    starts where an old block started in the same mode. Tokens are stored relative to their block
+    so the blocks after the edit are reused as they are.
+
+    The text is kept as one string per block. The offsets of the blocks after an edit are shifted
+    lazily: the shifts are kept as (index, delta) pairs that are added when an offset is read
+    and only written into the offsets once MAX_SHIFTS of them have accumulated.
+    """
+    MAX_SHIFTS = 32
+
+    def __init__(self, text):
+        self.modes = []
+        self.blocks = []
+        self.texts = []
+        self.stored_offsets = []
+        self.shifts = []
+        self.length = len(text)
+        self.relex(0, 0, 0, _EditedText(text, [], 0))
+        self._text = text
+
+    @property
+    def text(self):
+        if self._text is None:
+            self._text = "".join(self.texts)
+        return self._text
+
+    @property
+    def offsets(self):
+        """
+        Offset of each block in the text
+        """
+        self.apply_shifts()
+        return self.stored_offsets
+
+    def offset(self, index):
+        """
+        Offset of the block at index in the text
+        """
+        result = self.stored_offsets[index]
+        for start, delta in self.shifts:
+            if start > index:
+                break
+            result += delta
+        return result
+
+    def apply_shifts(self):
+        """
+        Write the pending shifts into the stored offsets
+        """
+        if not self.shifts:
+            return
+        boundaries = [start for start, _ in self.shifts[1:]] + [len(self.stored_offsets)]
+        total = 0
+        for (start, delta), stop in zip(self.shifts, boundaries):
+            total += delta
+            self.stored_offsets[start:stop] = [offset + total for offset in self.stored_offsets[start:stop]]
+        self.shifts = []
+
+    def find_block(self, position, lo=0):
+        """
+        Index of the first block at or after lo that starts at or after position
+        """
+        hi = len(self.blocks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.offset(mid) < position:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def lex_block(self, reader, mode):
+        """
+        Tokens from the reader up to and including the next newline token
+
+        Returns the tokens, the text consumed and the mode of the lexer afterwards.
+        """
+        lexer = Lexer.resume(reader, Checkpoint(0, 0, 0, 0, *mode))
+        tokens = []
+        for token in lexer:
+            tokens.append(token)
+            if lexer.on_a_new_line:
+                break
+        return tokens, reader.consume(lexer.buffer[lexer.position:]), lexer.checkpoint().mode
+
+    def relex(self, first, stop, delta, reader):
+        """
+        Replace blocks from first up to stop by lexing the text of the reader until it re-synchronizes with the old blocks.
+        Text before the start of stop has changed in length by delta.
+
+        Returns the number of blocks lexed.
+        """
+        position = self.offset(first) if first < len(self.blocks) else 0
+        mode = self.modes[first] if first < len(self.modes) else (True, False, False, False)
+        offsets = []
+        modes = []
+        blocks = []
+        texts = []
+        while True:
+            tokens, text, next_mode = self.lex_block(reader, mode)
+            offsets.append(position)
+            modes.append(mode)
+            blocks.append(tokens)
+            texts.append(text)
+            position += len(text)
+            mode = next_mode
+            if tokens[-1].is_end():
+                stop = len(self.blocks)
+                break
+            while stop < len(self.blocks) and self.offset(stop) + delta < position:
+                stop += 1
+            if stop < len(self.blocks) and self.offset(stop) + delta == position and self.modes[stop] == mode:
+                break
+
+        # The new offsets are stored net of the shifts that still apply to them
+        count = len(blocks)
+        base = sum(shift for start, shift in self.shifts if start < first)
+        shifts = defaultdict(int)
+        for start, shift in self.shifts:
+            if start >= stop:
+                start += count - (stop - first)
+            elif start >= first:
+                start = first + count
+            shifts[start] += shift
+        shifts[first + count] += delta
+        self.stored_offsets[first:stop] = [offset - base for offset in offsets]
+        self.modes[first:stop] = modes
+        self.blocks[first:stop] = blocks
+        self.texts[first:stop] = texts
+        self.shifts = sorted((start, shift) for start, shift in shifts.items() if shift and start < len(self.blocks))
+        if len(self.shifts) > self.MAX_SHIFTS:
+            self.apply_shifts()
+        return count
+
+    def edit(self, start, end, replacement):
+        """
+        Replace the text between start and end and update the tokens
+
+        Returns the number of blocks that were lexed again.
+        """
+        if not 0 <= start <= end <= self.length:
+            raise ValueError("Invalid edit range")
+        first = max(self.find_block(start + 1) - 1, 0)
+        last = max(self.find_block(end + 1, first) - 1, first)
+        # Blocks that start inside the replaced text can't be reused
+        stop = self.find_block(end, first + 1)
+        head = self.texts[first][:start - self.offset(first)] + replacement + self.texts[last][end - self.offset(last):]
+        delta = len(replacement) - (end - start)
+        self.length += delta
+        self._text = None
+        return self.relex(first, stop, delta, _EditedText(head, self.texts, last + 1))
+
+    def checkpoints(self):
+        """
+        Checkpoints at the start of each block
+        """
+        return [
+            Checkpoint(offset, offset, line, 0, *mode)
+            for line, (offset, mode) in enumerate(zip(self.offsets, self.modes))
+        ]
+
+    def __iter__(self):
+        for line, (offset, tokens) in enumerate(zip(self.offsets, self.blocks)):
+            for token in tokens:
+                yield Token(token.value, token.whitespace, offset + token.index, line, token.column)
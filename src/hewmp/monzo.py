@@ -1,10 +1,20 @@
 from fractions import Fraction
-from numpy import array, zeros, log, exp, dot
+from math import gcd as _gcd
+from threading import Lock
+from weakref import WeakValueDictionary
+from numpy import array, asarray, zeros, log, exp, gcd, int64
 
 
 PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31)
 
 
+def lcm(a, b):
+    """
+    Least common multiple of two positive integers (math.lcm requires Python 3.9)
+    """
+    return a // _gcd(a, b) * b
+
+
 def number_to_monzo(number):
     if number < 1:
         raise ValueError("Non-vectorizable number {}".format(number))
@@ -23,17 +33,31 @@ def fraction_to_monzo(fraction):
     return positive_monzo - negative_monzo, Fraction(numerator, denominator)
 
 
+# Bound on the magnitude of the integer representation. Keeps intermediate products well within int64.
+INTEGER_LIMIT = 2**31
+
+
 class SemiMonzo:
     """
     Vector representation of a fraction or an nth root of a fraction
+
+    The components are stored as int64 numerators over a shared denominator.
+    Components that don't fit are kept as an object array of Fractions instead.
     """
+    __slots__ = ("_numerators", "_denominator", "_vector", "_frozen", "residual", "nats")
+
     def __init__(self, value=None, residual=None, nats=None):
+        self._frozen = False
         if isinstance(value, self.__class__):
             if residual is not None or nats is not None:
                 raise ValueError("Residual or nats given when copying SemiMonzo")
             residual = value.residual
             nats = value.nats
-            value = value.vector
+            if value._numerators is None:
+                value = value._vector
+            else:
+                self._set_integral(value._numerators.copy(), value._denominator)
+                value = False
         if isinstance(value, Fraction):
             if residual is not None:
                 raise ValueError("Residual already given when converting fraction to monzo")
@@ -47,15 +71,124 @@ class SemiMonzo:
         if nats is None:
             nats = 0.0
         if value is None:
-            self.vector = array([Fraction(0)] * len(PRIMES))
-        else:
+            self._set_integral(zeros(len(PRIMES), int64), 1)
+        elif value is not False:
             # Monzo components of nth roots of fractions up to 31-limit (logarithmic)
-            self.vector = array([Fraction(component) for component in value])
+            self._set_components(value)
         # Fraction beyond 31-limit (non-logarithmic)
         self.residual = residual
         # Logarithmic residual
         self.nats = nats
 
+    def _set_integral(self, numerators, denominator):
+        self._numerators = numerators
+        self._denominator = denominator
+        self._vector = None
+
+    def _set_exact(self, vector):
+        self._numerators = None
+        self._denominator = None
+        self._vector = vector
+
+    def _set_components(self, value):
+        value = asarray(value)
+        if value.dtype.kind in "iu":
+            numerators = value.astype(int64)
+            if (abs(numerators) <= INTEGER_LIMIT).all():
+                self._set_integral(numerators, 1)
+                return
+        elif value.dtype.kind == "f":
+            numerators = value.astype(int64)
+            if (numerators == value).all() and (abs(numerators) <= INTEGER_LIMIT).all():
+                self._set_integral(numerators, 1)
+                return
+        components = [Fraction(component) for component in value]
+        denominator = 1
+        for component in components:
+            denominator = lcm(denominator, component.denominator)
+        numerators = [component.numerator * (denominator // component.denominator) for component in components]
+        if denominator <= INTEGER_LIMIT and all(abs(numerator) <= INTEGER_LIMIT for numerator in numerators):
+            self._set_integral(array(numerators, int64), denominator)
+        else:
+            self._set_exact(array(components))
+
+    def _set_result(self, numerators, denominator, fallback):
+        """
+        Store the result of integer arithmetic falling back to exact Fractions if it grew too large.
+        """
+        if denominator > INTEGER_LIMIT or abs(numerators).max() > INTEGER_LIMIT:
+            divisor = int(gcd(int(gcd.reduce(numerators)), denominator))
+            numerators = numerators // divisor
+            denominator //= divisor
+            if denominator > INTEGER_LIMIT or abs(numerators).max() > INTEGER_LIMIT:
+                self._set_components(fallback())
+                return
+        self._set_integral(numerators, denominator)
+
+    def freeze(self):
+        """
+        Make the monzo immutable so that it can be shared between threads. Used when interning.
+        """
+        if self._numerators is None:
+            self._vector.flags.writeable = False
+        else:
+            self._numerators.flags.writeable = False
+        self._frozen = True
+
+    def _check_mutable(self):
+        if self._frozen:
+            raise ValueError("Monzos of interned pitches and intervals can't be modified")
+
+    @property
+    def vector(self):
+        """
+        Components as an object array of Fractions. Modifications to the array are reflected in the monzo.
+
+        Frozen monzos give a new read-only array instead.
+        """
+        if self._frozen:
+            result = self.components()
+            result.flags.writeable = False
+            return result
+        if self._vector is None:
+            self._set_exact(self.components())
+        return self._vector
+
+    @vector.setter
+    def vector(self, value):
+        self._check_mutable()
+        self._set_exact(value)
+
+    def components(self):
+        """
+        Components as a new object array of Fractions
+        """
+        if self._numerators is None:
+            return array([Fraction(component) for component in self._vector])
+        denominator = self._denominator
+        return array([Fraction(numerator, denominator) for numerator in self._numerators.tolist()])
+
+    def add_to_component(self, index, amount):
+        """
+        Add an amount to a single component in place
+        """
+        self._check_mutable()
+        if self._numerators is None:
+            self._vector[index] += amount
+            return
+        shift = Fraction(amount) * self._denominator
+        if shift.denominator == 1 and abs(self._numerators[index] + shift.numerator) <= INTEGER_LIMIT:
+            self._numerators[index] += shift.numerator
+        else:
+            components = self.components()
+            components[index] += amount
+            self._set_components(components)
+
+    def _raw(self):
+        if self._numerators is None:
+            return self._vector
+        return self.components()
+
     @property
     def total_nats(self):
         if self.residual == 0:
@@ -63,72 +196,162 @@ class SemiMonzo:
         return log(float(self.residual)) + self.nats
 
     def __neg__(self):
-        return self.__class__(-self.vector, 1/self.residual, -self.nats)
+        result = self.__class__.__new__(self.__class__)
+        result._frozen = False
+        if self._numerators is None:
+            result._set_components(-self._vector)
+        else:
+            result._set_integral(-self._numerators, self._denominator)
+        result.residual = 1/self.residual
+        result.nats = -self.nats
+        return result
+
+    def _combine(self, other, sign):
+        result = self.__class__.__new__(self.__class__)
+        result._frozen = False
+        if self._numerators is None or other._numerators is None:
+            result._set_components(self._raw() + sign*other._raw())
+            return result
+        if self._denominator == other._denominator:
+            denominator = self._denominator
+            numerators = self._numerators + sign*other._numerators
+        else:
+            denominator = lcm(self._denominator, other._denominator)
+            numerators = self._numerators * (denominator // self._denominator) + sign*other._numerators * (denominator // other._denominator)
+        result._set_result(numerators, denominator, lambda: self.components() + sign*other.components())
+        return result
 
     def __add__(self, other):
         """
         Add logarithms. Multiply fractions.
         """
-        vector = self.vector + other.vector
-        residual = self.residual * other.residual
-        nats = self.nats + other.nats
-        return self.__class__(vector, residual, nats)
+        result = self._combine(other, 1)
+        result.residual = self.residual * other.residual
+        result.nats = self.nats + other.nats
+        return result
 
     def __sub__(self, other):
         """
         Subtrac logarithms. Divide fractions.
         """
-        vector = self.vector - other.vector
-        residual = self.residual / other.residual
-        nats = self.nats - other.nats
-        return self.__class__(vector, residual, nats)
+        result = self._combine(other, -1)
+        result.residual = self.residual / other.residual
+        result.nats = self.nats - other.nats
+        return result
+
+    def _scale(self, factor):
+        """
+        Components multiplied by a Fraction
+        """
+        result = self.__class__.__new__(self.__class__)
+        result._frozen = False
+        numerator, denominator = factor.numerator, factor.denominator
+        if self._numerators is None or abs(numerator) > INTEGER_LIMIT or denominator > INTEGER_LIMIT:
+            result._set_components([component * factor for component in self._raw()])
+            return result
+        result._set_result(
+            self._numerators * numerator,
+            self._denominator * denominator,
+            lambda: [component * factor for component in self.components()],
+        )
+        return result
 
     def __mul__(self, other):
         """
         Raise to the nth power
         """
         if other == 1:
-            return self.__class__(self.vector, self.residual, self.nats)
+            return self.copy()
         other = Fraction(other)
-        vector = [component * other for component in self.vector]
+        result = self._scale(other)
         if other.denominator == 1:
-            residual = self.residual ** other
-            nats = self.nats * other
+            result.residual = self.residual ** other
+            result.nats = self.nats * other
         else:
-            residual = None
-            nats = self.total_nats * float(other)
-        return self.__class__(vector, residual, nats)
+            result.residual = Fraction(1)
+            result.nats = self.total_nats * float(other)
+        return result
 
     def __truediv__(self, other):
         """
         Take the nth root.
         """
         if other == 1:
-            return self.__class__(self.vector, self.residual, self.nats)
+            return self.copy()
         other = Fraction(other)
-        vector = [component / other for component in self.vector]
-        nats = self.total_nats / float(other)
-        return self.__class__(vector, None, nats)
+        result = self._scale(1 / other)
+        result.residual = Fraction(1)
+        result.nats = self.total_nats / float(other)
+        return result
 
     def __eq__(self, other):
-        return (self.vector == other.vector).all() and self.residual == other.residual and self.nats == other.nats
+        if self is other:
+            return True
+        if self._numerators is None or other._numerators is None:
+            if not (self._raw() == other._raw()).all():
+                return False
+        elif not (self._numerators * other._denominator == other._numerators * self._denominator).all():
+            return False
+        return self.residual == other.residual and self.nats == other.nats
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def key(self):
+        """
+        Hashable value of the monzo. Equal monzos have equal keys regardless of how the components are stored.
+        """
+        if self._numerators is None:
+            components = [Fraction(component) for component in self._vector]
+            denominator = 1
+            for component in components:
+                denominator = lcm(denominator, component.denominator)
+            numerators = [component.numerator * (denominator // component.denominator) for component in components]
+        else:
+            numerators = self._numerators
+            denominator = self._denominator
+            if denominator > 1:
+                divisor = int(gcd(int(gcd.reduce(numerators)), denominator))
+                numerators = numerators // divisor
+                denominator //= divisor
+            numerators = numerators.tolist()
+        return (tuple(numerators), denominator, self.residual, self.nats)
 
     def copy(self):
-        return self.__class__(self.vector, self.residual, self.nats)
+        return self.__class__(self)
 
     def __repr__(self):
-        return "{}({!r}, {!r}, {!r})".format(self.__class__.__name__, self.vector, self.residual, self.nats)
+        return "{}({!r}, {!r}, {!r})".format(self.__class__.__name__, self._raw(), self.residual, self.nats)
 
     def float_vector(self):
-        return array([float(component) for component in self.vector])
+        if self._numerators is None:
+            return array([float(component) for component in self._vector])
+        return self._numerators / self._denominator
 
     def fraction(self):
         result = self.residual
-        for prime, component in zip(PRIMES, self.vector):
+        for prime, component in zip(PRIMES, self._raw()):
             result *= Fraction(prime) ** component
         return result
 
 
+def stack_monzos(monzos):
+    """
+    Float components of the monzos as an (N, len(PRIMES)) matrix and their logarithmic residuals as an array
+    """
+    vectors = zeros((len(monzos), len(PRIMES)))
+    integral = [i for i, monzo in enumerate(monzos) if monzo._numerators is not None]
+    if integral:
+        numerators = array([monzos[i]._numerators for i in integral])
+        denominators = array([monzos[i]._denominator for i in integral])
+        vectors[integral] = numerators / denominators[:, None]
+    for i, monzo in enumerate(monzos):
+        if monzo._numerators is None:
+            vectors[i] = monzo.float_vector()
+    nats = array([monzo.total_nats for monzo in monzos], dtype=float)
+    return vectors, nats
+
+
 def et_to_semimonzo(num_steps, et_divisions, et_divided):
     num_steps = Fraction(num_steps)
     et_divisions = Fraction(et_divisions)
@@ -137,8 +360,33 @@ def et_to_semimonzo(num_steps, et_divisions, et_divided):
     return result * num_steps / et_divisions
 
 
+# Shared instances of pitches and intervals keyed by value. Entries disappear once nothing refers to them.
+_INTERNED = WeakValueDictionary()
+_INTERNED_LOCK = Lock()
+
+
+def intern(value):
+    """
+    Canonical instance of a Pitch or an Interval so that equal values share a single object.
+
+    Pitches and intervals are treated as immutable once interned and their monzos are frozen.
+    Build a new one with arithmetic instead of modifying it.
+    """
+    key = value.key()
+    with _INTERNED_LOCK:
+        result = _INTERNED.setdefault(key, value)
+        result.monzo.freeze()
+        return result
+
+
+def _unpickle_interned(cls, *args):
+    return intern(cls(*args))
+
+
 class Pitch:
+    __slots__ = ("monzo", "frequency_offset", "phase", "_key", "__weakref__")
     absolute = True
+
     def __init__(self, monzo=None, frequency_offset=0, phase=0):
         if monzo is None:
             monzo = SemiMonzo()
@@ -147,11 +395,29 @@ class Pitch:
         self.monzo = monzo
         self.frequency_offset = frequency_offset
         self.phase = phase
+        self._key = None
 
     def copy(self):
         return self.__class__(self.monzo.copy(), self.frequency_offset, self.phase)
 
+    def key(self):
+        if self._key is None:
+            self._key = (self.__class__, self.monzo.key(), self.frequency_offset, self.phase)
+        return self._key
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def intern(self):
+        return intern(self)
+
+    def __reduce__(self):
+        # Unpickled pitches join the interned instances of the receiving process
+        return (_unpickle_interned, (self.__class__, self.monzo, self.frequency_offset, self.phase))
+
     def __eq__(self, other):
+        if self is other:
+            return True
         if not isinstance(other, Pitch):
             return False
         return self.monzo == other.monzo and self.frequency_offset == other.frequency_offset and self.phase == other.phase
@@ -171,7 +437,9 @@ class Pitch:
 
 
 class Interval:
+    __slots__ = ("monzo", "frequency_delta", "phase_delta", "_key", "__weakref__")
     absolute = False
+
     def __init__(self, monzo=None, frequency_delta=0, phase_delta=0):
         if monzo is None:
             monzo = SemiMonzo()
@@ -180,6 +448,28 @@ class Interval:
         self.monzo = monzo
         self.frequency_delta = frequency_delta
         self.phase_delta = phase_delta
+        self._key = None
+
+    def key(self):
+        if self._key is None:
+            self._key = (self.__class__, self.monzo.key(), self.frequency_delta, self.phase_delta)
+        return self._key
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def intern(self):
+        return intern(self)
+
+    def __reduce__(self):
+        return (_unpickle_interned, (self.__class__, self.monzo, self.frequency_delta, self.phase_delta))
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, Interval):
+            return False
+        return self.monzo == other.monzo and self.frequency_delta == other.frequency_delta and self.phase_delta == other.phase_delta
 
     def __add__(self, other):
         monzo = self.monzo + other.monzo
@@ -226,9 +516,39 @@ class Mapping:
             raise ValueError("Base frequency not set")
         if not isinstance(pitch, Pitch):
             raise TypeError("Only pitches can be mapped to frequency")
-        nats = dot(self.vector, pitch.monzo.vector) + pitch.monzo.total_nats
+        nats = self.dot(pitch.monzo) + pitch.monzo.total_nats
         return self.base_frequency * exp(nats) + pitch.frequency_offset
 
+    def map_many(self, vectors, nats=None, frequency_offsets=None):
+        """
+        Map an (N, len(PRIMES)) matrix of monzo components to frequencies in one go.
+
+        nats are the logarithmic residuals of the monzos (SemiMonzo.total_nats) and
+        frequency_offsets are added to the results like with Pitch.frequency_offset.
+        """
+        if self.base_frequency is None:
+            raise ValueError("Base frequency not set")
+        vectors = asarray(vectors, dtype=float)
+        # Accumulate one prime at a time to sum in the same order as dot
+        result = zeros(len(vectors))
+        for component, coefficient in zip(vectors.T, self.vector):
+            result = result + component * coefficient
+        if nats is not None:
+            result = result + nats
+        result = self.base_frequency * exp(result)
+        if frequency_offsets is not None:
+            result = result + frequency_offsets
+        return result
+
+    def map_pitches(self, pitches):
+        """
+        Frequencies of a sequence of pitches as an array
+        """
+        if not all(isinstance(pitch, Pitch) for pitch in pitches):
+            raise TypeError("Only pitches can be mapped to frequency")
+        vectors, nats = stack_monzos([pitch.monzo for pitch in pitches])
+        return self.map_many(vectors, nats, array([pitch.frequency_offset for pitch in pitches], dtype=float))
+
     def itor(self, interval):
         return exp(self.nats(interval))
 
@@ -237,4 +557,10 @@ class Mapping:
             raise TypeError("Only intervals can be converted")
         if interval.frequency_delta:
             raise ValueError("Non-zero frequency delta")
-        return dot(self.vector, interval.monzo.vector) + interval.monzo.total_nats
+        return self.dot(interval.monzo) + interval.monzo.total_nats
+
+    def dot(self, monzo):
+        """
+        Logarithmic size of the monzo's components under this mapping. Summed in order for reproducibility.
+        """
+        return sum((self.vector * monzo.float_vector()).tolist())
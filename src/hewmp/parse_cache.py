@@ -0,0 +1,170 @@
+"""
+Disk cache of parsed scores keyed by a hash of the source text
+"""
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+try:
+    from importlib import metadata
+except ImportError:
+    # Python < 3.8
+    metadata = None
+
+
+# Bump when the layout of the cached objects changes
+FORMAT = 2
+
+
+def _package_version():
+    if metadata is None:
+        try:
+            import pkg_resources
+            return pkg_resources.get_distribution("hewmp").version
+        except Exception:
+            return "unknown"
+    try:
+        return metadata.version("hewmp")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+VERSION = _package_version()
+
+
+class DiskCache:
+    """
+    Directory of pickled parse results
+
+    Entries are keyed by a hash of the source text, the parsing options and the version of hewmp.
+    Entries are written to a temporary file that is atomically renamed into place so that several
+    processes can share the directory. The least recently used entries are removed once the
+    total size of the directory exceeds max_bytes.
+
+    Entries are unpickled when loaded so the directory must only be writable by trusted users.
+    """
+    suffix = ".pickle"
+    # Errors that mark an entry as unreadable when loading or a value as unstorable when dumping
+    load_errors = (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError)
+    dump_errors = (pickle.PicklingError, TypeError, AttributeError)
+
+    def __init__(self, directory, max_bytes=256*1024*1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, text, *options):
+        digest = hashlib.sha256()
+        digest.update("{}\0{}\0{!r}\0".format(VERSION, FORMAT, options).encode("utf-8"))
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def dumps(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def load(self, fp):
+        return pickle.load(fp)
+
+    def get(self, key):
+        """
+        Stored value of the key or None if there's no valid entry
+        """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as fp:
+                result = self.load(fp)
+        except self.load_errors:
+            # Entries written by an incompatible version are treated as missing too
+            self.misses += 1
+            return None
+        try:
+            # The modification time doubles as the time of last use for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return result
+
+    def put(self, key, value):
+        """
+        Store a value under the key. Returns False if the value can't be stored.
+        """
+        try:
+            data = self.dumps(value)
+        except self.dump_errors:
+            return False
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(data)
+            os.replace(temp_path, self.path(key))
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+        self.evict()
+        return True
+
+    def entries(self):
+        """
+        List of (last use, size, path) of the stored entries
+        """
+        result = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Removed by another process
+                continue
+            result.append((stat.st_mtime, stat.st_size, path))
+        return result
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the total size is within max_bytes
+        """
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.hits = 0
+        self.misses = 0
+
+
+class JSONDiskCache(DiskCache):
+    """
+    DiskCache of values that can be represented as JSON
+
+    Loading an entry doesn't execute code so the directory may be shared more freely.
+    """
+    suffix = ".json"
+    load_errors = (OSError, ValueError)
+    dump_errors = (TypeError, ValueError)
+
+    def dumps(self, value):
+        return json.dumps(value).encode("utf-8")
+
+    def load(self, fp):
+        return json.loads(fp.read().decode("utf-8"))
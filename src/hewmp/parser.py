@@ -1,11 +1,17 @@
 # coding: utf-8
-from io import StringIO
-from collections import Counter, defaultdict
+from bisect import bisect_right
+from collections import Counter, OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count
+from threading import Lock
 try:
     import mido
 except ImportError:
     mido = None
 from fractions import Fraction
+from functools import lru_cache
+from hashlib import blake2b
+import pickle
 from .lexer import Lexer, CONFIGS, TRACK_START
 from .extra_chords import EXTRA_CHORDS
 from .chord_parser import expand_chord, separate_by_arrows
@@ -29,7 +35,9 @@ from .arrow import SignedArrow, SIGN_BY_ARROW
 from . import orgone
 from . import preed
 from . import lambda_bp
-from .temperament import infer_subgroup
+from .temperament import infer_subgroup, MAPPING_CACHE
+from . import temperament_data
+from .parse_cache import DiskCache
 from .spine import erect_spine
 
 
@@ -122,17 +130,26 @@ class ParsedInterval:
         self.lift_inflection = lift_inflection
         self._absolute = absolute
         self.offset = offset
+        self._value = None
 
     @property
     def interval_class(self):
         return getattr(self.base, "interval_class", None)
 
     def value(self):
+        """
+        Interval or pitch represented by the token. Computed once and shared so it must not be modified.
+        """
+        if self._value is None:
+            self._value = self._calculate_value()
+        return self._value
+
+    def _calculate_value(self):
         if not isinstance(self.base, SemiInterval):
             result = SemiInterval(SemiMonzo(self.base.monzo()))
         else:
             result = self.base.copy()
-        result.monzo.vector[0] += self.octaves
+        result.monzo.add_to_component(0, self.octaves)
         result += self.up_inflection * self.ups
         result += self.lift_inflection * self.lifts
         result = result / self.root * self.exponent
@@ -149,6 +166,7 @@ class ParsedInterval:
     @absolute.setter
     def absolute(self, value):
         self._absolute = value
+        self._value = None
 
 
 def parse_warts(token, index=0):
@@ -180,58 +198,73 @@ def parse_warts(token, index=0):
     return et_divisions, et_divided, warts, wart_str
 
 
-def sync_playheads(patterns):
+def sync_playheads(patterns, flats=None):
+    """
+    Start and end times of each pattern so that the playheads of all tracks line up in real time
+
+    The flattened events of the patterns can be passed as flats to avoid flattening them again.
+    """
+    if flats is None:
+        flats = [pattern.flatten() for pattern in patterns]
     start_universal_time = None
     end_universal_time = None
-    tempi = []
+    tempo_maps = []
     end_times = []
-    for pattern in patterns:
+    for flat in flats:
         start_time = None
         end_time = None
-        tempo = None
-        for event in pattern.flatten():
+        tempi = []
+        for event in flat:
             if isinstance(event, Playstop):
                 end_time = event.end_time
             elif isinstance(event, Playhead):
                 start_time = event.time
             elif isinstance(event, Tempo):
-                tempo = event
-        tempi.append(tempo)
+                tempi.append(event)
+        tempo_map = TempoMap(tempi)
+        tempo_maps.append(tempo_map)
         end_times.append(end_time)
         if start_time is not None:
-            universal = start_time * tempo.beat_unit
+            universal = tempo_map.to_universal(start_time)
             if start_universal_time is None or universal > start_universal_time:
                 start_universal_time = universal
-    for tempo, end_time in zip(tempi, end_times):
+    for tempo_map, end_time in zip(tempo_maps, end_times):
         if end_time is not None:
-            universal = end_time * tempo.beat_unit
+            universal = tempo_map.to_universal(end_time)
             if start_universal_time is None or universal > start_universal_time:
                 if end_universal_time is None or universal < end_universal_time:
                     end_universal_time = universal
     result = []
-    for tempo in tempi:
+    for tempo_map in tempo_maps:
         start_time = None
         end_time = None
         if start_universal_time is not None:
-            start_time = start_universal_time / tempo.beat_unit
+            start_time = tempo_map.from_universal(start_universal_time)
         if end_universal_time is not None:
-            end_time = end_universal_time / tempo.beat_unit
+            end_time = tempo_map.from_universal(end_universal_time)
         result.append((start_time, end_time))
     return result
 
 
-DEFAULT_CONFIG = {
-    "tuning": Tuning(440.0, (), (), (), Fraction(12), Fraction(2), None),  # warts is None so it's JI
-    "tempo": Tempo(Fraction(1, 4), Fraction(1, 2), Fraction(1, 4)),
-    "track_volume": TrackVolume(Fraction(1)),
-    "program_change": None,
-    "CRD": 5,
-    "N": "hewmp",
-    "flags": ("unmapET",),  # default to just intonation
-    "SG": "auto",
-}
+def default_config():
+    """
+    Config that the global track starts from. Every call returns new objects so that parses don't share state.
+    """
+    result = {
+        "tuning": Tuning(440.0, (), (), (), Fraction(12), Fraction(2), None),  # warts is None so it's JI
+        "tempo": Tempo(Fraction(1, 4), Fraction(1, 2), Fraction(1, 4)),
+        "track_volume": TrackVolume(Fraction(1)),
+        "program_change": None,
+        "CRD": 5,
+        "N": "hewmp",
+        "flags": ("unmapET",),  # default to just intonation
+        "SG": "auto",
+    }
+    result["tuning"].suggest_mapping()
+    return result
+
 
-DEFAULT_CONFIG["tuning"].suggest_mapping()
+DEFAULT_CONFIG = default_config()
 
 
 class ParsingError(Exception):
@@ -262,8 +295,78 @@ def parse_pitch(token, inflections, parse_spine=pythagoras.Pitch.parse):
     return Pitch(spine, arrows, inflections)
 
 
+# Version numbers are unique across parsers so that copies can share their caches
+_PARSING_STATE_VERSIONS = count(1)
+_PARSING_STATE_VERSIONS_LOCK = Lock()
+
+
+def _next_parsing_state_version():
+    with _PARSING_STATE_VERSIONS_LOCK:
+        return next(_PARSING_STATE_VERSIONS)
+
+
+DEFAULT_INTERVAL_SPINES = {
+    "hewmp": pythagoras.Interval.parse,
+    "orgone": orgone.Interval.parse,
+    "preed": preed.Interval.parse,
+    "lambda": lambda_bp.Interval.parse,
+    "_custom": None,
+}
+
+DEFAULT_PITCH_SPINES = {
+    "hewmp": pythagoras.Pitch.parse,
+    "orgone": orgone.Pitch.parse,
+    "preed": preed.Pitch.parse,
+    "lambda": lambda_bp.Pitch.parse,
+    "_custom": None,
+}
+
+
+class ParseCache:
+    """
+    Least recently used cache of parsing results with hit and miss counts
+    """
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, compute, *args):
+        """
+        Cached value of key. Calls compute(*args) to fill in a missing value.
+        """
+        result = self.entries.get(key)
+        if result is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return result
+        self.misses += 1
+        result = compute(*args)
+        self.entries[key] = result
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return result
+
+
 class IntervalParser:
-    def __init__(self, inflections=None, et_divisions=Fraction(12), et_divided=Fraction(2), warts=""):
+    """
+    Parser of interval and pitch tokens
+
+    Parsed tokens are memoized in a least recently used cache. The cache keys include a version number
+    that is replaced whenever an attribute affecting the outcome of parsing is assigned.
+    Call invalidate() after modifying the inflections or spines in place.
+
+    All of the state lives on the instance so separate parsers can be used concurrently in different threads.
+    A single parser and its copies are not safe to share between threads.
+    """
+    # Attributes that change the outcome of parsing
+    PARSING_STATE = frozenset(["inflections", "et_divisions", "et_divided", "offset", "up_down_inflection", "lift_drop_inflection"])
+
+    def __init__(self, inflections=None, et_divisions=Fraction(12), et_divided=Fraction(2), warts="", cache_size=1024):
+        self.version = _next_parsing_state_version()
+        self.cache = ParseCache(cache_size)
+        self.chord_cache = ParseCache(cache_size)
         if inflections is None:
             inflections = {
                 "hewmp": DEFAULT_SIGNED_INFLECTIONS.copy(),
@@ -273,44 +376,63 @@ class IntervalParser:
                 "_custom": None,
             }
         self.inflections = inflections
+        self.interval_spines = DEFAULT_INTERVAL_SPINES.copy()
+        self.pitch_spines = DEFAULT_PITCH_SPINES.copy()
         self.et_divisions = et_divisions
         self.et_divided = et_divided
         self.warts = warts
         self.offset = SemiInterval()
         self.comma_list = None
         self.persistence = 5
-        self.up_down_inflection = SemiInterval()
         # Default to half of the Pythagorean comma to spell P8/2 as va4 or ^d5
         # Also gives us the semi-fourth as vha2 or ^hd3
-        self.up_down_inflection.monzo.vector[0] = Fraction(-19, 2)
-        self.up_down_inflection.monzo.vector[1] = Fraction(12, 2)
+        self.up_down_inflection = SemiInterval(SemiMonzo([Fraction(-19, 2), Fraction(12, 2)] + [0] * (len(PRIMES) - 2)))
         # Default to half of the Pythagorean limma to spell P4/2 as >M2 or <m3
-        self.lift_drop_inflection = SemiInterval()
-        self.lift_drop_inflection.monzo.vector[0] = Fraction(8, 2)
-        self.lift_drop_inflection.monzo.vector[1] = Fraction(-5, 2)
-
-    interval_spines = {
-        "hewmp": pythagoras.Interval.parse,
-        "orgone": orgone.Interval.parse,
-        "preed": preed.Interval.parse,
-        "lambda": lambda_bp.Interval.parse,
-        "_custom": None,
-    }
+        self.lift_drop_inflection = SemiInterval(SemiMonzo([Fraction(8, 2), Fraction(-5, 2)] + [0] * (len(PRIMES) - 2)))
+
+    def __setattr__(self, name, value):
+        if name in self.PARSING_STATE:
+            self.invalidate()
+        super().__setattr__(name, value)
+
+    def invalidate(self):
+        """
+        Stop using results parsed so far
+        """
+        self.version = _next_parsing_state_version()
+
+    def copy(self):
+        """
+        Independent parser in the same state sharing the caches of this one
+        """
+        result = self.__class__.__new__(self.__class__)
+        result.__dict__.update(self.__dict__)
+        # The state is unchanged so the version is kept
+        result.__dict__["inflections"] = {
+            notation: None if inflections is None else inflections.copy()
+            for notation, inflections in self.inflections.items()
+        }
+        result.interval_spines = self.interval_spines.copy()
+        result.pitch_spines = self.pitch_spines.copy()
+        return result
 
-    pitch_spines = {
-        "hewmp": pythagoras.Pitch.parse,
-        "orgone": orgone.Pitch.parse,
-        "preed": preed.Pitch.parse,
-        "lambda": lambda_bp.Pitch.parse,
-        "_custom": None,
-    }
+    def __getstate__(self):
+        # Cached results stay in this process
+        state = self.__dict__.copy()
+        state["cache"] = ParseCache(self.cache.maxsize)
+        state["chord_cache"] = ParseCache(self.chord_cache.maxsize)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Versions are only unique within a process
+        self.__dict__["version"] = _next_parsing_state_version()
 
     def calculate_up_down(self):
         wart_str = "{}{}ED{}".format(self.et_divisions, self.warts, self.et_divided)
-        self.up_down_inflection = SemiInterval()
         if wart_str in ups_and_downs.ARROW_INFLECTIONS:
-            base = ups_and_downs.ARROW_INFLECTIONS[wart_str]
-            self.up_down_inflection.monzo.vector[:len(base)] = base
+            base = list(ups_and_downs.ARROW_INFLECTIONS[wart_str])
+            self.up_down_inflection = SemiInterval(SemiMonzo(base + [0] * (len(PRIMES) - len(base))))
         else:
             self.up_down_inflection = SemiInterval(et_to_semimonzo(1, self.et_divisions, self.et_divided))
 
@@ -326,6 +448,18 @@ class IntervalParser:
                 raise ParsingError("Unrecognized absolute pitch {}".format(token))
 
     def parse(self, token, notation="hewmp"):
+        """
+        Parse a token into a ParsedInterval. The result is shared with later parses of the same token.
+        """
+        return self.cache.get((token, notation, self.version), self._parse, token, notation)
+
+    def chord_intervals(self, token):
+        """
+        Memoized version of chord_intervals(token, self)
+        """
+        return self.chord_cache.get((token, self.version), chord_intervals, token, self)
+
+    def _parse(self, token, notation):
         absolute = False
         if token.startswith("@"):
             absolute = True
@@ -456,8 +590,31 @@ def parse_utonal(token, interval_parser):
     return Pattern([Note(interval) for interval in intervals], logical_duration=1)
 
 
-def parse_chord(token, transposition, interval_parser):
-    notation = "hewmp"
+@lru_cache(maxsize=1024)
+def expand_chord_token(token):
+    """
+    Subtokens of a chord symbol and the notation they're in
+    """
+    if token in EXTRA_CHORDS:
+        return tuple(EXTRA_CHORDS[token]), "hewmp"
+    if token in orgone.EXTRA_CHORDS:
+        return tuple(orgone.EXTRA_CHORDS[token]), "orgone"
+    if token in preed.EXTRA_CHORDS:
+        return tuple(preed.EXTRA_CHORDS[token]), "preed"
+    # TODO: Lambda chords
+    subtokens = expand_color_chord(token)
+    if subtokens is not None:
+        return tuple(subtokens), "hewmp"
+    subtokens, notation = expand_chord(token)
+    return tuple(subtokens), notation
+
+
+def chord_intervals(token, interval_parser):
+    """
+    Intervals of a chord relative to its root with inversions and voicings applied
+
+    Absolute pitches in the chord are included as is.
+    """
     inversion = 0
     voicing = None
     interval_classes = []
@@ -491,49 +648,54 @@ def parse_chord(token, transposition, interval_parser):
             raise ParsingError("Unrecognized voicing {}".format(voicing_token))
 
     if ":" in token:
-        result = parse_otonal(token, interval_parser)
-        result.transpose(transposition)
+        result = [note.pitch for note in parse_otonal(token, interval_parser)]
     elif ";" in token:
-        result = parse_utonal(token, interval_parser)
-        result.transpose(transposition)
+        result = [note.pitch for note in parse_utonal(token, interval_parser)]
     else:
-        if token in EXTRA_CHORDS:
-            subtokens = EXTRA_CHORDS[token]
-        elif token in orgone.EXTRA_CHORDS:
-            subtokens = orgone.EXTRA_CHORDS[token]
-            notation = "orgone"
-        elif token in preed.EXTRA_CHORDS:
-            subtokens = preed.EXTRA_CHORDS[token]
-            notation = "preed"
-        # TODO: Lambda chords
-        else:
-            subtokens = expand_color_chord(token)
-            if subtokens is None:
-                subtokens, notation = expand_chord(token)
-        result = Pattern(logical_duration=1)
+        subtokens, notation = expand_chord_token(token)
+        result = []
         for subtoken in subtokens:
             interval = interval_parser.parse(subtoken, notation)
-            pitch = interval.value()
-            if pitch.absolute:
-                result.append(Note(pitch))
-            else:
-                result.append(Note(pitch + transposition))
+            result.append(interval.value())
             interval_classes.append(interval.interval_class)
     for i in range(inversion):
-        result[i].pitch.monzo.vector[0] += 1
+        result[i] = result[i] + octaves_interval(1)
     if inversion:
-        for i in range(len(result)):  #pylint: disable=consider-using-enumerate
-            result[i].pitch.monzo.vector[0] -= 1
+        result = [interval + octaves_interval(-1) for interval in result]
     if voicing is not None:
         for tone, octaves in voicing.items():
-            pitch = result[interval_classes.index(tone)].pitch.copy()
+            index = interval_classes.index(tone)
+            interval = result[index]
             for i, octave in enumerate(octaves):
                 if i == 0:
-                    result[interval_classes.index(tone)].pitch.monzo.vector[0] += octave
+                    result[index] = interval + octaves_interval(octave)
                 else:
-                    result.append(Note(pitch))
-                    result[-1].pitch.monzo.vector[0] += octave
+                    result.append(interval + octaves_interval(octave))
+    return tuple(result)
+
 
+def parse_chord(token, transposition, interval_parser):
+    result = Pattern(logical_duration=1)
+    for interval in interval_parser.chord_intervals(token):
+        if interval.absolute:
+            result.append(Note(interval))
+        else:
+            result.append(Note(interval + transposition))
+    return result
+
+
+def octaves_interval(octaves):
+    return SemiInterval(SemiMonzo([octaves] + [0]*(len(PRIMES)-1)))
+
+
+def comma_reduce_pitch(pitch, comma_list, persistence, cache):
+    """
+    Copy of the pitch with its monzo comma reduced. Residuals and offsets are kept as is.
+    """
+    # TODO: Convert back to Fractions
+    vector = comma_reduce(pitch.monzo.components(), comma_list, persistence, cache)
+    result = pitch.copy()
+    result.monzo = SemiMonzo(vector, pitch.monzo.residual, pitch.monzo.nats)
     return result
 
 
@@ -541,9 +703,12 @@ def comma_reduce_pattern(pattern, comma_list, persistence, cache=None):
     if cache is None:
         cache = {}
     if isinstance(pattern, Note):
-        # TODO: Convert back to Fractions
-        pattern.pitch.monzo.vector = comma_reduce(pattern.pitch.monzo.vector, comma_list, persistence, cache)
-    if isinstance(pattern, Pattern):
+        pattern.pitch = comma_reduce_pitch(pattern.pitch, comma_list, persistence, cache).intern()
+    if isinstance(pattern, RepeatPattern):
+        # Reduce the stored body instead of copies of the repetitions
+        for subpattern in pattern.body:
+            comma_reduce_pattern(subpattern, comma_list, persistence, cache)
+    elif isinstance(pattern, Pattern):
         for subpattern in pattern:
             comma_reduce_pattern(subpattern, comma_list, persistence, cache)
 
@@ -566,53 +731,148 @@ def parse_time(token):
 
 
 class RepeatExpander:
+    """
+    Token stream with section repeats |: ... :|xN resolved
+
+    Each section is buffered until its repeat count is known and then passed on once,
+    delimited by its "|:" and ":|" tokens. The parser can repeat the parsed section on its own
+    or ask for the tokens to be played back again using replay().
+    """
     def __init__(self, lexer, max_repeats=None):
         self.lexer = lexer
         self.max_repeats = max_repeats
+        self.repeated_section = []
+        self.num_repeats = 0
+        self.playback = deque()
 
     def __iter__(self):
-        self.repeated_section = []
-        self.record_mode = False
-        self.playback_mode = False
         return self
 
     def __next__(self):
         while True:
-            if self.playback_mode and self.repeated_section:
-                return self.repeated_section.pop(0)
-            else:
-                token = next(self.lexer)
+            if self.playback:
+                return self.playback.popleft()
+            token = next(self.lexer)
 
             if token.value == "|:":
-                if self.record_mode:
-                    raise ParsingError('Nested "|:"')
-                self.record_mode = True
-                self.playback_mode = False
+                self.record(token)
             elif token.value == ":|":
-                if not self.record_mode:
-                    raise ParsingError('Unmatched ":|"')
-                num_repeats_token = self.lexer.peek()
-                if not num_repeats_token.is_end() and num_repeats_token.value.startswith("x"):
-                    num_repeats = int(num_repeats_token.value[1:])
-                    if self.max_repeats is not None and num_repeats > self.max_repeats:
-                        raise ParsingError("Too many section repeats")
-                    self.repeated_section *= num_repeats
-                    next(self.lexer)
-                else:
-                    self.repeated_section *= 2
-                self.record_mode = False
-                self.playback_mode = True
+                raise ParsingError('Unmatched ":|"')
             else:
-                if self.record_mode:
-                    if token.is_end() or token.value == TRACK_START:
-                        raise ParsingError('Missing ":|"')
-                    self.repeated_section.append(token)
-                else:
-                    return token
+                return token
+
+    def record(self, start_token):
+        section = []
+        while True:
+            token = next(self.lexer)
+            if token.value == "|:":
+                raise ParsingError('Nested "|:"')
+            if token.value == ":|":
+                end_token = token
+                break
+            if token.is_end() or token.value == TRACK_START:
+                raise ParsingError('Missing ":|"')
+            section.append(token)
+
+        num_repeats_token = self.lexer.peek()
+        if not num_repeats_token.is_end() and num_repeats_token.value.startswith("x"):
+            num_repeats = int(num_repeats_token.value[1:])
+            if self.max_repeats is not None and num_repeats > self.max_repeats:
+                raise ParsingError("Too many section repeats")
+            next(self.lexer)
+        else:
+            num_repeats = 2
+
+        self.repeated_section = section
+        self.num_repeats = num_repeats
+        if num_repeats:
+            self.playback.append(start_token)
+            self.playback.extend(section)
+            self.playback.append(end_token)
+
+    def replay(self, num_repeats):
+        """
+        Play back the tokens of the last section num_repeats more times
+        """
+        for _ in range(num_repeats):
+            self.playback.extend(self.repeated_section)
 
     @property
     def done(self):
-        return self.lexer.done and not self.repeated_section
+        return self.lexer.done and not self.playback
+
+
+def _is_self_contained(section, notation):
+    """
+    Check if parsing the tokens of a section leaves the parser in the state it started in
+    and doesn't touch anything parsed before the section
+    """
+    depth = 0
+    first = None
+    for token_obj in section:
+        token = token_obj.value
+        if token in CONFIGS or token.startswith("@") or token == "T":
+            return False
+        if token in ("(", "[", "{"):
+            depth += 1
+        elif token in (")", "]", "}"):
+            depth -= 1
+            if depth < 0:
+                return False
+        elif depth == 0 and token.startswith("~"):
+            return False
+        if first is None and token not in ("\n", "|", "|>", ">|"):
+            first = token
+    if depth or first is None or section[-1].value in ("&", "+", "="):
+        return False
+
+    # The section needs to start with something that plays for any following
+    # ties, repeats or modifiers to refer to
+    if first == "(":
+        return True
+    if first in (")", "]", "}", "&", "+", "=", ",") or first[0] in "=~\"" or first.startswith("T!"):
+        return False
+    if all(mt in TEMPORAL_MINI_LANGUAGE for mt in first) or first[0] in ARTICULATIONS:
+        return False
+    if first[0] in ("p", "f") or first.startswith("mp") or first.startswith("mf"):
+        return False
+    if notation in ("percussion", "percussion!"):
+        if first in PERCUSSION_SHORTHANDS and notation == "percussion":
+            return True
+        return first[0] in PERCUSSION_SHORTHANDS
+    return True
+
+
+def repeat_section(pattern, num_repeats, section_start, current_pitch, current_notation, section):
+    """
+    Repeat the subpatterns parsed since the start of a section without parsing them again
+
+    The earlier repetitions share a single copy of the section. The last repetition keeps the parsed subpatterns
+    so that anything following the section refers to them like it would after replaying the tokens.
+
+    Returns False if the section cannot be repeated this way.
+    """
+    index, start_time, start_pitch, notation = section_start
+    span = pattern.t - start_time
+    if span <= 0 or current_notation != notation or current_pitch != start_pitch:
+        return False
+    if not _is_self_contained(section, notation):
+        return False
+    if num_repeats <= 0:
+        return True
+    body = pattern.subpatterns[index:]
+    repetitions = RepeatedSection(
+        [subpattern.retime(subpattern.time - start_time, subpattern.duration) for subpattern in body],
+        num_repeats,
+        span,
+        start_time
+    )
+    offset = span * num_repeats
+    for subpattern in body:
+        subpattern.time += offset
+    pattern.insert(index, repetitions)
+    pattern.t += offset
+    return True
 
 
 ARTICULATIONS = {
@@ -658,9 +918,11 @@ def parse_track(lexer, default_config, max_repeats=None):
     config.update(default_config)
     config["tuning"] = config["tuning"].copy()
     config["tempo"] = config["tempo"].copy()
+    initial_tempo = config["tempo"]
     config["flags"] = list(config["flags"])
     current_notation = "hewmp"
     max_polyphony = None
+    section_start = None
 
     def parse_enharmonic(token):
         arrow = token[0]
@@ -697,6 +959,22 @@ def parse_track(lexer, default_config, max_repeats=None):
         if token == TRACK_START:
             break
 
+        if token == "|:":
+            section_start = None
+            if not config_mode and not time_mode and not stack and owner_pattern is None and transposed_pattern is None and concatenated_pattern is None:
+                section_start = (len(pattern), pattern.t, current_pitch, current_notation)
+            continue
+        if token == ":|":
+            num_repeats = lexer.num_repeats - 1
+            if (
+                    section_start is None or config_mode or time_mode or stack or owner_pattern is not None or
+                    transposed_pattern is not None or concatenated_pattern is not None or
+                    not repeat_section(pattern, num_repeats, section_start, current_pitch, current_notation, lexer.repeated_section)
+                ):
+                lexer.replay(num_repeats)
+            section_start = None
+            continue
+
         if token in CONFIGS:
             config_key = token[:-1]
             config_mode = True
@@ -710,18 +988,25 @@ def parse_track(lexer, default_config, max_repeats=None):
                     interval_parser.set_base_pitch(subtoken.strip(), current_notation)
             if config_key == "T":
                 tuning_name = token.strip().lower()
-                if tuning_name in TEMPERAMENTS:
-                    comma_list, subgroup = TEMPERAMENTS[tuning_name]
-                    subgroup = subgroup.split(".")
-                    config["tuning"].subgroup = [interval_parser.parse(basis_vector).value().monzo.float_vector() for basis_vector in subgroup]
-                    config["tuning"].comma_list = [interval_parser.parse(comma).value().monzo.float_vector() for comma in comma_list]
+                data = temperament_data.lookup(tuning_name)
+                if data is not None:
+                    config["tuning"].subgroup = data["subgroup"]
+                    config["tuning"].comma_list = data["comma_list"]
+                    for enharmonic in data["enharmonics"]:
+                        parse_enharmonic(enharmonic)
                 else:
-                    config["tuning"].comma_list = []
-                    for name in tuning_name.split("&"):
-                        config["tuning"].comma_list.append(parse_color_comma(name.strip()))
-                    if config["SG"] == "auto":
-                        config["tuning"].subgroup = infer_subgroup(config["tuning"].comma_list)
-                assign_enharmonics()
+                    if tuning_name in TEMPERAMENTS:
+                        comma_list, subgroup = TEMPERAMENTS[tuning_name]
+                        subgroup = subgroup.split(".")
+                        config["tuning"].subgroup = [interval_parser.parse(basis_vector).value().monzo.float_vector() for basis_vector in subgroup]
+                        config["tuning"].comma_list = [interval_parser.parse(comma).value().monzo.float_vector() for comma in comma_list]
+                    else:
+                        config["tuning"].comma_list = []
+                        for name in tuning_name.split("&"):
+                            config["tuning"].comma_list.append(parse_color_comma(name.strip()))
+                        if config["SG"] == "auto":
+                            config["tuning"].subgroup = infer_subgroup(config["tuning"].comma_list)
+                    assign_enharmonics()
             if config_key == "CL":
                 comma_list = [comma.strip() for comma in token.split(",")]
                 config["tuning"].comma_list = [interval_parser.parse(comma).value().monzo.float_vector() for comma in comma_list]
@@ -737,6 +1022,10 @@ def parse_track(lexer, default_config, max_repeats=None):
             if config_key == "CRD":
                 config[config_key] = int(token)
                 interval_parser.persistence = int(token)
+            if config_key in ("L", "Q", "G") and pattern.t > 0 and pattern.last is not config["tempo"]:
+                # Tempo change in the middle of the track
+                config["tempo"] = config["tempo"].retime(pattern.t, 0)
+                pattern.append(config["tempo"])
             if config_key == "L":
                 config["tempo"].beat_unit = Fraction(token)
             if config_key == "Q":
@@ -747,6 +1036,7 @@ def parse_track(lexer, default_config, max_repeats=None):
                 span_token, pattern_token = token.split("=")
                 config["tempo"].groove_span = Fraction(span_token)
                 config["tempo"].groove_pattern = list(map(Fraction, filter(None, pattern_token.split(" "))))
+                config["tempo"].calculate_groove()
             if config_key == "V":
                 track_volume = TrackVolume(Fraction(token), pattern.t)
                 pattern.append(track_volume)
@@ -794,9 +1084,10 @@ def parse_track(lexer, default_config, max_repeats=None):
                 # TODO: Allow frequency offsets here as well (ref #78)
                 for arrow in SignedArrow:
                     if config_key[1] == arrow.value[0]:
-                        interval_parser.inflections[current_notation][arrow] = inflection.monzo.vector
+                        interval_parser.inflections[current_notation][arrow] = inflection.monzo.components()
                     if config_key[1] == arrow.value[1]:
-                        interval_parser.inflections[current_notation][arrow] = -inflection.monzo.vector
+                        interval_parser.inflections[current_notation][arrow] = -inflection.monzo.components()
+                interval_parser.invalidate()
             if config_key == "WF":
                 name = token.strip()
                 pattern.append(Waveform(name, pattern.t))
@@ -832,6 +1123,7 @@ def parse_track(lexer, default_config, max_repeats=None):
                 interval_parser.inflections["_custom"] = inflections
                 interval_parser.interval_spines["_custom"] = intervalCls.parse
                 interval_parser.pitch_spines["_custom"] = pitchCls.parse
+                interval_parser.invalidate()
                 current_notation = "_custom"
                 config["N"] = current_notation
                 pattern.append(ContextChange(current_notation, pattern.t))
@@ -884,12 +1176,11 @@ def parse_track(lexer, default_config, max_repeats=None):
                 pattern.t = pattern.last.time
                 pattern.t += pattern.last.duration
             elif token.lower().startswith("x"):
-                pattern.last = patternify(pattern.last)
                 pattern.t -= pattern.last.duration
                 num_repeats = int(token[1:])
                 if max_repeats is not None and num_repeats > max_repeats:
                     raise ParsingError("Too many repeats")
-                pattern.last.repeat(num_repeats, affect_duration=(token.startswith("X")))
+                pattern.last = patternify(pattern.last).repeat(num_repeats, affect_duration=(token.startswith("X")))
                 pattern.t += pattern.last.duration
             elif isinstance(pattern.last, Pattern):
                 if token == "R":
@@ -907,6 +1198,9 @@ def parse_track(lexer, default_config, max_repeats=None):
                 elif token == "?":
                     pattern.last.stretch_subpatterns()
                 elif token == "a" or "G" in token or "CA" in token or "H" in token or "E" in token or "S" in token:
+                    if isinstance(pattern.last, RepeatPattern):
+                        # The onsets are retimed individually
+                        pattern.last.write_out()
                     num_onsets = len(pattern.last)
 
                     if "C" in token:
@@ -1020,7 +1314,9 @@ def parse_track(lexer, default_config, max_repeats=None):
             owner_pattern = pattern
             pattern = Pattern()
         elif token == "}":
-            owner_pattern.last.properties = pattern
+            # Properties only affect patterns
+            if isinstance(owner_pattern.last, Pattern):
+                owner_pattern.last.properties = pattern
             pattern = owner_pattern
             owner_pattern = None
         elif token == "&":
@@ -1174,10 +1470,13 @@ def parse_track(lexer, default_config, max_repeats=None):
                         pitch = current_pitch + interval
                         if moves_root:
                             current_pitch = pitch
+                    if "comma_reduction_cache" in config:
+                        reduced_pitch = comma_reduce_pitch(current_pitch, config["tuning"].comma_list, config["CRD"], config["comma_reduction_cache"])
+                        if pitch is current_pitch:
+                            pitch = reduced_pitch
+                        current_pitch = reduced_pitch
                     note = Note(pitch, time=pattern.t)
                     pattern.append(note)
-                    if "comma_reduction_cache" in config:  # TODO: Convert to Fractions
-                        current_pitch.monzo.vector = comma_reduce(current_pitch.monzo.vector, config["tuning"].comma_list, persistence=config["CRD"], cache=config["comma_reduction_cache"])
                     pattern.t += note.duration
 
                 if concatenated_pattern:
@@ -1191,6 +1490,7 @@ def parse_track(lexer, default_config, max_repeats=None):
     pattern.insert(0, Articulation(ARTICULATIONS[";"]))
     pattern.insert(0, Dynamic(DYNAMICS["mf"]))
 
+    config["tempo"] = initial_tempo
     pattern.insert(0, config["tempo"])
 
     if "unmapET" in config["flags"]:
@@ -1206,29 +1506,256 @@ def parse_track(lexer, default_config, max_repeats=None):
     return pattern, config
 
 
-def parse_file(file, max_repeats=None):
-    if not file.seekable():
-        file = StringIO(file.read())
+def iter_tracks(file, max_repeats=None):
+    """
+    Parse tracks one at a time as the input is read
+
+    Yields the global track and config first, followed by each track and its config.
+    The input is consumed lazily so non-seekable streams don't need to be read in full
+    before the first track is available.
+    """
     lexer = RepeatExpander(Lexer(file), max_repeats=max_repeats)
-    global_track, global_config = parse_track(lexer, DEFAULT_CONFIG, max_repeats=max_repeats)
-    results = [global_track]
+    global_track, global_config = parse_track(lexer, default_config(), max_repeats=max_repeats)
+    yield global_track, global_config
     while not lexer.done:
-        pattern, _ = parse_track(lexer, global_config, max_repeats=max_repeats)
+        yield parse_track(lexer, global_config, max_repeats=max_repeats)
+
+
+def split_tracks(text):
+    """
+    Split source text on track boundaries
+
+    Returns a list of (source, index, line, column) with the global track first. The source of a track
+    includes the "---" ending it and the rest give the position where the source starts in the text.
+    """
+    lexer = Lexer(text)
+    result = []
+    start = (0, 0, 0, 0)
+    for token in lexer:
+        if token.value == TRACK_START:
+            position, index, line, column = start
+            result.append((text[position:lexer.position], index, line, column))
+            start = (lexer.position, lexer.index, lexer.line, lexer.column)
+    position, index, line, column = start
+    result.append((text[position:], index, line, column))
+    return result
+
+
+def parse_track_source(source, index, line, column, default_config, max_repeats=None):
+    """
+    Parse a track produced by split_tracks
+    """
+    # Only the global track starts at the beginning of a line
+    lexer = Lexer(source, index, line, column, on_a_new_line=(index == 0))
+    return parse_track(RepeatExpander(lexer, max_repeats=max_repeats), default_config, max_repeats=max_repeats)
+
+
+def _is_picklable(obj):
+    try:
+        pickle.dumps(obj)
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return False
+    return True
+
+
+# Config and settings of a worker process in parse_file
+_worker_state = {}
+
+
+def _initialize_worker(global_config, max_repeats):
+    _worker_state["config"] = global_config
+    _worker_state["max_repeats"] = max_repeats
+
+
+def _parsing_state(config):
+    """
+    Snapshot of the interval parser in config for detecting tracks that change it
+    """
+    interval_parser = config.get("interval_parser")
+    if interval_parser is None:
+        return None
+    return (interval_parser.version, interval_parser.warts, interval_parser.persistence)
+
+
+def _parse_track_in_worker(source, index, line, column):
+    """
+    Parse a track in a worker process.
+
+    Returns the pickled pattern or None if it can't be sent back and whether the track changed the interval parser.
+    """
+    # Each task starts from the state of the interval parser after the global track
+    config = dict(_worker_state["config"])
+    if "interval_parser" in config:
+        config["interval_parser"] = config["interval_parser"].copy()
+    state = _parsing_state(config)
+    pattern, _ = parse_track_source(source, index, line, column, config, _worker_state["max_repeats"])
+    changed = _parsing_state(config) != state
+    try:
+        return pickle.dumps(pattern, pickle.HIGHEST_PROTOCOL), changed
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return None, changed
+
+
+def parse_file(file, max_repeats=None, workers=None, cache_dir=None):
+    """
+    Parse a file or a string into a list of patterns and the global config
+
+    With more than one worker the tracks following the global track are parsed concurrently in a pool of
+    worker processes. The results are the same as when parsing sequentially. Changes to the interval parser
+    carry over to later tracks so the remaining tracks are parsed sequentially after a track that makes them.
+
+    If cache_dir is given the results are stored in that directory and loaded from there when the same
+    source is parsed again. A DiskCache instance may be passed instead of a directory.
+    Cached results are unpickled so the directory must be trusted.
+    """
+    if cache_dir is not None:
+        cache = cache_dir if isinstance(cache_dir, DiskCache) else DiskCache(cache_dir)
+        text = file if isinstance(file, str) else file.read()
+        key = cache.key(text, max_repeats)
+        result = cache.get(key)
+        if result is None:
+            result = parse_file(text, max_repeats=max_repeats, workers=workers)
+            cache.put(key, result)
+        return result
+    if workers is not None and workers > 1:
+        return _parse_file_in_parallel(file, max_repeats, workers)
+    tracks = iter_tracks(file, max_repeats=max_repeats)
+    global_track, global_config = next(tracks)
+    results = [global_track]
+    for pattern, _ in tracks:
         results.append(pattern)
     return results, global_config
 
 
-def parse_text(text, max_repeats=None):
-    return parse_file(StringIO(text), max_repeats=max_repeats)
+def _parse_file_in_parallel(file, max_repeats, workers):
+    text = file if isinstance(file, str) else file.read()
+    sources = split_tracks(text)
+    global_track, global_config = parse_track_source(*sources[0], default_config(), max_repeats)
+    results = [global_track]
+    sources = sources[1:]
+
+    # Custom spines can't be sent to other processes
+    if len(sources) < 2 or not _is_picklable(global_config):
+        for source in sources:
+            results.append(parse_track_source(*source, global_config, max_repeats)[0])
+        return results, global_config
+
+    state = _parsing_state(global_config)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_initialize_worker, initargs=(global_config, max_repeats)) as executor:
+        futures = [executor.submit(_parse_track_in_worker, *source) for source in sources]
+        for index, (source, future) in enumerate(zip(sources, futures)):
+            data, changed = future.result()
+            if data is not None and not changed:
+                results.append(pickle.loads(data))
+                continue
+            results.append(parse_track_source(*source, global_config, max_repeats)[0])
+            if _parsing_state(global_config) != state:
+                # The rest were parsed from an outdated interval parser
+                for remaining in futures[index + 1:]:
+                    remaining.cancel()
+                for remaining in sources[index + 1:]:
+                    results.append(parse_track_source(*remaining, global_config, max_repeats)[0])
+                break
+    return results, global_config
+
+
+def parse_text(text, max_repeats=None, workers=None, cache_dir=None):
+    return parse_file(text, max_repeats=max_repeats, workers=workers, cache_dir=cache_dir)
+
+
+class IncrementalParse:
+    """
+    Result of parse_incremental
+
+    The patterns and config are the same as those returned by parse_file. The hashes identify the source
+    of each track and reused lists the indices of the patterns that were taken from the previous result.
+    The interval parser is in its state after the global track and independent tells which tracks were
+    parsed from that state without changing it.
+    """
+    def __init__(self, patterns, config, hashes, max_repeats, reused, interval_parser=None, independent=None):
+        self.patterns = patterns
+        self.config = config
+        self.hashes = hashes
+        self.max_repeats = max_repeats
+        self.reused = reused
+        self.interval_parser = interval_parser
+        if independent is None:
+            independent = [False] * len(patterns)
+        self.independent = independent
+
+    def __iter__(self):
+        return iter((self.patterns, self.config))
+
+
+def track_hashes(sources):
+    """
+    Hashes of the track sources produced by split_tracks ignoring the "---" that ends a track
+    """
+    result = []
+    for index, (source, _, _, _) in enumerate(sources):
+        if index < len(sources) - 1:
+            source = source[:-len(TRACK_START)]
+        result.append(blake2b(source.encode("utf-8"), digest_size=16).digest())
+    return result
+
+
+def parse_incremental(text, previous=None, max_repeats=None):
+    """
+    Parse text re-using the patterns of tracks whose source is unchanged since the previous result
+
+    Everything is parsed again if the global track changes. A track is only re-used if it didn't change
+    the interval parser and no track before it did. Unchanged tracks share their Pattern objects with the
+    previous result. Returns an IncrementalParse.
+    """
+    sources = split_tracks(text)
+    hashes = track_hashes(sources)
+    available = defaultdict(list)
+    if (previous is not None and previous.max_repeats == max_repeats and previous.hashes[0] == hashes[0] and
+            previous.interval_parser is not None):
+        global_track = previous.patterns[0]
+        # Later tracks changed the interval parser of the previous config
+        global_config = dict(previous.config)
+        global_config["interval_parser"] = previous.interval_parser.copy()
+        reused = [0]
+        for hash_, pattern, independent in zip(previous.hashes[1:], previous.patterns[1:], previous.independent[1:]):
+            if independent:
+                available[hash_].append(pattern)
+    else:
+        global_track, global_config = parse_track_source(*sources[0], default_config(), max_repeats)
+        reused = []
+    interval_parser = global_config["interval_parser"].copy()
+    state = _parsing_state(global_config)
+    patterns = [global_track]
+    independent = [True]
+    for index, (source, hash_) in enumerate(zip(sources[1:], hashes[1:]), 1):
+        pristine = _parsing_state(global_config) == state
+        if pristine and available[hash_]:
+            patterns.append(available[hash_].pop(0))
+            reused.append(index)
+            independent.append(True)
+        else:
+            patterns.append(parse_track_source(*source, global_config, max_repeats)[0])
+            independent.append(pristine and _parsing_state(global_config) == state)
+    return IncrementalParse(patterns, global_config, hashes, max_repeats, reused, interval_parser, independent)
 
 
 def realize(patterns, preserve_spacers=False):
+    # Syncing only needs the control events. Realizing then skips the parts outside of the playheads.
+    flats = [list(pattern.iter_flat(controls_only=True)) for pattern in patterns]
     result = []
-    for pattern, (start_time, end_time) in zip(patterns, sync_playheads(patterns)):
+    for pattern, (start_time, end_time) in zip(patterns, sync_playheads(patterns, flats)):
         result.append(pattern.realize(start_time=start_time, end_time=end_time, preserve_spacers=preserve_spacers))
     return result
 
 
+def realize_tables(patterns, preserve_spacers=False):
+    flats = [list(pattern.iter_flat(controls_only=True)) for pattern in patterns]
+    result = []
+    for pattern, (start_time, end_time) in zip(patterns, sync_playheads(patterns, flats)):
+        result.append(pattern.realize_table(start_time=start_time, end_time=end_time, preserve_spacers=preserve_spacers))
+    return result
+
+
 def simplify_tracks(data):
     used = array([False] * len(PRIMES))
 
@@ -1258,28 +1785,36 @@ def simplify_tracks(data):
 
 def prune(patterns):
     result = []
-    for pattern in realize(patterns):
+    for table in realize_tables(patterns):
         events = []
         trackVolume = 1.0
         waveform = None
-        for event in pattern.to_json()["events"]:
-            if event["type"] == "note":
+        real_times = table.real_times.tolist()
+        real_gate_lengths = table.real_gate_lengths.tolist()
+        real_frequencies = table.real_frequencies.tolist()
+        phases = (table.phases * 360 / (2*pi)).tolist()
+        indices = table.indices.tolist()
+        for row, kind in enumerate(table.kinds.tolist()):
+            if kind == EventTable.NOTE:
                 events.append({
                     "type": "n",
-                    "t": event["realTime"],
-                    "d": event["realGateLength"],
-                    "v": float(Fraction(event["velocity"])),
-                    "f": event["realFrequency"],
-                    "p": event["phase"],
+                    "t": real_times[row],
+                    "d": real_gate_lengths[row],
+                    "v": float(table.velocities[row]),
+                    "f": real_frequencies[row],
+                    "p": phases[row],
                 })
-            if event["type"] == "percussion":
+                continue
+            if kind == EventTable.PERCUSSION:
                 events.append({
                     "type": "p",
-                    "t": event["realTime"],
-                    "d": event["realGateLength"],
-                    "v": float(Fraction(event["velocity"])),
-                    "i": event["index"],
+                    "t": real_times[row],
+                    "d": real_gate_lengths[row],
+                    "v": float(table.velocities[row]),
+                    "i": None if indices[row] < 0 else indices[row],
                 })
+                continue
+            event = table.extras[row].to_json()
             if event["type"] == "trackVolume":
                 trackVolume = float(Fraction(event["volume"]));
             if event["type"] == "waveform":
@@ -1293,7 +1828,7 @@ def prune(patterns):
                     "sustain": float(Fraction(event["sustain"])),
                     "release": float(Fraction(event["release"])),
                 })
-        max_polyphony = pattern.max_polyphony
+        max_polyphony = table.max_polyphony
         if max_polyphony is None:
             max_polyphony = 15
         result.append({
@@ -1351,6 +1886,11 @@ def tokenize_pattern(pattern, _tokenize_chord, _tokenize_pitch, main=False, abso
         return "V:{}\n".format(pattern.volume)
     if isinstance(pattern, UserMessage):
         return pattern.escape()
+    if isinstance(pattern, Tempo):
+        result = "Q:{}={}\nL:{}\n".format(pattern.tempo_unit, Fraction(60) / pattern.tempo_duration, pattern.beat_unit)
+        if pattern.groove_span is not None:
+            result += "G:{}={}\n".format(pattern.groove_span, " ".join(map(str, pattern.groove_pattern)))
+        return result
     if isinstance(pattern, Articulation):
         for symbol, value in ARTICULATIONS.items():
             if value == pattern.gate_ratio:
@@ -1372,7 +1912,17 @@ def tokenize_pattern(pattern, _tokenize_chord, _tokenize_pitch, main=False, abso
                 suffix = "[{}]".format(pattern.duration)
         elif absolute_time:
             suffix = "[@{}]".format(pattern.time)
+    if isinstance(pattern, RepeatPattern):
+        pattern = pattern.expand()
     if isinstance(pattern, Pattern):
+        if any(isinstance(subpattern, RepeatedSection) for subpattern in pattern):
+            subpatterns = []
+            for subpattern in pattern:
+                if isinstance(subpattern, RepeatedSection):
+                    subpatterns.extend(subpattern.inline())
+                else:
+                    subpatterns.append(subpattern)
+            pattern = Pattern(subpatterns, pattern.time, pattern.duration, pattern.logical_duration)
         pattern.simplify()
         if pattern.is_chord() and _tokenize_chord is not None:
             try:
@@ -1386,6 +1936,8 @@ def tokenize_pattern(pattern, _tokenize_chord, _tokenize_pitch, main=False, abso
             force_tokenize = False
             if isinstance(subpattern, (ProgramChange, ContextChange, TrackVolume, Spacer, UserMessage)):
                 force_tokenize = True
+            if isinstance(subpattern, Tempo) and not (main and subpattern.time == 0):
+                force_tokenize = True
             if isinstance(subpattern, Articulation):
                 force_tokenize = True
                 if main and subpattern.time == 0 and subpattern.gate_ratio == ARTICULATIONS[";"]:
@@ -1498,53 +2050,108 @@ def midi_velocity(velocity):
     return int(round(float(127 * Fraction(velocity))))
 
 
+MIDI_DEFAULT_TEMPO = 500000
+
+def midi_tempo(tempo):
+    """
+    Microseconds per quarter note
+    """
+    return int(round(10**6 * tempo.tempo_duration / (4 * tempo.tempo_unit)))
+
+
+def midi_tick_converter(tempo_changes, resolution):
+    """
+    Converter from real time and duration in seconds to MIDI ticks under (real_time, midi_tempo) changes.
+
+    The resolution is in ticks per second at the MIDI default tempo.
+    """
+    real_times = [real_time for real_time, _ in tempo_changes]
+    ratios = [MIDI_DEFAULT_TEMPO / tempo for _, tempo in tempo_changes]
+    ticks = [0]
+    for i in range(1, len(tempo_changes)):
+        ticks.append(ticks[-1] + resolution * (real_times[i] - real_times[i-1]) * ratios[i-1])
+
+    def convert(real_time, real_duration=0):
+        i = max(bisect_right(real_times, real_time) - 1, 0)
+        start = ticks[i] + resolution * (real_time - real_times[i]) * ratios[i]
+        j = max(bisect_right(real_times, real_time + real_duration) - 1, 0)
+        if i == j:
+            return start, resolution * real_duration * ratios[i]
+        return start, ticks[j] + resolution * (real_time + real_duration - real_times[j]) * ratios[j] - start
+
+    return ticks, convert
+
+
 def tracks_to_midi(tracks, freq_to_midi=freq_to_midi_12, reserve_channel_10=True, transpose=0, resolution=960):
     """
     Save tracks as a midi file with per-channel pitch-bend for microtones.
 
     Assumes that A4 is in standard tuning 440Hz.
     """
-    midi = mido.MidiFile()
+    midi = mido.MidiFile(ticks_per_beat=resolution // 2)
+    tables = [table for table in realize_tables(tracks) if table.duration > 0]
+    # The tempo map of the first track is used for the whole file. Other tracks keep their own timing in real time.
+    tempo_changes = []
+    if tables:
+        for row, event in sorted(tables[0].extras.items()):
+            if isinstance(event, Tempo):
+                tempo = midi_tempo(event)
+                if tempo_changes and tempo_changes[-1][0] == event.real_time:
+                    tempo_changes[-1] = (event.real_time, tempo)
+                elif not tempo_changes or tempo_changes[-1][1] != tempo:
+                    tempo_changes.append((event.real_time, tempo))
+    if not tempo_changes:
+        tempo_changes.append((0.0, MIDI_DEFAULT_TEMPO))
+    tempo_ticks, to_ticks = midi_tick_converter(tempo_changes, resolution)
+
     channel_offset = 0
-    for pattern in realize(tracks):
-        max_polyphony = pattern.max_polyphony
+    for table in tables:
+        max_polyphony = table.max_polyphony
         if max_polyphony is None:
             max_polyphony = 15
-        if pattern.duration <= 0:
-            continue
         track = mido.MidiTrack()
         midi.tracks.append(track)
 
-        data = pattern.to_json()
+        real_times = table.real_times.tolist()
+        real_durations = table.real_durations.tolist()
+        real_gate_lengths = table.real_gate_lengths.tolist()
+        real_frequencies = table.real_frequencies.tolist()
+        indices = table.indices.tolist()
         events = []
         time_offset = 0
-        for event in data["events"]:
-            if event["type"] in ("note", "percussion", "programChange", "contextChange") or event.get("subtype") == "controlChange":
-                time = int(round(resolution * event["realTime"]))
-            if event["type"] == "note":
-                events.append((time, event, event["realFrequency"], midi_velocity(event["velocity"])))
-            if event["type"] == "percussion":
-                events.append((time, event, None, midi_velocity(event["velocity"])))
-            if event["type"] == "programChange" or event.get("subtype") == "controlChange":
+        for row, kind in enumerate(table.kinds.tolist()):
+            if kind == EventTable.NOTE:
+                time = int(round(to_ticks(real_times[row])[0]))
+                events.append((time, row, real_frequencies[row], midi_velocity(table.velocities[row])))
+                continue
+            if kind == EventTable.PERCUSSION:
+                time = int(round(to_ticks(real_times[row])[0]))
+                events.append((time, row, None, midi_velocity(table.velocities[row])))
+                continue
+            event = table.extras[row]
+            if isinstance(event, (ProgramChange, ControlChange, ContextChange)):
+                time = int(round(to_ticks(event.real_time)[0]))
+            if isinstance(event, (ProgramChange, ControlChange)):
                 change_time = time - 1
                 if change_time < 0:
                     time_offset = -change_time
-                events.append((change_time, event, None, None))
-            if event["type"] == "contextChange":
-                events.append((time - 1.1, event, None, None))
+                events.append((change_time, row, None, None))
+            if isinstance(event, ContextChange):
+                events.append((time - 1.1, row, None, None))
         presorted = events
         events = []
         channel = channel_offset
         key = lambda t: (t[0], t[2], t[3])
-        for time, event, frequency, velocity in sorted(presorted, key=key):
-            if event["type"] in ("note", "percussion"):
-                duration = int(round(resolution * event["realGateLength"]))
+        for time, row, frequency, velocity in sorted(presorted, key=key):
+            kind = table.kinds[row]
+            if kind == EventTable.NOTE or kind == EventTable.PERCUSSION:
+                duration = int(round(to_ticks(real_times[row], real_gate_lengths[row])[1]))
                 if duration <= 0:
                     continue
-                max_duration = int(resolution * event["realDuration"])
+                max_duration = int(to_ticks(real_times[row], real_durations[row])[1])
                 if duration >= max_duration:
                     duration = max_duration - 1
-            if event["type"] == "note":
+            if kind == EventTable.NOTE:
                 index, bend = freq_to_midi(frequency)
                 index += transpose
                 channel_ = channel
@@ -1553,8 +2160,8 @@ def tracks_to_midi(tracks, freq_to_midi=freq_to_midi_12, reserve_channel_10=True
                 events.append((time, "note_on", index, bend, velocity, channel_))
                 events.append((time + duration, "note_off", index, bend, velocity, channel_))
                 channel = ((channel - channel_offset + 1) % max_polyphony) + channel_offset
-            if event["type"] == "percussion":
-                index = event["index"]
+            elif kind == EventTable.PERCUSSION:
+                index = indices[row]
                 if reserve_channel_10:
                     channel_ = 9
                 else:
@@ -1562,12 +2169,17 @@ def tracks_to_midi(tracks, freq_to_midi=freq_to_midi_12, reserve_channel_10=True
                     channel = ((channel - channel_offset + 1) % max_polyphony) + channel_offset
                 events.append((time, "note_on", index, None, velocity, channel_))
                 events.append((time + duration, "note_off", index, None, velocity, channel_))
-            if event["type"] == "programChange":
-                events.append((time, "program_change", event["program"], None, None, None))
-            if event.get("subtype") == "controlChange":
-                events.append((time, "control_change", event["control"], None, event["value"], None))
-            if event["type"] == "contextChange":
-                events.append((time, "_context_change", event["name"], None, None, None))
+            else:
+                event = table.extras[row]
+                if isinstance(event, ProgramChange):
+                    events.append((time, "program_change", event.program, None, None, None))
+                if isinstance(event, ControlChange):
+                    events.append((time, "control_change", event.control, None, event.value, None))
+                if isinstance(event, ContextChange):
+                    events.append((time, "_context_change", event.name, None, None, None))
+        if table is tables[0]:
+            for tick, (_, tempo) in zip(tempo_ticks, tempo_changes):
+                events.append((int(round(tick)), "_set_tempo", tempo, None, None, None))
 
         default_range = []
         for ch in range(max_polyphony):
@@ -1587,6 +2199,10 @@ def tracks_to_midi(tracks, freq_to_midi=freq_to_midi_12, reserve_channel_10=True
             time += time_offset
             if msg_type == "_context_change":
                 current_context = index
+            elif msg_type == "_set_tempo":
+                message = mido.MetaMessage("set_tempo", tempo=index, time=(time - current_time))
+                track.append(message)
+                current_time = time
             elif msg_type == "program_change":
                 for ch in channel_ranges.get(current_context, default_range):
                     message = mido.Message(msg_type, program=index, channel=ch, time=(time - current_time))
@@ -1605,7 +2221,7 @@ def tracks_to_midi(tracks, freq_to_midi=freq_to_midi_12, reserve_channel_10=True
                 message = mido.Message(msg_type, note=index, channel=channel, velocity=velocity, time=(time - current_time))
                 track.append(message)
                 current_time = time
-        target_time = int(round(resolution * data["realDuration"]))
+        target_time = int(round(to_ticks(table.real_duration)[0]))
         message = mido.MetaMessage("end_of_track", time=max(0, target_time - current_time))
         track.append(message)
 
@@ -1614,11 +2230,32 @@ def tracks_to_midi(tracks, freq_to_midi=freq_to_midi_12, reserve_channel_10=True
     return midi
 
 
+def cache_statistics(config):
+    """
+    Hit and miss counts of the caches used while parsing
+    """
+    interval_parser = config["interval_parser"]
+    return {
+        "intervals": (interval_parser.cache.hits, interval_parser.cache.misses),
+        "chords": (interval_parser.chord_cache.hits, interval_parser.chord_cache.misses),
+        "chord symbols": (expand_chord_token.cache_info().hits, expand_chord_token.cache_info().misses),
+        "mappings": (MAPPING_CACHE.hits, MAPPING_CACHE.misses),
+    }
+
+
+def print_cache_statistics(config, file):
+    for name, (hits, misses) in cache_statistics(config).items():
+        total = hits + misses
+        ratio = hits / total if total else 0
+        file.write("{}: {} hits, {} misses, {:.1%} hit ratio\n".format(name, hits, misses, ratio))
+
+
 if __name__ == "__main__":
     import argparse
     import sys
     import json
     import os.path
+    from itertools import chain
 
     parser = argparse.ArgumentParser(description='Parse input file (or stdin) in HEWMP notation and output JSON to file (or stdout)')
     parser.add_argument('infile', nargs='?', type=argparse.FileType('r'), default=sys.stdin)
@@ -1635,17 +2272,25 @@ if __name__ == "__main__":
     parser.add_argument('--override-channel-10', action='store_true')
     parser.add_argument('--midi-transpose', type=int, default=0)
     parser.add_argument('--track', type=int)
+    parser.add_argument('--mapping-cache', type=str, help='Directory for sharing tempered mappings between runs')
+    parser.add_argument('--profile', action='store_true', help='Report cache hit ratios to stderr')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes for parsing tracks')
+    parser.add_argument('--cache-dir', type=str, help='Trusted directory for reusing parse results of unchanged input')
     args = parser.parse_args()
 
-    patterns, config = parse_file(args.infile)
+    MAPPING_CACHE.path = args.mapping_cache
+
+    if args.jobs > 1 or args.cache_dir is not None:
+        patterns, config = parse_file(args.infile, workers=args.jobs, cache_dir=args.cache_dir)
+    else:
+        tracks = iter_tracks(args.infile)
+        global_track, config = next(tracks)
+        patterns = chain([global_track], (pattern for pattern, _ in tracks))
     if args.track is not None:
-        tracks = patterns
-        patterns = []
-        for index, track in enumerate(tracks):
-            if index == 0 or index == args.track:
-                patterns.append(track)
-    if args.infile is not sys.stdin:
-        args.infile.close()
+        patterns = (track for index, track in enumerate(patterns) if index == 0 or index == args.track)
+    if not args.fractional and not args.monzo:
+        # Only the textual formats can be written out track by track
+        patterns = list(patterns)
 
     file_extension = os.path.splitext(args.outfile.name)[-1].lower()
     export_midi = (args.midi or args.midi_et or file_extension == ".mid")
@@ -1698,6 +2343,11 @@ if __name__ == "__main__":
             simplify_tracks(result)
         json.dump(result, args.outfile)
 
+    if args.profile:
+        print_cache_statistics(config, sys.stderr)
+
+    if args.infile is not sys.stdin:
+        args.infile.close()
     if args.outfile is not sys.stdout:
         args.outfile.close()
     elif not args.fractional and not args.absolute:
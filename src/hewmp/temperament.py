@@ -1,13 +1,24 @@
-from numpy import array, dot, isclose, logical_or, zeros
-from numpy.linalg import norm
+from collections import OrderedDict
+from threading import RLock
+from fractions import Fraction
+from math import floor
+from numpy import array, dot, isclose, logical_or, zeros, concatenate
+from numpy.linalg import norm, lstsq
+from .parse_cache import JSONDiskCache
 
 
-def temper(just_mapping, comma_list, constraints, num_iterations=1000, step_size=0.5):
+def temper(just_mapping, comma_list, constraints, num_iterations=1000, step_size=0.5, method="direct"):
     """
     Temper out a given list of commas while keeping the constrained intervals pure if possible.
 
     The magnitude of the resulting mapping is arbitrary, but reasonably close to just intonation
+
+    The "direct" method solves for the fixed point of the "iterative" method in closed form.
     """
+    if method == "direct":
+        return temper_direct(just_mapping, comma_list, constraints)
+    if method != "iterative":
+        raise ValueError("Unknown tempering method '{}'".format(method))
     j_factors = [dot(constraint, just_mapping) for constraint in constraints]
 
     mapping = array(just_mapping)
@@ -22,6 +33,25 @@ def temper(just_mapping, comma_list, constraints, num_iterations=1000, step_size
     return mapping
 
 
+def temper_direct(just_mapping, comma_list, constraints):
+    """
+    Temper out a given list of commas while keeping the constrained intervals pure if possible.
+
+    The result is the mapping closest to just intonation that is orthogonal to the commas
+    and matches just intonation on the constraints i.e. just_mapping + commas*a + constraints*b
+    where the coefficients are found by solving a small linear system in the least squares sense.
+    """
+    just_mapping = array(just_mapping, dtype=float)
+    directions = [array(vector, dtype=float) for vector in list(comma_list) + list(constraints)]
+    if not directions:
+        return just_mapping
+    basis = array(directions).T
+    targets = concatenate([zeros(len(comma_list)), [dot(constraint, just_mapping) for constraint in constraints]])
+    gram = dot(basis.T, basis)
+    coefficients = lstsq(gram, targets - dot(basis.T, just_mapping), rcond=None)[0]
+    return just_mapping + dot(basis, coefficients)
+
+
 def minimax(just_mapping, mapping):
     """
     Scale the mapping to minimize the maximum error from just intonation.
@@ -38,7 +68,7 @@ def minimax(just_mapping, mapping):
     return best_mapping
 
 
-def temper_subgroup(just_mapping, comma_list, constraints, subgroup, num_iterations=1000, step_size=0.1, metric=None):
+def temper_subgroup(just_mapping, comma_list, constraints, subgroup, num_iterations=1000, step_size=0.1, metric=None, method="direct"):
     """
     Return a tempered version of just intonation where only the subgroup is affected
 
@@ -80,7 +110,7 @@ def temper_subgroup(just_mapping, comma_list, constraints, subgroup, num_iterati
     if not isclose(array([dot(subgroup_just_mapping, constraint) for constraint in constraints]), constraint_sizes).all():
         raise ValueError("Non-orthogonal subgroup or constraint outside subgroup")
 
-    subgroup_mapping = temper(subgroup_just_mapping, comma_list, constraints, num_iterations, step_size)
+    subgroup_mapping = temper(subgroup_just_mapping, comma_list, constraints, num_iterations, step_size, method=method)
     if not constraints:
         if constraint is None:
             if metric is not None:
@@ -100,6 +130,113 @@ def temper_subgroup(just_mapping, comma_list, constraints, subgroup, num_iterati
     return mapping
 
 
+def canonical_vector(vector):
+    """
+    Hashable form of a vector with integral components as ints and the rest as exact Fractions
+    """
+    result = []
+    for component in vector:
+        component = Fraction(component)
+        numerator, denominator = int(component.numerator), int(component.denominator)
+        result.append(numerator if denominator == 1 else Fraction(numerator, denominator))
+    return tuple(result)
+
+
+class MappingCache:
+    """
+    Least recently used cache of tempered mappings
+
+    Keys are tuples of the parameters that determine the mapping. If path is set the entries are also
+    stored in that directory as one JSON file per key so that other processes can reuse them.
+    The directory is bounded to max_bytes by removing the least recently used files.
+    The cache may be used from multiple threads. Mappings are computed outside of the lock.
+    """
+    def __init__(self, maxsize=256, path=None, max_bytes=16*1024*1024):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.path = path
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = RLock()
+
+    @property
+    def path(self):
+        return self._path
+
+    @path.setter
+    def path(self, value):
+        self._path = value
+        self.disk = None if value is None else JSONDiskCache(value, self.max_bytes)
+
+    def get(self, key, compute):
+        """
+        Mapping stored under the key. Calls compute() to produce it if not found.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return array(self.entries[key])
+        disk = self.disk
+        if disk is not None:
+            disk_key = disk.key(repr(key))
+            stored = disk.get(disk_key)
+            if stored is not None:
+                mapping = array(stored, dtype=float)
+                with self.lock:
+                    self.hits += 1
+                    self._insert(key, mapping)
+                return array(mapping)
+        with self.lock:
+            self.misses += 1
+        mapping = array(compute(), dtype=float)
+        self._insert(key, mapping)
+        if disk is not None:
+            disk.put(disk_key, list(map(float, mapping)))
+        return array(mapping)
+
+    def _insert(self, key, mapping):
+        with self.lock:
+            self.entries[key] = mapping
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def put(self, key, mapping):
+        """
+        Store a mapping that is already known
+        """
+        self._insert(key, array(mapping, dtype=float))
+
+    @staticmethod
+    def subgroup_key(just_mapping, comma_list, constraints, subgroup, metric=None):
+        return (
+            "subgroup",
+            tuple(map(float, just_mapping)),
+            tuple(map(canonical_vector, comma_list)),
+            tuple(map(canonical_vector, constraints)),
+            tuple(map(canonical_vector, subgroup)),
+            None if metric is None else tuple(map(float, metric)),
+        )
+
+    def temper_subgroup(self, just_mapping, comma_list, constraints, subgroup, metric=None):
+        """
+        Cached version of temper_subgroup using the direct method
+        """
+        key = self.subgroup_key(just_mapping, comma_list, constraints, subgroup, metric)
+        return self.get(key, lambda: temper_subgroup(just_mapping, comma_list, constraints, subgroup, metric=metric))
+
+
+# Shared by every track and parse in the process
+MAPPING_CACHE = MappingCache()
+
+
 def is_less_complex(pitch_a, pitch_b):
     """
     Compare pitches to see which one is expressed using smaller primes ignoring octaves
@@ -118,9 +255,210 @@ def is_less_complex(pitch_a, pitch_b):
     return False
 
 
+def complexity_key(pitch):
+    """
+    Sort key that orders pitches the same way as is_less_complex
+    """
+    indices = range(len(pitch) - 1, 0, -1)
+    return tuple(abs(pitch[i]) for i in indices) + tuple(pitch[i] < 0 for i in indices)
+
+
+def _integral_rows(comma_list):
+    """
+    Convert the commas to lists of ints or return None if some of them are not integral
+    """
+    result = []
+    for comma in comma_list:
+        row = [int(round(coord)) for coord in comma]
+        if any(coord != int_coord for coord, int_coord in zip(comma, row)):
+            return None
+        result.append(row)
+    return result
+
+
+def _echelon(rows, columns):
+    """
+    Bring integral rows to echelon form using unimodular row operations with pivots taken in the given column order.
+
+    Returns the pivot columns, the non-zero echelon rows and the transform from the original rows to the echelon rows.
+    The transform has more rows than the echelon form if the original rows were linearly dependent.
+    """
+    rows = [list(row) for row in rows]
+    transform = [[int(i == j) for j in range(len(rows))] for i in range(len(rows))]
+    pivots = []
+    top = 0
+    for column in columns:
+        while True:
+            active = [i for i in range(top, len(rows)) if rows[i][column]]
+            if not active:
+                break
+            smallest = min(active, key=lambda i: abs(rows[i][column]))
+            rows[top], rows[smallest] = rows[smallest], rows[top]
+            transform[top], transform[smallest] = transform[smallest], transform[top]
+            pivot = rows[top][column]
+            reduced = True
+            for i in range(top + 1, len(rows)):
+                quotient = rows[i][column] // pivot
+                if quotient:
+                    rows[i] = [a - quotient*b for a, b in zip(rows[i], rows[top])]
+                    transform[i] = [a - quotient*b for a, b in zip(transform[i], transform[top])]
+                if rows[i][column]:
+                    reduced = False
+            if reduced:
+                if pivot < 0:
+                    rows[top] = [-a for a in rows[top]]
+                    transform[top] = [-a for a in transform[top]]
+                pivots.append(column)
+                top += 1
+                break
+        if top == len(rows):
+            break
+    return pivots, rows[:top], transform
+
+
+def _lattice_minimum(pitch, rows, pivots):
+    """
+    Find the least complex pitch in the coset pitch + span(rows) of a lattice in echelon form.
+
+    Returns the multipliers of the echelon rows.
+    """
+    candidates = [([Fraction(coord) for coord in pitch], [])]
+    for row, pivot in zip(rows, pivots):
+        step = row[pivot]
+        next_candidates = []
+        for vector, multipliers in candidates:
+            below = floor(-vector[pivot] / step)
+            options = [below, below + 1]
+            low = abs(vector[pivot] + below*step)
+            high = abs(vector[pivot] + (below + 1)*step)
+            if low < high:
+                options = [below]
+            elif high < low:
+                options = [below + 1]
+            for multiplier in options:
+                next_vector = [coord + multiplier*delta for coord, delta in zip(vector, row)]
+                next_candidates.append((next_vector, multipliers + [multiplier]))
+        candidates = next_candidates
+    return min(candidates, key=lambda candidate: complexity_key(candidate[0]))[1]
+
+
+def _reduced_coefficients(pitch, comma_list, persistence):
+    """
+    Coefficients of the commas that make the pitch least complex using lattice reduction.
+
+    Returns None if the answer can't be guaranteed to match an exhaustive search within the persistence bound.
+    """
+    # Fractional coordinates pick up rounding errors in the exhaustive search so leave them to it
+    if not all(float(coord).is_integer() for coord in pitch):
+        return None
+    rows = _integral_rows(comma_list)
+    if rows is None:
+        return None
+    pivots, echelon_rows, transform = _echelon(rows, range(len(pitch) - 1, -1, -1))
+    # Linearly dependent commas or commas consisting of octaves only make the solution ambiguous
+    if len(echelon_rows) < len(rows) or (pivots and pivots[-1] == 0):
+        return None
+    multipliers = _lattice_minimum(pitch, echelon_rows, pivots)
+    coefficients = [sum(m*t[j] for m, t in zip(multipliers, transform)) for j in range(len(rows))]
+    if any(abs(coef) > persistence for coef in coefficients):
+        return None
+    return coefficients
+
+
+def _search_coefficients(pitch, comma_list, persistence, degree=None, keep_pitch=False):
+    """
+    Branch and bound search for the coefficients of the commas that make the pitch least complex.
+
+    Coefficients are bounded by the persistence. If a degree is given only candidates divisible by it are considered
+    and they're compared after division. Ties are broken in favor of the lexicographically smallest coefficients
+    or in favor of the pitch itself if keep_pitch is set. Returns the coefficients and the winning candidate.
+    """
+    num_commas = len(comma_list)
+    indices = range(len(pitch) - 1, 0, -1)
+
+    def evaluate(coefs):
+        candidate = pitch + 0
+        for coef, comma in zip(coefs, comma_list):
+            candidate += coef*comma
+        if degree is not None:
+            if not (candidate % degree == 0).all():
+                return None
+            candidate //= degree
+        return candidate
+
+    # Assign commas touching the highest primes first so that the most significant coordinates get fixed early
+    order = sorted(range(num_commas), key=lambda j: [-abs(comma_list[j][i]) for i in indices])
+    ranges = [[0.0] * len(pitch) for _ in range(num_commas + 1)]
+    for level in reversed(range(num_commas)):
+        comma = comma_list[order[level]]
+        ranges[level] = [r + persistence*abs(float(coord)) for r, coord in zip(ranges[level + 1], comma)]
+    # Fractional coordinates suffer from rounding so they can only be compared when clearly apart
+    exact = [float(pitch[i]).is_integer() for i in indices]
+    integral = all(exact) and float(pitch[0]).is_integer()
+    scale = 1 if degree is None else degree
+
+    best_key = None
+    best_rank = None
+    best_coefs = None
+    best_candidate = None
+    if keep_pitch:
+        best_candidate = pitch
+        best_key = complexity_key(pitch)
+        best_rank = ()
+
+    def is_hopeless(sums, level):
+        if degree is not None and integral:
+            for coord, span in zip(sums, ranges[level]):
+                if not span and coord % degree:
+                    return True
+        if best_key is None:
+            return False
+        for k, i in enumerate(indices):
+            bound = max(0.0, abs(sums[i]) - ranges[level][i]) / scale
+            best = float(best_key[k])
+            if bound > best + 1e-9:
+                return True
+            if bound < best - 1e-9 or not exact[k]:
+                return False
+        return False
+
+    def search(sums, coefs, level):
+        nonlocal best_key, best_rank, best_coefs, best_candidate
+        if level == num_commas:
+            ordered = [0] * num_commas
+            for j, coef in zip(order, coefs):
+                ordered[j] = coef
+            candidate = evaluate(ordered)
+            if candidate is None:
+                return
+            key = complexity_key(candidate)
+            rank = (1, tuple(ordered))
+            if best_key is None or key < best_key or (key == best_key and rank < best_rank):
+                best_key, best_rank, best_coefs, best_candidate = key, rank, ordered, candidate
+            return
+        comma = comma_list[order[level]]
+        branches = []
+        for coef in range(-persistence, persistence + 1):
+            next_sums = [s + coef*float(coord) for s, coord in zip(sums, comma)]
+            bounds = [max(0.0, abs(next_sums[i]) - ranges[level + 1][i]) for i in indices]
+            branches.append((bounds, coef, next_sums))
+        branches.sort(key=lambda branch: branch[0])
+        for _, coef, next_sums in branches:
+            if not is_hopeless(next_sums, level + 1):
+                search(next_sums, coefs + [coef], level + 1)
+
+    sums = [float(coord) for coord in pitch]
+    if not is_hopeless(sums, 0):
+        search(sums, [], 0)
+    return best_coefs, best_candidate
+
+
 def comma_reduce(pitch, comma_list, persistence=5, cache=None):
     """
     Express the pitch using as small primes as possible by adding commas from the list
+
+    The result matches an exhaustive search of coefficients up to the persistence in absolute value.
+    The exact least complex pitch is found using lattice reduction and the search only kicks in if it's out of bounds.
     """
     # Walk towards "zero"
     current = pitch
@@ -143,20 +481,15 @@ def comma_reduce(pitch, comma_list, persistence=5, cache=None):
         cache_key = tuple(current)
         if cache_key in cache:
             return array(cache[cache_key])
-    best = current
-    def combine(coefs):
-        nonlocal best
-        if len(coefs) == len(comma_list):
-            candidate = current + 0
-            for coef, comma in zip(coefs, comma_list):
-                candidate += coef*comma
-            if is_less_complex(candidate, best):
-                best = candidate
-            return
-        for i in range(-persistence, persistence+1):
-            combine(coefs + [i])
-
-    combine([])
+    coefficients = _reduced_coefficients(current, comma_list, persistence)
+    if coefficients is None:
+        _, best = _search_coefficients(current, comma_list, persistence, keep_pitch=True)
+    elif any(coefficients):
+        best = current + 0
+        for coef, comma in zip(coefficients, comma_list):
+            best += coef*comma
+    else:
+        best = current
     if cache is not None:
         cache[cache_key] = array(best)
     return best
@@ -172,24 +505,7 @@ def comma_root(pitch, degree, comma_list, persistence=5, cache=None):
     cache_key = (tuple(pitch), degree)
     if cache is not None and cache_key in cache:
         return cache[cache_key]
-    best = None
-    def combine(coefs):
-        nonlocal best
-        if len(coefs) == len(comma_list):
-            candidate = pitch + 0
-            for coef, comma in zip(coefs, comma_list):
-                candidate += coef*comma
-            if (candidate % degree == 0).all():
-                candidate //= degree
-            else:
-                return
-            if best is None or is_less_complex(candidate, best):
-                best = candidate
-            return
-        for i in range(-persistence, persistence+1):
-            combine(coefs + [i])
-
-    combine([])
+    _, best = _search_coefficients(pitch, comma_list, persistence, degree=degree)
     if cache is not None:
         if best is not None:
             cache[cache_key] = array(best)
@@ -228,7 +544,10 @@ if __name__ == "__main__":
     parser.add_argument('commas', nargs="+", type=str)
     parser.add_argument('--constraints', nargs="*", type=str)
     parser.add_argument('--subgroup', type=str)
+    parser.add_argument('--method', choices=["direct", "iterative"], default="direct")
+    parser.add_argument('--mapping-cache', type=str, help='Directory for sharing tempered mappings between runs')
     args = parser.parse_args()
+    MAPPING_CACHE.path = args.mapping_cache
 
     if args.commas[0] in TEMPERAMENTS:
         commas, subgroup = TEMPERAMENTS[args.commas[0]]
@@ -261,7 +580,10 @@ if __name__ == "__main__":
 
     JI = log(array(PRIMES))
 
-    mapping = temper_subgroup(JI, comma_list, constraints, basis_vectors, metric=DEFAULT_METRIC)
+    if args.method == "direct":
+        mapping = MAPPING_CACHE.temper_subgroup(JI, comma_list, constraints, basis_vectors, metric=DEFAULT_METRIC)
+    else:
+        mapping = temper_subgroup(JI, comma_list, constraints, basis_vectors, metric=DEFAULT_METRIC, method=args.method)
 
     for m, p in zip(mapping, PRIMES):
         if not isclose(m, log(p)):
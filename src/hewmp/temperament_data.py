@@ -0,0 +1,96 @@
+"""
+Precomputed data of the named temperaments
+
+Running this module rebuilds the data file:
+    python -m hewmp.temperament_data
+"""
+import json
+import os
+from threading import Lock
+from fractions import Fraction
+from numpy import array, log
+from .monzo import PRIMES
+from .temperaments import TEMPERAMENTS, ENHARMONICS
+from .temperament import MAPPING_CACHE
+from .event import DEFAULT_METRIC
+
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), "data", "temperaments.json")
+
+_data = None
+_data_lock = Lock()
+
+
+def load(path=DATA_PATH):
+    """
+    Load the data file replacing the current table. A missing file results in an empty table.
+    """
+    global _data
+    try:
+        with open(path) as fp:
+            _data = json.load(fp)
+    except (OSError, ValueError):
+        _data = {}
+    return _data
+
+
+def lookup(name):
+    """
+    Comma list, subgroup basis, suggested mapping and enharmonics of a named temperament
+
+    Returns None if the temperament isn't in the data file or if its entry is out of date.
+    The file is loaded on first use. The mapping is also stored in MAPPING_CACHE so that
+    tunings without constraints don't need to temper it again.
+    """
+    with _data_lock:
+        if _data is None:
+            load()
+    entry = _data.get(name)
+    if entry is None or name not in TEMPERAMENTS:
+        return None
+    comma_list, subgroup = TEMPERAMENTS[name]
+    if entry["source"] != [list(comma_list), subgroup]:
+        return None
+    result = {
+        "comma_list": [array(comma, dtype=float) for comma in entry["comma_list"]],
+        "subgroup": [array(basis_vector, dtype=float) for basis_vector in entry["subgroup"]],
+        "mapping": array(entry["mapping"], dtype=float),
+        "enharmonics": entry["enharmonics"],
+    }
+    key = MAPPING_CACHE.subgroup_key(log(array(PRIMES)), result["comma_list"], [], result["subgroup"], DEFAULT_METRIC)
+    MAPPING_CACHE.put(key, result["mapping"])
+    return result
+
+
+def build():
+    """
+    Compute the data of every temperament in TEMPERAMENTS the same way the parser would
+    """
+    from .parser import IntervalParser
+    from .temperament import temper_subgroup
+
+    interval_parser = IntervalParser()
+    JI = log(array(PRIMES))
+    result = {}
+    for name, (comma_list, subgroup) in TEMPERAMENTS.items():
+        basis = [interval_parser.parse(basis_vector).value().monzo.float_vector() for basis_vector in subgroup.split(".")]
+        commas = [interval_parser.parse(comma).value().monzo.float_vector() for comma in comma_list]
+        mapping = temper_subgroup(JI, commas, [], basis, metric=DEFAULT_METRIC)
+        key = frozenset(map(Fraction, comma_list))
+        result[name] = {
+            "source": [list(comma_list), subgroup],
+            "comma_list": [comma.tolist() for comma in commas],
+            "subgroup": [basis_vector.tolist() for basis_vector in basis],
+            "mapping": mapping.tolist(),
+            "enharmonics": ENHARMONICS.get(key, []),
+        }
+    return result
+
+
+if __name__ == "__main__":
+    data = build()
+    os.makedirs(os.path.dirname(DATA_PATH), exist_ok=True)
+    with open(DATA_PATH, "w") as fp:
+        json.dump(data, fp, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        fp.write("\n")
+    print("Wrote {} temperaments to {}".format(len(data), DATA_PATH))
@@ -252,7 +252,7 @@ if __name__ == "__main__":
     from numpy import log, array
     from .monzo import PRIMES
     from .event import DEFAULT_METRIC
-    from .temperament import temper_subgroup, infer_subgroup
+    from .temperament import MAPPING_CACHE, infer_subgroup
     from .parser import IntervalParser
     from .color import parse_comma
 
@@ -300,7 +300,7 @@ if __name__ == "__main__":
             basis = subgroup.split(".")
             basis = [interval_parser.parse(basis_vector).value().monzo.float_vector() for basis_vector in basis]
             commalist = [interval_parser.parse(comma).value().monzo.float_vector() for comma in comma_list]
-            mapping = temper_subgroup(JI, commalist, [], basis, metric=DEFAULT_METRIC)
+            mapping = MAPPING_CACHE.temper_subgroup(JI, commalist, [], basis, metric=DEFAULT_METRIC)
 
             rank = subgroup.count(".") - len(comma_list) + 1
             by_rank[rank].append((name, comma_list, subgroup, mapping))
@@ -342,7 +342,7 @@ if __name__ == "__main__":
     for name in interesting_pergens:
         monzos = [parse_comma(subname.strip()) for subname in name.split("&")]
         basis = infer_subgroup(monzos)
-        mapping = temper_subgroup(JI, monzos, [], basis, metric=DEFAULT_METRIC)
+        mapping = MAPPING_CACHE.temper_subgroup(JI, monzos, [], basis, metric=DEFAULT_METRIC)
 
         subgroup = []
         for base in basis:
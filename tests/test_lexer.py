@@ -1,5 +1,5 @@
 from io import StringIO
-from hewmp.lexer import Lexer
+from hewmp.lexer import Lexer, IncrementalLexer, Checkpoint
 
 
 def test_lexer():
@@ -60,5 +60,65 @@ def test_lexer():
         last_token = token
 
 
+def test_lexer_text_input():
+    text = "T:meantone $ comment\nQ:1/4=80\n---\n|: P1 M3- :|x3 $ trailing\nCL:81/80"
+    tokens = list(Lexer(text))
+    reference = list(Lexer(StringIO(text)))
+    assert [repr(token) for token in tokens] == [repr(token) for token in reference]
+    result = [token.value for token in tokens]
+    assert result == ["T:", "meantone ", "\n", "Q:", "1/4=80", "\n", "---", "\n", "|:", "P1", "M3-", ":|", "x3", "\n", "CL:", "81/80", None]
+    for token in tokens:
+        if token.value:
+            assert text[:token.index].endswith(token.value)
+
+
+def test_lexer_resume():
+    text = "T:meantone\nP1 \"a\nb\" M2\n---\nQ:1/4=80 $ comment\nP5"
+    lexer = Lexer(text)
+    next(lexer)
+    next(lexer)
+    checkpoint = lexer.checkpoint()
+    rest = list(lexer)
+    assert [repr(token) for token in Lexer.resume(text, checkpoint)] == [repr(token) for token in rest]
+
+
+def test_incremental_lexer():
+    text = "T:meantone\nP1 M2 $ comment\n---\nQ:1/4=80\n|: P1 M3 :|x3\nP5"
+    lexer = IncrementalLexer(text)
+    assert [repr(token) for token in lexer] == [repr(token) for token in Lexer(text)]
+
+    edits = [
+        (14, 16, "m3 P4"),  # Edit within a line
+        (0, 0, "$ Header\n"),  # Insert a line before everything
+        (20, 20, "\"open string\n"),  # Unterminated string swallows the rest
+        (20, 21, ""),  # Close it again
+        (0, len(lexer.text), "P1\n"),
+    ]
+    for start, end, replacement in edits:
+        num_relexed = lexer.edit(start, end, replacement)
+        assert [repr(token) for token in lexer] == [repr(token) for token in Lexer(lexer.text)]
+    assert num_relexed == 2
+
+    lexer = IncrementalLexer("P1\n" * 1000)
+    assert lexer.edit(1501, 1502, "2") == 1
+    assert [token.value for token in lexer][1000:1002] == ["P2", "\n"]
+    assert repr(lexer.checkpoints()[500]) == repr(Checkpoint(1500, 1500, 500, 0, True, False, False, False))
+
+    # Offsets stay correct while shifts are pending and after they're applied
+    text = "P1 M2\n" * 100
+    lexer = IncrementalLexer(text)
+    for index in range(2 * IncrementalLexer.MAX_SHIFTS):
+        position = (index * 37) % len(text)
+        replacement = "\n" if index % 3 else "m3 "
+        lexer.edit(position, position + index % 2, replacement)
+        text = text[:position] + replacement + text[position + index % 2:]
+        assert [repr(token) for token in lexer][-20:] == [repr(token) for token in Lexer(text)][-20:]
+    assert lexer.text == text
+    assert [repr(token) for token in lexer] == [repr(token) for token in Lexer(text)]
+
+
 if __name__ == "__main__":
     test_lexer()
+    test_lexer_text_input()
+    test_lexer_resume()
+    test_incremental_lexer()
@@ -1,8 +1,10 @@
 from fractions import Fraction
+from io import StringIO
 from numpy import array, dot, isclose, exp, log
-from hewmp.parser import parse_text, IntervalParser, DEFAULT_INFLECTIONS, Note, sync_playheads, Percussion, Tuning, ProgramChange
+from hewmp.parser import parse_text, parse_file, iter_tracks, ParsingError, realize, realize_tables, EventTable, RepeatedSection, RepeatPattern, IntervalParser, DEFAULT_INFLECTIONS, Note, sync_playheads, Percussion, Tuning, ProgramChange, tracks_to_midi, SemiMonzo, PRIMES, patterns_to_fractions, patterns_to_monzos
 from hewmp.notation import tokenize_pitch, reverse_inflections, tokenize_interval
 from hewmp.temperaments import ENHARMONICS
+from hewmp.event import PRUNED, Pattern, Dynamic, Articulation
 
 
 def get_notes(text):
@@ -15,6 +17,10 @@ def get_real_notes(text):
     return [note for note in pattern.realize() if isinstance(note, Note)]
 
 
+def realize_json(patterns):
+    return [pattern.to_json() for pattern in realize(patterns)]
+
+
 def expect_pitches(notes, pitches):
     assert len(notes) == len(pitches)
     for note, expected in zip(notes, pitches):
@@ -1262,6 +1268,465 @@ def test_ties_into_tuplets():
         assert notes[i].duration == times_durations[i][1]
 
 
+def test_non_seekable_input():
+    class Pipe:
+        def __init__(self, text):
+            self.text = text
+            self.position = 0
+
+        def read(self, size=-1):
+            if size < 0:
+                size = len(self.text)
+            result = self.text[self.position:self.position + size]
+            self.position += len(result)
+            return result
+
+        def seekable(self):
+            return False
+
+    text = "Q:1/4=100\n---\n" + "P1 . . . . M2\n" * 400 + "---\nN:percussion\n" + "k.s.\n" * 1000
+    pipe = Pipe(text)
+    tracks = iter_tracks(pipe)
+    global_track, _ = next(tracks)
+    first_track, _ = next(tracks)
+    assert pipe.position < len(text)
+    last_track, _ = next(tracks)
+    assert pipe.position == len(text)
+
+    patterns, _ = parse_file(Pipe(text))
+    reference, _ = parse_text(text)
+    assert len(patterns) == len(reference) == 3
+    assert realize_json(patterns) == realize_json(reference)
+    assert realize_json([global_track, first_track, last_track]) == realize_json(reference)
+
+
+def test_section_repeats():
+    sections = [
+        ("|: P1 M2 :|x3", "P1 M2 P1 M2 P1 M2", True),
+        ("M3 |: P1 M2 :| [2] P5", "M3 P1 M2 P1 M2 [2] P5", True),
+        ("|: P1 M2 :|x4 ! P5", "P1 M2 P1 M2 P1 M2 P1 M2 ! P5", True),
+        ("|: (P1 M2)[2] =M :|x3 %", "(P1 M2)[2] =M (P1 M2)[2] =M (P1 M2)[2] =M %", True),
+        ("|: P1 | M2 \n m3+ :|x2", "P1 | M2 \n m3+ P1 | M2 \n m3+", True),
+        ("|: P1 M2 { p f } :|x2", "P1 M2 { p f } P1 M2 { p f }", True),
+        ("|: ~M2 :|x3", "~M2 ~M2 ~M2", False),
+        ("P1 |: ! M2 :|x3", "P1 ! M2 ! M2 ! M2", False),
+        ("|: P1 :|x0 M2", "M2", False),
+        ("|: P1 M2 :|x1", "P1 M2", True),
+        ("|: C4 M2 :|x2", "C4 M2 C4 M2", False),
+        ("|: P1 C4 :|x2", "P1 C4 P1 C4", False),
+        ("N:percussion\n|: k.s. :|x4", "N:percussion\nk.s. k.s. k.s. k.s.", True),
+    ]
+    for repeated, written_out, lazy in sections:
+        patterns = parse_text(repeated)[0]
+        assert realize_json(patterns) == realize_json(parse_text(written_out)[0])
+        assert any(isinstance(subpattern, RepeatedSection) for subpattern in patterns[0]) == (lazy and "x1" not in repeated)
+
+
+def test_lazy_repeats():
+    repeats = [
+        ("(P1 M2 M3)[x3] P5", "(P1 M2 M3 P1 M2 M3 P1 M2 M3) P5", True),
+        ("(P1 M2)[X2] P5", "(P1 M2 P1 M2)[*2] P5", True),
+        ("(P1 M2 M3)[x3 R]", "(P1 M2 M3 P1 M2 M3 P1 M2 M3)[R]", True),
+        ("(P1 M2 [2] M3)[x2 r]", "(P1 M2 [2] M3 P1 M2 [2] M3)[r]", True),
+        ("(P1 M2 M3)[x2 <]", "(P1 M2 M3 P1 M2 M3)[<]", True),
+        ("(P1 M2 [2] M3)[x3 >>]", "(P1 M2 [2] M3 P1 M2 [2] M3 P1 M2 [2] M3)[>>]", True),
+        ("(P1 M2 [2] M3)[x2 v]", "(P1 M2 [2] M3 P1 M2 [2] M3)[v]", True),
+        ("(P1 M2 M3)[x2 ^^ R]", "(P1 M2 M3 P1 M2 M3)[^^ R]", True),
+        ("(P1 M2)[x2 !1] P5", "(P1 M2 P1 M2)[!1] P5", True),
+        ("(P1 M2)[x2 x3]", "(P1 M2 P1 M2 P1 M2 P1 M2 P1 M2 P1 M2)", True),
+        ("(P1 M2)[x2 R x2]", "(P1 M2 P1 M2)[R x2]", True),
+        ("(P1 M2 M3)[x2 E5]", "(P1 M2 M3 P1 M2 M3)[E5]", False),
+        ("(P1 M2 M3)[x2 ?]", "(P1 M2 M3 P1 M2 M3)[?]", False),
+        ("(P1,M3 M2)[x2 <]", "(P1,M3 M2 P1,M3 M2)[<]", False),
+        ("(P1 M2){p f}[x2] M3", "(P1 M2 P1 M2){p f} M3", True),
+        ("N:percussion\n(k.s.)[x4]", "N:percussion\n(k.s.k.s.k.s.k.s.)", True),
+    ]
+    for repeated, written_out, lazy in repeats:
+        patterns = parse_text(repeated)[0]
+        assert realize_json(patterns) == realize_json(parse_text(written_out)[0])
+        assert any(isinstance(subpattern, RepeatPattern) and subpattern.num_repeats > 1 for subpattern in patterns[0]) == lazy
+
+
+def test_nested_flatten():
+    text = "((P1 M2){pp ff} (P5 (M6 m7){' _})[x2]){p f} P8"
+    pattern = parse_text(text)[0][0]
+    events = pattern.iter_flat()
+    assert next(events).time == 0
+    notes = [event for event in pattern.flatten() if isinstance(event, Note)]
+    assert [note.time for note in notes] == [0, Fraction(1, 4), Fraction(1, 2), Fraction(5, 8), Fraction(11, 16), Fraction(3, 4), Fraction(7, 8), Fraction(15, 16), 1]
+    assert [note.duration for note in notes] == [Fraction(1, 4)] * 2 + [Fraction(1, 8), Fraction(1, 16), Fraction(1, 16)] * 2 + [1]
+    # The outermost envelope wins
+    assert isclose(notes[0].velocity, 1/3)
+    assert notes[0].velocity < notes[1].velocity < notes[2].velocity
+    assert notes[-1].velocity is None
+    # Envelopes inside repeats are dropped like in written out copies
+    assert [note.gate_ratio for note in notes] == [None] * 9
+
+
+def test_event_table():
+    text = "I:Steel Drums\nP1 M2[2] f P5,M3\n---\nN:percussion\nk.s.!h."
+    patterns = parse_text(text)[0]
+    tables = realize_tables(patterns)
+    for pattern, table in zip(realize(patterns), tables):
+        assert len(table) == len(pattern.events)
+        expected = pattern.to_json()
+        # Velocities and gate ratios of notes and percussion are stored as floats
+        for event in expected["events"]:
+            if event["type"] in ["note", "percussion"]:
+                event["velocity"] = str(float(Fraction(event["velocity"])))
+                event["gateRatio"] = str(float(Fraction(event["gateRatio"])))
+        assert table.to_pattern().to_json() == expected
+    assert tables[0].velocities.dtype == float
+    notes = tables[0].kinds == EventTable.NOTE
+    assert notes.sum() == 4
+    assert isclose(tables[0].real_frequencies[notes][0], 440)
+    assert list(tables[0].times[notes]) == [0, 1, 3, 3]
+    assert isinstance(tables[0].extras[4], ProgramChange)
+    percussion = tables[1].kinds == EventTable.PERCUSSION
+    assert list(tables[1].names[percussion]) == ["Acoustic Bass Drum", "Acoustic Snare", "Closed Hi-hat"]
+    assert (tables[1].real_gate_lengths[percussion] > 0).all()
+
+
+def test_vectorized_real_time():
+    tempo = parse_text("G:3/8=2 3 3\nP1")[1]["tempo"]
+    times = [Fraction(n, 7) for n in range(30)]
+    durations = [Fraction(n % 4, 3) for n in range(30)]
+    real_times, real_durations = tempo.to_real_times(times, durations)
+    for time, duration, real_time, real_duration in zip(times, durations, real_times, real_durations):
+        assert (real_time, real_duration) == tempo.to_real_time(time, duration)
+
+
+def test_mid_track_tempo_change():
+    text = """
+    Q:1/4=60
+    P1 M2 M3
+    Q:1/4=120
+    P4 P5
+    """
+    pattern = parse_text(text)[0][0]
+    notes = [event for event in pattern.realize().events if isinstance(event, Note)]
+    assert [note.real_time for note in notes] == [0, 1, 2, 3, 3.5]
+    assert [note.real_duration for note in notes] == [1, 1, 1, 0.5, 0.5]
+
+    midi = tracks_to_midi([pattern])
+    tempi = [message.tempo for message in midi.tracks[0] if message.type == "set_tempo"]
+    assert tempi == [1000000, 500000]
+    real_time = 0
+    note_ons = []
+    for message in midi:
+        real_time += message.time
+        if message.type == "note_on":
+            note_ons.append(real_time)
+    assert isclose(note_ons, [0, 1, 2, 3, 3.5]).all()
+
+
+def test_integer_monzo():
+    half_comma = SemiMonzo([Fraction(-19, 2), Fraction(12, 2)] + [0] * (len(PRIMES) - 2))
+    assert list(half_comma.float_vector()[:2]) == [-9.5, 6.0]
+    assert half_comma * 2 == SemiMonzo(Fraction(531441, 524288))
+    assert (half_comma + half_comma).fraction() == Fraction(531441, 524288)
+
+    huge = half_comma * 2**40
+    assert huge.vector[0] == -19 * 2**39
+    assert huge / 2**40 == half_comma
+
+    pitch = SemiMonzo(Fraction(3, 2))
+    pitch.vector[0] += 1
+    assert pitch.fraction() == 3
+    pitch.add_to_component(1, -1)
+    assert pitch.fraction() == 1
+
+
+def test_map_many():
+    text = """
+    T:meantone
+    M3 P5 ~M2 2 5/4 15c 3Hz
+    """
+    pattern = parse_text(text)[0][0]
+    mapping = parse_text(text)[1]["tuning"].suggested_mapping
+    pitches = [note.pitch for note in pattern if isinstance(note, Note)]
+    frequencies = mapping.map_pitches(pitches)
+    assert len(frequencies) == 7
+    for pitch, frequency in zip(pitches, frequencies):
+        assert frequency == mapping(pitch)
+    realized = [event.real_frequency for event in pattern.realize().events if isinstance(event, Note)]
+    assert realized == list(frequencies)
+
+
+def test_interned_pitches():
+    notes = get_notes("M2 P1 M2 (M2 M2)")
+    assert notes[0].pitch is notes[2].pitch
+    assert notes[0].pitch is notes[3].pitch
+    assert notes[0].pitch == notes[4].pitch
+    assert hash(notes[0].pitch) == hash(notes[4].pitch)
+    assert notes[0].pitch != notes[1].pitch
+
+    pattern = parse_text("=M")[0][0]
+    root = get_notes("P1")[0].pitch
+    fifth = get_notes("P5")[0].pitch
+    pattern.transpose(fifth - root)
+    notes = [note for note in pattern.flatten() if isinstance(note, Note)]
+    assert notes[0].pitch is fifth
+    assert root == get_notes("P1")[0].pitch
+
+
+def test_repeated_voicing_tone():
+    notes = get_notes("=M_1R131")
+    pitches = [[0], [-5, 4], [-1, 1], [1], [2], [-1]]
+    expect_pitches(notes, pitches)
+
+
+def test_interval_parser_cache():
+    interval_parser = IntervalParser()
+    up = interval_parser.parse("^M2")
+    assert interval_parser.parse("^M2") is up
+    assert interval_parser.cache.hits == 1 and interval_parser.cache.misses == 1
+
+    interval_parser.et_divisions = Fraction(22)
+    interval_parser.calculate_up_down()
+    assert interval_parser.parse("^M2") is not up
+    assert interval_parser.parse("^M2").value() != up.value()
+
+    text = "ET:12\n^M2\nET:19\n^M2"
+    notes = get_notes(text)
+    assert notes[0].pitch != notes[1].pitch
+
+
+def test_chord_cache():
+    interval_parser = IntervalParser()
+    major = interval_parser.chord_intervals("M_1")
+    assert interval_parser.chord_intervals("M_1") is major
+    assert interval_parser.chord_cache.hits == 1
+
+    notes = get_notes("=M ~P5 =M_1 =M_1")
+    expect_pitches(notes, [[0], [-6, 4], [-1, 1], [-1, 1], [-1, 1], [-8, 5], [-3, 2], [-1, 1], [-8, 5], [-3, 2]])
+
+    notes = get_notes("ET:12\n=^M\nET:19\n=^M")
+    assert notes[1].pitch != notes[4].pitch
+
+
+def test_parallel_parsing():
+    text = "BN:C4\nQ:1/4=120\nG:1/4=2 1\n---\n" + "P1 M2[2] m3 =M_1\n" * 20 + "---\nET:19\n^M2 ^P5\n---\n^M2 ~P5\n---\nT:meantone\nM3 \"x---y\"\n---\nN:percussion\nk.s.\n"
+    patterns, config = parse_text(text, workers=3)
+    reference, reference_config = parse_text(text)
+    assert len(patterns) == len(reference) == 6
+    assert realize_json(patterns) == realize_json(reference)
+    assert config["tuning"].base_frequency == reference_config["tuning"].base_frequency
+    notes = [event for event in patterns[1].flatten() if isinstance(event, Note)]
+    assert notes[0].pitch == notes[6].pitch
+    assert notes[0].pitch is notes[6].pitch
+
+
+def test_parallel_parsing_error():
+    text = "---\nP1\n---\n|: P1\n---\nP2"
+    try:
+        parse_text(text, workers=2)
+        assert False
+    except ParsingError as error:
+        assert "Missing" in str(error)
+
+
+def test_interval_parser_carries_over_tracks():
+    from hewmp.parser import parse_incremental
+
+    patterns, _ = parse_text("---\nET:19\n^M2\n---\n^M2")
+    notes = [[event for event in pattern.flatten() if isinstance(event, Note)][0] for pattern in patterns[1:]]
+    assert notes[0].pitch == notes[1].pitch
+
+    tracks = ["BN:C4", "^M2 P5", "ET:19\n^M2", "^M2 P5", "E:vvm2\n^M2", "^M2 P5"]
+    text = "\n---\n".join(tracks)
+    reference = realize_json(parse_text(text)[0])
+    assert realize_json(parse_text(text, workers=2)[0]) == reference
+    notes = [[event for event in pattern.flatten() if isinstance(event, Note)][0] for pattern in parse_text(text)[0][1:]]
+    assert notes[0].pitch != notes[2].pitch
+    assert notes[1].pitch == notes[2].pitch
+
+    result = parse_incremental(text)
+    assert realize_json(result.patterns) == reference
+    assert result.independent == [True, True, False, False, False, False]
+    tracks[2] = "ET:22\n^M2"
+    text = "\n---\n".join(tracks)
+    updated = parse_incremental(text, result)
+    assert updated.reused == [0, 1]
+    assert realize_json(updated.patterns) == realize_json(parse_text(text)[0])
+
+
+def test_concurrent_parsing():
+    from concurrent.futures import ThreadPoolExecutor
+
+    texts = [
+        "T:barbados\nS:P8 P4/2 9\nBF:1000\nA5 B5 C5 D5 E5 F5 G5 H5 J5 A6",
+        "S:4 5 6\nP1 a2+ M3+\n---\nS:4 5 6\nP1 P2 M3+",
+        "E:vvm2\n~-P4/2 ^M2 vm3\n---\nET:19\n=^M_1 ^M2",
+        "T:meantone\nQ:1/4=100\nP1 M2 M3 =M7_1\n---\nN:percussion\nk.s.",
+        "BN:C4\nET:22\n^M2 vM3 ^P5\n---\nP1 M2[2] m3",
+    ]
+    def parse(index):
+        patterns = parse_text(texts[index % len(texts)])[0]
+        # The exporters read the pitches that are shared between parses
+        fractions = StringIO()
+        patterns_to_fractions(patterns, fractions)
+        monzos = StringIO()
+        patterns_to_monzos(patterns, monzos)
+        return realize_json(patterns), fractions.getvalue(), monzos.getvalue()
+
+    reference = [parse(index) for index in range(len(texts))]
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(parse, range(50)))
+
+    for index, result in enumerate(results):
+        assert result == reference[index % len(texts)]
+
+
+def test_disk_cache():
+    import os
+    from tempfile import TemporaryDirectory
+    from hewmp.parse_cache import DiskCache
+
+    text = "BN:C4\nQ:1/4=90\nG:1/4=2 1\n---\nP1 M2 =M_1\n---\nN:percussion\nk.s."
+    reference = realize_json(parse_text(text)[0])
+    with TemporaryDirectory() as directory:
+        cache = DiskCache(directory)
+        patterns, _ = parse_text(text, cache_dir=cache)
+        assert cache.misses == 1 and not cache.hits
+        patterns, config = parse_text(text, cache_dir=cache)
+        assert cache.hits == 1
+        assert realize_json(patterns) == reference
+        assert config["tempo"].groove_pattern is not None
+
+        key = cache.key(text, None)
+        with open(cache.path(key), "wb") as fp:
+            fp.write(b"garbage")
+        assert cache.get(key) is None
+        assert realize_json(parse_text(text, cache_dir=directory)[0]) == reference
+
+        cache.max_bytes = os.path.getsize(cache.path(key))
+        parse_text("P1 M2", cache_dir=cache)
+        assert len(cache.entries()) == 1
+        assert os.path.exists(cache.path(cache.key("P1 M2", None)))
+
+
+def test_incremental_parsing():
+    from hewmp.parser import parse_incremental
+
+    tracks = ["BN:C4\nQ:1/4=90", "P1 M2 =M_1", "N:percussion\nk.s.", "ET:19\n^M2 ^P5", "P1 M2 =M_1"]
+    result = parse_incremental("\n---\n".join(tracks))
+    assert result.reused == []
+    assert realize_json(result.patterns) == realize_json(parse_text("\n---\n".join(tracks))[0])
+
+    tracks[3] = "ET:19\n^M2 vP5"
+    tracks.append("M3 P5")
+    text = "\n---\n".join(tracks)
+    updated = parse_incremental(text, result)
+    # The old last track had no trailing newline so it is parsed again
+    assert updated.reused == [0, 1, 2]
+    assert updated.patterns[2] is result.patterns[2]
+    assert updated.patterns[1] is not updated.patterns[4]
+    patterns, config = updated
+    reference, reference_config = parse_text(text)
+    assert realize_json(patterns) == realize_json(reference)
+
+    tracks[0] = "BN:D4\nQ:1/4=90"
+    text = "\n---\n".join(tracks)
+    updated = parse_incremental(text, updated)
+    assert updated.reused == []
+    assert realize_json(updated.patterns) == realize_json(parse_text(text)[0])
+
+
+def test_realize_shared_flatten():
+    text = "Q:1/4=100\nP1 |> M2 (m3 P4){p f} >| P5\n---\nQ:1/4=50\nP1 M2 |> m3 P4 >| P5"
+    patterns, _ = parse_text(text)
+    reference = []
+    for pattern, (start_time, end_time) in zip(patterns, sync_playheads(patterns)):
+        reference.append(pattern.realize(start_time=start_time, end_time=end_time).to_json())
+    patterns, _ = parse_text(text)
+    assert realize_json(patterns) == reference
+
+
+def test_windowed_realization():
+    texts = [
+        "Q:1/4=120\n" + "(P1 M2 (m3 P4) P5)[2]{p f} =M_1 ~P5 m7[1/2] | " * 6,
+        "(P1 M2 T! T!)(M3 !)(P5 T!)[3] (P1 (M2 ! m3){p f} T!) P5 !!!",
+        "P1 @T9 ~P8 @T6*5/7 ~P8 (M2 M3) (P4 T!)",
+        "P1[@2] P8[@0] (M2 M3)[@5] (P4 !)",
+        "I:Violin\nP1 M2 m3\nV:1/2\nm3 P4 (P5 T!) M2\nWF:sine\nP5 M3\nADSR:1 2 3 4\n(M2 !) T! P1 (m3 !) ; P5 M2 f P4",
+        "P1 @T9 T!",
+        "P1 @T9 (T! ! M2) . T!",
+        "P1 P5 f ( {p f} ) [1/2] ( ! m3 )",
+    ]
+    for text in texts:
+        pattern = parse_text(text)[0][0]
+        for start_time in [Fraction(n, 2) for n in range(-2, 2*int(pattern.end_time) + 4)]:
+            for end_time in [start_time, start_time + Fraction(5, 2), None]:
+                windowed = pattern.realize(start_time, end_time).to_json()
+                full = pattern.realize(start_time, end_time, flat=pattern.flatten()).to_json()
+                assert windowed == full
+    pattern = parse_text(texts[0])[0][0]
+    assert PRUNED in list(pattern.iter_flat(Fraction(8), Fraction(10)))
+
+    # Ties extend the note even when they're outside of the window
+    notes = [event for event in parse_text("P1 @T9 T!")[0][0].realize(0, Fraction(5, 2)) if isinstance(event, Note)]
+    assert notes[0].duration == 2
+
+    # The state before an empty window is only restored if an event is in it
+    pattern = parse_text("P1 P5 f ( {p f} ) [1/2] ( ! m3 )")[0][0]
+    assert not [event for event in pattern.realize(2, 2) if isinstance(event, (Dynamic, Articulation))]
+
+    # Control events after the playhead still apply to notes moved before it
+    texts = [
+        "---\n_ . . . . (M3 ') @T M2 >|",
+        "---\n_ . . . . (M3 pp) @T M2 >|",
+        "---\n_ . . . . (M3 pp ') (M2)[@0] >|",
+        "---\n=M7-[1/2 3] % (@P1 ~m2)[r !2] (~-M2 ~9/8)[< R] (; ') (C4)[@2 3] >|",
+    ]
+    expected = [(Fraction(1, 2), Fraction(2, 3)), (1, Fraction(1, 4)), (Fraction(1, 2), Fraction(1, 4)), (Fraction(1, 2), Fraction(2, 3))]
+    for text, (gate_ratio, velocity) in zip(texts, expected):
+        notes = [event for event in realize(parse_text(text)[0])[1] if isinstance(event, Note)]
+        assert notes[-1].gate_ratio == gate_ratio
+        assert notes[-1].velocity == velocity
+
+
+def test_reading_repeats_stays_lazy():
+    pattern = parse_text("(P1 M2)[x1000] M3")[0][0]
+    repeated = [subpattern for subpattern in pattern if isinstance(subpattern, RepeatPattern)][0]
+    assert len(repeated) == 2000
+    assert len(list(repeated)) == 2000
+    assert not repeated.is_chord()
+    assert repeated.num_repeats == 1000
+    assert len(repeated.body) == 2
+
+    pattern = [subpattern for subpattern in parse_text("(P1 M2 M3)")[0][0] if isinstance(subpattern, Pattern)][0]
+    expected = [note.time for note in get_notes("(P1 M2 M3 P1 M2 M3 P1 M2)")]
+    pattern.fill(8)
+    assert isinstance(pattern[0], RepeatPattern)
+    assert pattern.logical_duration == 8
+    assert [note.time for note in pattern.flatten()] == expected
+
+    # Like written out copies the repeated subpatterns don't keep their envelopes
+    notes = [event for event in realize(parse_text("((P1 M2){p f} f)[x2]")[0])[0] if isinstance(event, Note)]
+    assert [note.velocity for note in notes] == [Fraction(2, 3), Fraction(2, 3), Fraction(3, 4), Fraction(3, 4)]
+
+
+def test_interned_monzos_are_frozen():
+    note = get_notes("M3")[0]
+    vector = note.pitch.monzo.vector
+    try:
+        vector[0] += 1
+        assert False
+    except ValueError:
+        pass
+    try:
+        note.pitch.monzo.vector = vector
+        assert False
+    except ValueError:
+        pass
+    copy = note.pitch.copy()
+    copy.monzo.vector[0] += 1
+    assert copy.monzo.vector[0] == vector[0] + 1
+    assert get_notes("M3")[0].pitch.monzo.vector[0] == vector[0]
+
+
 if __name__ == '__main__':
     test_parse_interval()
     test_parse_higher_prime()
@@ -1358,3 +1823,26 @@ if __name__ == '__main__':
     test_flavor_chord_multiplicity()
     # test_percussion_with_dynamics()
     test_ties_into_tuplets()
+    test_non_seekable_input()
+    test_section_repeats()
+    test_lazy_repeats()
+    test_nested_flatten()
+    test_event_table()
+    test_vectorized_real_time()
+    test_mid_track_tempo_change()
+    test_integer_monzo()
+    test_map_many()
+    test_interned_pitches()
+    test_repeated_voicing_tone()
+    test_interval_parser_cache()
+    test_chord_cache()
+    test_parallel_parsing()
+    test_parallel_parsing_error()
+    test_interval_parser_carries_over_tracks()
+    test_concurrent_parsing()
+    test_disk_cache()
+    test_incremental_parsing()
+    test_realize_shared_flatten()
+    test_windowed_realization()
+    test_reading_repeats_stays_lazy()
+    test_interned_monzos_are_frozen()
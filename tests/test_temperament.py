@@ -1,5 +1,12 @@
+from fractions import Fraction
 from numpy import array, dot, isclose, log
-from hewmp.temperament import temper, temper_subgroup, comma_reduce, comma_root, minimax
+import os
+import tempfile
+from hewmp.temperament import temper, temper_subgroup, comma_reduce, comma_root, minimax, MappingCache
+from hewmp.temperaments import TEMPERAMENTS
+from hewmp.monzo import fraction_to_monzo, PRIMES
+from hewmp.event import DEFAULT_METRIC
+from hewmp import temperament_data
 
 
 if __name__ == '__main__':
@@ -32,6 +39,67 @@ if __name__ == '__main__':
     barbados = temper_subgroup(JI, [island_comma], [], subgroup_2_3_13_per_15)
     assert(isclose(dot(barbados, island_comma), 0))
 
+    for method in ["direct", "iterative"]:
+        candidate = temper(JI[:3], [syntonic_comma], [octave, third], method=method)
+        assert(isclose(candidate, quarter_comma_meantone).all())
+
+    JI = log(array(PRIMES))
+    for comma_list, subgroup in TEMPERAMENTS.values():
+        comma_list = [fraction_to_monzo(comma)[0] for comma in comma_list]
+        subgroup = [fraction_to_monzo(basis_vector)[0] for basis_vector in subgroup.split(".")]
+        direct = temper_subgroup(JI, comma_list, [], subgroup, metric=DEFAULT_METRIC, method="direct")
+        iterative = temper_subgroup(JI, comma_list, [], subgroup, metric=DEFAULT_METRIC, method="iterative")
+        assert(isclose(direct, iterative).all())
+
     assert (comma_reduce(array([1, -2, 1]), [syntonic_comma]) == array([-3, 2, 0])).all()
 
     assert (comma_root(array([0, 0, 1]), 4, [syntonic_comma]) == array([-1, 1, 0])).all()
+
+    jovial = [fraction_to_monzo(comma)[0][:6].astype(float) for comma in ["243/242", "364/363", "441/440"]]
+    pitch = array([Fraction(coord) for coord in [3, -2, 4, -3, 2, 1]])
+    assert (comma_reduce(pitch, jovial) == array([-6, 8, 2, 0, 0, 0])).all()
+    assert (comma_root(array([0, 0, 0, 0, 2.0, 0]), 2, jovial) == array([-3, 2, -1, 2, 0, 0])).all()
+
+    # Fractional coordinates are left alone
+    pitch = array([Fraction(1, 2), Fraction(0), Fraction(1, 3)])
+    assert (comma_reduce(pitch, [syntonic_comma]) == array([Fraction(1, 2), Fraction(0), Fraction(1, 3)])).all()
+
+    subgroup_2_3_5 = [array([1, 0, 0]), array([0, 1, 0]), array([0, 0, 1])]
+    cache = MappingCache(maxsize=2)
+    meantone = cache.temper_subgroup(JI[:3], [syntonic_comma], [], subgroup_2_3_5)
+    assert (cache.temper_subgroup(JI[:3], [syntonic_comma.astype(float)], [], subgroup_2_3_5) == meantone).all()
+    assert cache.hits == 1 and cache.misses == 1
+    cache.get("a", lambda: [1.0])
+    cache.get("b", lambda: [2.0])
+    cache.temper_subgroup(JI[:3], [syntonic_comma], [], subgroup_2_3_5)
+    assert cache.misses == 4
+
+    with tempfile.TemporaryDirectory() as directory:
+        MappingCache(path=directory).temper_subgroup(JI[:3], [syntonic_comma], [], subgroup_2_3_5)
+        cache = MappingCache(path=directory)
+        assert (cache.temper_subgroup(JI[:3], [syntonic_comma], [], subgroup_2_3_5) == meantone).all()
+        assert cache.hits == 1 and cache.misses == 0
+
+        # Writers that started from the same state don't lose each other's entries
+        writers = [MappingCache(path=directory) for _ in range(4)]
+        for index, writer in enumerate(writers):
+            writer.get(("writer", index), lambda: [float(index)])
+        cache = MappingCache(path=directory)
+        for index in range(4):
+            assert cache.get(("writer", index), lambda: [-1.0]) == [float(index)]
+        assert cache.misses == 0
+
+        # The directory is kept within its size bound
+        cache = MappingCache(path=directory, max_bytes=1000)
+        for index in range(100):
+            cache.get(("bounded", index), lambda: [float(index)] * 10)
+        assert sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)) <= 1000
+
+    # The shipped data file is up to date
+    for name, entry in temperament_data.build().items():
+        data = temperament_data.lookup(name)
+        assert data is not None
+        assert (array(entry["comma_list"]) == array(data["comma_list"])).all()
+        assert (array(entry["subgroup"]) == array(data["subgroup"])).all()
+        assert isclose(entry["mapping"], data["mapping"]).all()
+        assert entry["enharmonics"] == data["enharmonics"]